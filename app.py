@@ -1,16 +1,17 @@
 import tkinter as tk
 from tkinter import messagebox, ttk, filedialog
 from typing import Callable, Dict, Any
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left
 import sqlite3
+import threading
+import re
+import unicodedata
 import database  # Importa nosso módulo de banco de dados
 import calendar # Módulo para trabalhar com calendários mensais
 from tkcalendar import Calendar # Importa o calendário
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import Paragraph
+import relatorios # Geração dos relatórios em PDF (ReportLab)
 
 # Variável global para armazenar os dados do usuário logado
 USUARIO_LOGADO = None
@@ -23,6 +24,11 @@ DIAS_SEMANA_MAP = {
 DIAS_SEMANA_LISTA = list(DIAS_SEMANA_MAP.keys())
 DIAS_SEMANA_INV_MAP = {v: k for k, v in DIAS_SEMANA_MAP.items()}
 
+DURACAO_PADRAO_SESSAO_MINUTOS = 60 # Usada para sugerir horários livres
+INTERVALO_VERIFICACAO_BACKUP_MS = 60 * 60 * 1000 # De hora em hora verifica se o backup automático está pendente
+ATRASO_PRIMEIRO_BACKUP_MS = 60 * 1000
+INTERVALO_OTIMIZACAO_ESTATISTICAS_MS = 60 * 60 * 1000 # De hora em hora atualiza as estatísticas do planejador do SQLite
+
 TERAPIAS_POR_NIVEL = {
     "Nível 1 – Apoio leve": """**Treinamento de Habilidades Sociais**
 - Jogos de tabuleiro em grupo (aprender a esperar a vez).
@@ -132,109 +138,620 @@ def calcular_idade(data_nasc_db):
     except (ValueError, TypeError):
         return "" # Retorna vazio se a data for inválida
 
-def _draw_wrapped_text(canvas_obj, text, x, y, max_width, max_height, style):
-    """Função auxiliar para desenhar texto com quebra de linha em um canvas do ReportLab."""
-    p = Paragraph(text.replace('\n', '<br/>'), style)
-    w, h = p.wrapOn(canvas_obj, max_width, max_height)
-    p.drawOn(canvas_obj, x, y - h)
-    return y - h - 20  # Retorna a nova posição Y com um espaçamento
+# --- Execução em Segundo Plano ---
+
+class ExecutorBanco:
+    """
+    Executa consultas ao banco em threads de fundo para não travar a interface.
+    Cada thread usa sua própria conexão do pool de database.py. O resultado é entregue
+    na thread do Tk (verificado via after), então os callbacks podem mexer nos widgets.
+    """
+    INTERVALO_VERIFICACAO_MS = 25
+
+    def __init__(self, max_workers=2, nome='banco'):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=nome)
+        self._ultimas = {} # (widget, chave) -> futuro mais recente
+        self._ocupados = {} # janela -> número de tarefas em andamento
+
+    def executar(self, widget, funcao, *args, ao_concluir=None, ao_falhar=None, chave=None, **kwargs):
+        """
+        Agenda funcao(*args, **kwargs) em segundo plano e retorna o Future.
+        ao_concluir(resultado) e ao_falhar(erro) são chamados na thread do Tk.
+        Com 'chave', uma nova chamada torna obsoleta a anterior de mesma chave no mesmo widget:
+        ela é cancelada se ainda não começou e seu resultado é descartado.
+        """
+        futuro = self._executor.submit(funcao, *args, **kwargs)
+        if chave is not None:
+            anterior = self._ultimas.get((str(widget), chave))
+            if anterior is not None:
+                anterior.cancel()
+            self._ultimas[(str(widget), chave)] = futuro
+        self._alterar_ocupado(widget, +1)
+        # Agendado na janela raiz, que continua existindo mesmo se 'widget' for fechado antes do fim
+        widget.nametowidget('.').after(self.INTERVALO_VERIFICACAO_MS, self._verificar, widget, futuro, ao_concluir, ao_falhar, chave)
+        return futuro
+
+    def _verificar(self, widget, futuro, ao_concluir, ao_falhar, chave):
+        if not futuro.done():
+            widget.nametowidget('.').after(self.INTERVALO_VERIFICACAO_MS, self._verificar, widget, futuro, ao_concluir, ao_falhar, chave)
+            return
+        self._alterar_ocupado(widget, -1)
+        if chave is not None:
+            if self._ultimas.get((str(widget), chave)) is not futuro:
+                return # Resultado obsoleto: uma chamada mais nova já foi feita
+            del self._ultimas[(str(widget), chave)]
+        if futuro.cancelled() or not _widget_existe(widget):
+            return
+        erro = futuro.exception()
+        if erro is not None:
+            if ao_falhar:
+                ao_falhar(erro)
+            else:
+                messagebox.showerror("Erro de Banco de Dados", f"Ocorreu um erro ao carregar os dados: {erro}", parent=widget)
+        elif ao_concluir:
+            ao_concluir(futuro.result())
+
+    def _alterar_ocupado(self, widget, delta):
+        """Mostra o cursor de espera na janela enquanto houver consultas em andamento."""
+        if not _widget_existe(widget):
+            return
+        janela = widget.winfo_toplevel()
+        total = self._ocupados.get(str(janela), 0) + delta
+        if total > 0:
+            self._ocupados[str(janela)] = total
+        else:
+            self._ocupados.pop(str(janela), None)
+        try:
+            janela.config(cursor='watch' if total > 0 else '')
+        except tk.TclError:
+            pass
+
+def _widget_existe(widget):
+    try:
+        return bool(widget.winfo_exists())
+    except tk.TclError:
+        return False
+
+EXECUTOR_BANCO = ExecutorBanco()
+# Os relatórios em PDF têm seu próprio executor para não ocupar as threads das consultas
+EXECUTOR_RELATORIOS = ExecutorBanco(max_workers=1, nome='relatorios')
+
+class JanelaProgresso(tk.Toplevel):
+    """
+    Janela modal com barra de progresso para tarefas em segundo plano. A tarefa chama
+    informar(feito, total, texto) de qualquer thread; a janela mostra o último valor informado.
+    Enquanto o total não é conhecido, a barra fica em modo indeterminado.
+    """
+    INTERVALO_ATUALIZACAO_MS = 100
+
+    def __init__(self, parent, titulo, texto, cancelavel=False):
+        super().__init__(parent)
+        self.title(titulo)
+        self.geometry("360x110")
+        self.resizable(False, False)
+        self.transient(parent)
+        self.grab_set()
+        self.protocol("WM_DELETE_WINDOW", lambda: None) # Fecha sozinha quando a tarefa termina
+
+        frame = ttk.Frame(self, padding=15)
+        frame.pack(fill='both', expand=True)
+        self.lbl_texto = ttk.Label(frame, text=texto)
+        self.lbl_texto.pack(anchor='w')
+        self.barra = ttk.Progressbar(frame, mode='indeterminate', length=320)
+        self.barra.pack(fill='x', pady=(10, 0))
+        self.barra.start(15)
+        # A tarefa consulta 'cancelado' entre uma etapa e outra
+        self.cancelado = threading.Event()
+        if cancelavel:
+            self.geometry("360x150")
+            self.btn_cancelar = ttk.Button(frame, text="Cancelar", command=self._cancelar)
+            self.btn_cancelar.pack(pady=(10, 0))
+
+        self._andamento = None # (feito, total, texto), trocado de uma vez pela thread de fundo
+        self.after(self.INTERVALO_ATUALIZACAO_MS, self._atualizar)
+
+    def informar(self, feito, total=None, texto=None):
+        self._andamento = (feito, total, texto)
+
+    def _atualizar(self):
+        if not _widget_existe(self):
+            return
+        if self._andamento is not None:
+            feito, total, texto = self._andamento
+            if total and str(self.barra.cget('mode')) != 'determinate':
+                self.barra.stop()
+                self.barra.config(mode='determinate')
+            if total:
+                self.barra.config(maximum=total, value=min(feito, total))
+            if texto:
+                self.lbl_texto.config(text=texto)
+        self.after(self.INTERVALO_ATUALIZACAO_MS, self._atualizar)
+
+    def _cancelar(self):
+        self.cancelado.set()
+        self.btn_cancelar.config(state='disabled')
+        self.lbl_texto.config(text="Cancelando...")
+
+    def fechar(self):
+        if _widget_existe(self):
+            self.grab_release()
+            self.destroy()
+
+class TreeviewPaginada:
+    """
+    Carrega as linhas de um Treeview sob demanda, em páginas (LIMIT/OFFSET), conforme o usuário rola a lista.
+    Clicar em um cabeçalho ordena no próprio banco e recomeça da primeira página.
+    As linhas são chaveadas pelo iid: atualizar() aplica só as diferenças e atualizar_linha()/remover_linha()
+    mexem em uma única linha, sem reconstruir a tabela nem perder a rolagem.
+    """
+    TAMANHO_PAGINA = 200
+    LIMIAR_ROLAGEM = 0.9 # Fração já rolada a partir da qual a próxima página é buscada
+    SETAS_ORDENACAO = {False: ' ▲', True: ' ▼'}
+
+    def __init__(self, tree, scrollbar, buscar_pagina, formatar_linha, colunas_ordenaveis=None, mensagem_erro="Erro ao carregar os dados",
+                 contexto_busca=None):
+        """
+        buscar_pagina(ordenar_por, decrescente, limite, deslocamento, *contexto) roda em segundo plano e retorna as linhas.
+        formatar_linha(linha) retorna (iid, valores, tags) para o Treeview.
+        colunas_ordenaveis mapeia a coluna do Treeview para a chave de ordenação aceita por buscar_pagina.
+        contexto_busca() roda na thread do Tk a cada busca e retorna a tupla 'contexto' (ex.: o termo
+        digitado), para que buscar_pagina não precise ler o estado da janela a partir da thread de fundo.
+        """
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.buscar_pagina = buscar_pagina
+        self.formatar_linha = formatar_linha
+        self.colunas_ordenaveis = colunas_ordenaveis or {}
+        self.mensagem_erro = mensagem_erro
+        self.contexto_busca = contexto_busca or tuple
+        self.coluna_ordem = None
+        self.decrescente = False
+        self._deslocamento = 0
+        self._esgotado = False
+        self._carregando = False
+        self._textos_cabecalho = {}
+        self._linhas = {} # iid -> linha exibida, para comparar sem consultar o Treeview
+
+        tree.configure(yscrollcommand=self._ao_rolar)
+        for coluna in self.colunas_ordenaveis:
+            self._textos_cabecalho[coluna] = tree.heading(coluna, 'text')
+            tree.heading(coluna, command=lambda c=coluna: self.ordenar(c))
+
+    def recarregar(self):
+        """Descarta as linhas exibidas e busca a primeira página novamente."""
+        self._deslocamento = 0
+        self._esgotado = False
+        self._carregando = False
+        self._linhas.clear()
+        self.tree.delete(*self.tree.get_children())
+        self._carregar_proxima_pagina()
+
+    def atualizar(self):
+        """
+        Busca de novo as linhas já carregadas e aplica só as diferenças (inserções, alterações,
+        remoções e ordem), preservando a seleção e a posição da rolagem.
+        """
+        limite = max(self._deslocamento, self.TAMANHO_PAGINA)
+        self._carregando = True
+        EXECUTOR_BANCO.executar(
+            self.tree, self.buscar_pagina,
+            self.colunas_ordenaveis.get(self.coluna_ordem), self.decrescente, limite, 0, *self.contexto_busca(),
+            ao_concluir=lambda linhas: self._sincronizar(linhas, limite), ao_falhar=self._falhou, chave='paginacao'
+        )
+
+    def atualizar_linha(self, iid, **alteracoes):
+        """Aplica 'alteracoes' à linha já exibida e redesenha só ela (ex.: status_pagamento='Pago')."""
+        iid = str(iid)
+        if iid not in self._linhas or not self.tree.exists(iid):
+            return
+        anterior = self._linhas[iid]
+        # Mantém o mesmo tipo de linha da consulta, para que _sincronizar compare de igual para igual
+        linha = anterior._replace(**alteracoes) if hasattr(anterior, '_replace') else dict(anterior, **alteracoes)
+        _, valores, tags = self.formatar_linha(linha)
+        self.tree.item(iid, values=valores, tags=tags)
+        self._linhas[iid] = linha
+
+    def remover_linha(self, iid):
+        """Remove uma linha que deixou de pertencer à consulta (ex.: pendência quitada)."""
+        iid = str(iid)
+        if self.tree.exists(iid):
+            self.tree.delete(iid)
+        if self._linhas.pop(iid, None) is not None:
+            # A linha também saiu do resultado no banco; sem isso a próxima página pularia um registro
+            self._deslocamento -= 1
+
+    def _sincronizar(self, linhas, limite):
+        self._carregando = False
+        self._deslocamento = len(linhas)
+        self._esgotado = len(linhas) < limite
+        novas = {}
+        for linha in linhas:
+            novas.setdefault(str(self.formatar_linha(linha)[0]), linha)
+
+        removidas = [iid for iid in self.tree.get_children() if iid not in novas]
+        if removidas:
+            self.tree.delete(*removidas)
+        for iid in removidas:
+            self._linhas.pop(iid, None)
+
+        for indice, (iid, linha) in enumerate(novas.items()):
+            anterior = self._linhas.get(iid)
+            if anterior is None:
+                _, valores, tags = self.formatar_linha(linha)
+                self.tree.insert("", indice, iid=iid, values=valores, tags=tags)
+            elif anterior != linha:
+                _, valores, tags = self.formatar_linha(linha)
+                self.tree.item(iid, values=valores, tags=tags)
+            self._linhas[iid] = linha
+
+        atual = list(self.tree.get_children())
+        for indice, iid in enumerate(novas):
+            if atual[indice] != iid:
+                self.tree.move(iid, "", indice)
+                atual.remove(iid)
+                atual.insert(indice, iid)
+        self.tree.after_idle(self._verificar_rolagem)
+
+    def ordenar(self, coluna):
+        """Ordena pela coluna clicada; um segundo clique na mesma coluna inverte a ordem."""
+        if coluna == self.coluna_ordem:
+            self.decrescente = not self.decrescente
+        else:
+            self.coluna_ordem, self.decrescente = coluna, False
+        for c, texto in self._textos_cabecalho.items():
+            seta = self.SETAS_ORDENACAO[self.decrescente] if c == coluna else ''
+            self.tree.heading(c, text=texto + seta)
+        self.recarregar()
+
+    def _carregar_proxima_pagina(self):
+        if self._carregando or self._esgotado:
+            return
+        self._carregando = True
+        EXECUTOR_BANCO.executar(
+            self.tree, self.buscar_pagina,
+            self.colunas_ordenaveis.get(self.coluna_ordem), self.decrescente, self.TAMANHO_PAGINA, self._deslocamento,
+            *self.contexto_busca(), ao_concluir=self._exibir_pagina, ao_falhar=self._falhou, chave='paginacao'
+        )
+
+    def _exibir_pagina(self, linhas):
+        self._carregando = False
+        self._deslocamento += len(linhas)
+        self._esgotado = len(linhas) < self.TAMANHO_PAGINA
+        for linha in linhas:
+            iid, valores, tags = self.formatar_linha(linha)
+            # Se os dados mudaram entre duas páginas o OFFSET pode repetir uma linha já exibida
+            if not self.tree.exists(iid):
+                self.tree.insert("", "end", iid=iid, values=valores, tags=tags)
+                self._linhas[str(iid)] = linha
+        # Uma página que não preenche a área visível não gera rolagem; verifica de novo
+        self.tree.after_idle(self._verificar_rolagem)
+
+    def _falhou(self, erro):
+        self._carregando = False
+        messagebox.showerror("Erro de Banco de Dados", f"{self.mensagem_erro}: {erro}", parent=self.tree)
+
+    def _ao_rolar(self, primeiro, ultimo):
+        self.scrollbar.set(primeiro, ultimo)
+        if float(ultimo) >= self.LIMIAR_ROLAGEM:
+            self._carregar_proxima_pagina()
+
+    def _verificar_rolagem(self):
+        if _widget_existe(self.tree) and self.tree.yview()[1] >= self.LIMIAR_ROLAGEM:
+            self._carregar_proxima_pagina()
+
+def normalizar_texto(texto):
+    """Minúsculas e sem acentos, como o tokenizador da busca de pacientes no banco."""
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).casefold()
+
+class IndicePrefixos:
+    """
+    Índice em memória para filtrar enquanto se digita, sem ir ao banco.
+    Guarda uma lista ordenada de (palavra normalizada, posição do registro); as palavras com um
+    prefixo ficam contíguas e são achadas por busca binária. Como na busca do banco, cada palavra
+    digitada precisa ser o início de alguma palavra do registro.
+    """
+    def __init__(self, registros, texto_do_registro):
+        self.registros = list(registros)
+        entradas = sorted(
+            (palavra, posicao)
+            for posicao, registro in enumerate(self.registros)
+            for palavra in set(re.findall(r'\w+', normalizar_texto(texto_do_registro(registro))))
+        )
+        self._palavras = [palavra for palavra, _ in entradas]
+        self._posicoes = [posicao for _, posicao in entradas]
+        self._ultima_busca = (None, None) # Páginas seguintes da mesma busca reaproveitam o resultado
+
+    def _posicoes_com_prefixo(self, prefixo):
+        inicio = bisect_left(self._palavras, prefixo)
+        fim = inicio
+        while fim < len(self._palavras) and self._palavras[fim].startswith(prefixo):
+            fim += 1
+        return set(self._posicoes[inicio:fim])
+
+    def filtrar(self, termo):
+        """Retorna os registros que casam com todas as palavras de 'termo', na ordem original."""
+        termo_anterior, resultado = self._ultima_busca
+        if termo == termo_anterior:
+            return list(resultado)
+        posicoes = None
+        # A palavra mais longa costuma ser a mais seletiva; começa por ela
+        for palavra in sorted(re.findall(r'\w+', normalizar_texto(termo)), key=len, reverse=True):
+            encontradas = self._posicoes_com_prefixo(palavra)
+            posicoes = encontradas if posicoes is None else posicoes & encontradas
+            if not posicoes:
+                break
+        if posicoes is None:
+            resultado = self.registros
+        else:
+            resultado = [self.registros[i] for i in sorted(posicoes)]
+        self._ultima_busca = (termo, resultado)
+        return list(resultado)
 
 def gerar_relatorio_sessao_pdf(janela_pai, sessao_id):
-    """Gera um relatório em PDF para uma sessão específica."""
+    """Gera um relatório em PDF para uma sessão específica, em segundo plano."""
     try:
         sessao_data = database.buscar_sessao_por_id(sessao_id)
-        if not sessao_data:
-            messagebox.showerror("Erro", "Não foi possível encontrar os dados da sessão.", parent=janela_pai)
+    except sqlite3.Error as e:
+        messagebox.showerror("Erro de Banco de Dados", f"Não foi possível carregar a sessão: {e}", parent=janela_pai)
+        return
+    if not sessao_data:
+        messagebox.showerror("Erro", "Não foi possível encontrar os dados da sessão.", parent=janela_pai)
+        return
+
+    paciente_nome_safe = "".join(c for c in sessao_data.get('paciente_nome', 'Paciente') if c.isalnum() or c in " ._").rstrip()
+    nome_arquivo_sugerido = f"Relatorio_Sessao_{sessao_id}_{paciente_nome_safe}.pdf"
+
+    nome_arquivo = filedialog.asksaveasfilename(
+        initialfile=nome_arquivo_sugerido,
+        defaultextension=".pdf",
+        filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")],
+        parent=janela_pai
+    )
+
+    if not nome_arquivo:
+        return
+
+    progresso = JanelaProgresso(janela_pai, "Gerando Relatório", "Montando o PDF...")
+
+    def concluido(paginas):
+        progresso.fechar()
+        messagebox.showinfo("Sucesso", f"Relatório salvo como '{nome_arquivo}' ({paginas} página(s))", parent=janela_pai)
+
+    def falhou(erro):
+        progresso.fechar()
+        messagebox.showerror("Erro", f"Não foi possível gerar o PDF: {erro}", parent=janela_pai)
+
+    EXECUTOR_RELATORIOS.executar(
+        progresso, relatorios.gerar_relatorio_sessao_pdf, nome_arquivo, sessao_data,
+        ao_progredir=progresso.informar, ao_concluir=concluido, ao_falhar=falhou
+    )
+
+def abrir_janela_exportar_relatorios(janela_pai, paciente_id=None, paciente_nome=None):
+    """
+    Exporta para um arquivo ZIP os relatórios em PDF de todas as sessões de um período,
+    filtrando por paciente (quando aberta a partir dele) e por plano de saúde.
+    """
+    janela_exp = tk.Toplevel(janela_pai)
+    janela_exp.title("Exportar Relatórios de Sessões")
+    janela_exp.geometry("420x230")
+    janela_exp.transient(janela_pai)
+    janela_exp.grab_set()
+
+    frame = ttk.Frame(janela_exp, padding=15)
+    frame.pack(fill='both', expand=True)
+
+    # Sugere o trimestre atual, período que os convênios costumam pedir
+    hoje = date.today()
+    inicio_trimestre = date(hoje.year, 3 * ((hoje.month - 1) // 3) + 1, 1)
+    ttk.Label(frame, text="De:").grid(row=0, column=0, sticky='w', pady=3)
+    entry_de = ttk.Entry(frame, width=12)
+    entry_de.insert(0, inicio_trimestre.strftime('%d/%m/%Y'))
+    entry_de.grid(row=0, column=1, sticky='w', pady=3)
+    ttk.Label(frame, text="Até:").grid(row=1, column=0, sticky='w', pady=3)
+    entry_ate = ttk.Entry(frame, width=12)
+    entry_ate.insert(0, hoje.strftime('%d/%m/%Y'))
+    entry_ate.grid(row=1, column=1, sticky='w', pady=3)
+
+    ttk.Label(frame, text="Paciente:").grid(row=2, column=0, sticky='w', pady=3)
+    ttk.Label(frame, text=paciente_nome if paciente_id is not None else "Todos").grid(row=2, column=1, sticky='w', pady=3)
+
+    planos_map = {p['nome']: p['id'] for p in database.listar_planos_saude()}
+    ttk.Label(frame, text="Plano de Saúde:").grid(row=3, column=0, sticky='w', pady=3)
+    combo_plano = ttk.Combobox(frame, values=["Todos"] + list(planos_map.keys()), state='readonly', width=25)
+    combo_plano.set("Todos")
+    combo_plano.grid(row=3, column=1, sticky='w', pady=3)
+
+    def exportar():
+        data_inicio_db = formatar_data_para_db(entry_de.get().strip())
+        data_fim_db = formatar_data_para_db(entry_ate.get().strip())
+        if not data_inicio_db or not data_fim_db or data_inicio_db > data_fim_db:
+            messagebox.showerror("Erro de Validação", "Informe um período válido (DD/MM/AAAA).", parent=janela_exp)
+            return
+        plano_saude_id = planos_map.get(combo_plano.get())
+        try:
+            sessoes = database.listar_sessoes_para_relatorio(data_inicio_db, data_fim_db, paciente_id, plano_saude_id)
+        except sqlite3.Error as e:
+            messagebox.showerror("Erro de Banco de Dados", f"Não foi possível carregar as sessões: {e}", parent=janela_exp)
+            return
+        if not sessoes:
+            messagebox.showinfo("Exportar Relatórios", "Nenhuma sessão encontrada com esses filtros.", parent=janela_exp)
             return
 
-        paciente_nome_safe = "".join(c for c in sessao_data.get('paciente_nome', 'Paciente') if c.isalnum() or c in " ._").rstrip()
-        nome_arquivo_sugerido = f"Relatorio_Sessao_{sessao_id}_{paciente_nome_safe}.pdf"
-        
+        nome_base = "".join(c for c in (paciente_nome or combo_plano.get()) if c.isalnum() or c in " ._").strip()
         nome_arquivo = filedialog.asksaveasfilename(
-            initialfile=nome_arquivo_sugerido,
-            defaultextension=".pdf",
-            filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")],
-            parent=janela_pai
+            initialfile=f"Relatorios_{nome_base}_{data_inicio_db}_a_{data_fim_db}.zip",
+            defaultextension=".zip",
+            filetypes=[("Arquivos ZIP", "*.zip"), ("All files", "*.*")],
+            parent=janela_exp
         )
-
         if not nome_arquivo:
             return
 
-        c = canvas.Canvas(nome_arquivo, pagesize=letter)
-        width, height = letter
-        margin = inch
+        progresso = JanelaProgresso(janela_exp, "Exportando Relatórios", f"Gerando {len(sessoes)} relatórios...", cancelavel=True)
 
-        styles = getSampleStyleSheet()
-        style_h1 = styles['h1']
-        style_h2 = styles['h2']
-        style_body = styles['BodyText']
-        
-        y_pos = height - margin
+        def concluido(resultado):
+            progresso.fechar()
+            if resultado['cancelado']:
+                messagebox.showinfo("Exportação Cancelada", "A exportação foi cancelada e o arquivo incompleto foi removido.", parent=janela_exp)
+                return
+            messagebox.showinfo(
+                "Sucesso",
+                f"{resultado['relatorios']} relatórios salvos em '{nome_arquivo}'.\n"
+                f"Tempo: {resultado['segundos']:.1f} s ({resultado['por_segundo']:.0f} relatórios/s).",
+                parent=janela_exp
+            )
+            janela_exp.destroy()
+
+        def falhou(erro):
+            progresso.fechar()
+            messagebox.showerror("Erro", f"Não foi possível exportar os relatórios: {erro}", parent=janela_exp)
+
+        EXECUTOR_RELATORIOS.executar(
+            progresso, relatorios.exportar_relatorios_zip, nome_arquivo, sessoes,
+            ao_progredir=progresso.informar, cancelado=progresso.cancelado, ao_concluir=concluido, ao_falhar=falhou
+        )
 
-        # Título e Informações Gerais
-        y_pos = _draw_wrapped_text(c, "Relatório de Sessão Terapêutica", margin, y_pos, width - 2 * margin, height, style_h1)
-        y_pos -= 10
-        
-        info_gerais = f"""
-            <b>Paciente:</b> {sessao_data.get('paciente_nome', 'N/A')}<br/>
-            <b>Data:</b> {formatar_data_para_exibicao(sessao_data.get('data_sessao'))}<br/>
-            <b>Terapeuta:</b> {sessao_data.get('medico_nome', 'N/A')}
-        """
-        y_pos = _draw_wrapped_text(c, info_gerais, margin, y_pos, width - 2 * margin, height, style_body)
-
-        # Seções do relatório
-        y_pos = _draw_wrapped_text(c, "<b>Resumo da Sessão:</b>", margin, y_pos, width - 2 * margin, height, style_h2)
-        y_pos = _draw_wrapped_text(c, sessao_data.get('resumo_sessao', 'Não informado.'), margin, y_pos, width - 2 * margin, height, style_body)
-        y_pos = _draw_wrapped_text(c, "<b>Observações sobre a Evolução:</b>", margin, y_pos, width - 2 * margin, height, style_h2)
-        y_pos = _draw_wrapped_text(c, sessao_data.get('observacoes_evolucao', 'Não informado.'), margin, y_pos, width - 2 * margin, height, style_body)
-        y_pos = _draw_wrapped_text(c, "<b>Plano Terapêutico:</b>", margin, y_pos, width - 2 * margin, height, style_h2)
-        _draw_wrapped_text(c, sessao_data.get('plano_terapeutico', 'Não informado.'), margin, y_pos, width - 2 * margin, height, style_body)
-        
-        c.save()
-        messagebox.showinfo("Sucesso", f"Relatório salvo como '{nome_arquivo}'", parent=janela_pai)
-    except Exception as e:
-        messagebox.showerror("Erro", f"Não foi possível gerar o PDF: {e}", parent=janela_pai)
+    botoes_frame = ttk.Frame(frame)
+    botoes_frame.grid(row=4, column=0, columnspan=2, sticky='e', pady=(15, 0))
+    ttk.Button(botoes_frame, text="Exportar ZIP", command=exportar).pack(side='left', padx=5)
+    ttk.Button(botoes_frame, text="Fechar", command=janela_exp.destroy).pack(side='left')
 
 def realizar_backup(janela_pai):
-    """Abre uma caixa de diálogo para salvar um backup do banco de dados."""
-    try:
-        # Sugere um nome de arquivo com a data e hora atuais
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        nome_arquivo_sugerido = f"backup_clinica_{timestamp}.db"
-        
-        backup_path = filedialog.asksaveasfilename(
-            title="Salvar Backup Como",
-            initialfile=nome_arquivo_sugerido,
-            defaultextension=".db",
-            filetypes=[("Arquivos de Banco de Dados", "*.db"), ("Todos os arquivos", "*.*")],
+    """Abre uma caixa de diálogo para salvar um backup do banco de dados, feito em segundo plano."""
+    # Sugere um nome de arquivo com a data e hora atuais
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    nome_arquivo_sugerido = f"backup_clinica_{timestamp}.db.gz"
+
+    backup_path = filedialog.asksaveasfilename(
+        title="Salvar Backup Como",
+        initialfile=nome_arquivo_sugerido,
+        defaultextension=".gz",
+        filetypes=[("Backup Comprimido", "*.db.gz"), ("Arquivos de Banco de Dados", "*.db"), ("Todos os arquivos", "*.*")],
+        parent=janela_pai
+    )
+    if not backup_path:
+        return
+
+    progresso = JanelaProgresso(janela_pai, "Backup do Sistema", "Iniciando o backup...")
+
+    def concluido(resultado):
+        progresso.fechar()
+        messagebox.showinfo(
+            "Backup Concluído",
+            f"Backup salvo com sucesso em:\n{backup_path}\n\n{resultado['bytes'] / (1024 * 1024):.1f} MB em {resultado['segundos']:.1f} s",
             parent=janela_pai
         )
-        
-        if backup_path:
-            database.backup_database(backup_path)
-            messagebox.showinfo("Backup Concluído", f"Backup salvo com sucesso em:\n{backup_path}", parent=janela_pai)
-            
-    except FileNotFoundError as e:
-        messagebox.showerror("Erro", str(e), parent=janela_pai)
-    except Exception as e:
-        messagebox.showerror("Erro de Backup", f"Ocorreu um erro inesperado ao realizar o backup:\n{e}", parent=janela_pai)
+
+    def falhou(erro):
+        progresso.fechar()
+        if isinstance(erro, FileNotFoundError):
+            messagebox.showerror("Erro", str(erro), parent=janela_pai)
+        else:
+            messagebox.showerror("Erro de Backup", f"Ocorreu um erro inesperado ao realizar o backup:\n{erro}", parent=janela_pai)
+
+    # A cópia usa a API de backup do SQLite, então o sistema pode continuar sendo usado enquanto ela roda
+    EXECUTOR_BANCO.executar(
+        progresso, database.backup_database, backup_path,
+        ao_progredir=progresso.informar, ao_concluir=concluido, ao_falhar=falhou
+    )
+
+def realizar_backup_incremental(janela_pai):
+    """Grava um backup incremental (só as páginas alteradas desde o último) em segundo plano e mostra as métricas."""
+    progresso = JanelaProgresso(janela_pai, "Backup Incremental", "Iniciando o backup...")
+
+    def concluido(metricas):
+        progresso.fechar()
+        messagebox.showinfo(
+            "Backup Concluído",
+            f"Backup {metricas['tipo']} salvo em:\n{database.pasta_backups_incrementais()}\n\n"
+            f"Páginas gravadas: {metricas['paginas_alteradas']} de {metricas['paginas_total']}\n"
+            f"Tamanho: {metricas['bytes'] / (1024 * 1024):.2f} MB\nTempo: {metricas['segundos']:.1f} s",
+            parent=janela_pai
+        )
+
+    def falhou(erro):
+        progresso.fechar()
+        messagebox.showerror("Erro de Backup", f"Ocorreu um erro inesperado ao realizar o backup:\n{erro}", parent=janela_pai)
+
+    EXECUTOR_BANCO.executar(
+        progresso, database.backup_incremental,
+        ao_progredir=progresso.informar, ao_concluir=concluido, ao_falhar=falhou
+    )
+
+def agendar_backup_automatico(root):
+    """
+    Verifica periodicamente se o último backup automático é mais antigo que database.BACKUP_INTERVALO_HORAS
+    e, nesse caso, grava um novo em segundo plano (mantendo as últimas database.BACKUP_GERACOES cópias).
+    """
+    def verificar():
+        if not _widget_existe(root):
+            return
+        if database.backup_automatico_pendente():
+            EXECUTOR_BANCO.executar(
+                root, database.realizar_backup_automatico, chave='backup_automatico',
+                ao_falhar=lambda erro: print(f"Falha no backup automático: {erro}")
+            )
+        root.after(INTERVALO_VERIFICACAO_BACKUP_MS, verificar)
+
+    # A primeira verificação espera a carga inicial da tela terminar
+    root.after(ATRASO_PRIMEIRO_BACKUP_MS, verificar)
+
+def agendar_otimizacao_estatisticas(root):
+    """
+    Atualiza periodicamente, em segundo plano, as estatísticas que o SQLite usa para escolher os índices
+    (ver database.otimizar_estatisticas), para que acompanhem o crescimento das tabelas.
+    """
+    def otimizar():
+        if not _widget_existe(root):
+            return
+        EXECUTOR_BANCO.executar(
+            root, database.otimizar_estatisticas, chave='otimizar_estatisticas',
+            ao_falhar=lambda erro: print(f"Falha ao atualizar as estatísticas do banco: {erro}")
+        )
+        root.after(INTERVALO_OTIMIZACAO_ESTATISTICAS_MS, otimizar)
+
+    root.after(INTERVALO_OTIMIZACAO_ESTATISTICAS_MS, otimizar)
 
 def realizar_restauracao(janela_pai):
     """Abre uma caixa de diálogo para restaurar o banco de dados a partir de um backup."""
-    aviso = "Atenção! A restauração substituirá TODOS os dados atuais por aqueles do arquivo de backup. Esta ação não pode ser desfeita.\n\nO aplicativo será fechado após a restauração. Deseja continuar?"
+    aviso = "Atenção! A restauração substituirá TODOS os dados atuais por aqueles do arquivo de backup. Uma cópia do banco atual será guardada na pasta de backups.\n\nO aplicativo será fechado após a restauração. Deseja continuar?"
     if not messagebox.askyesno("Restauração de Dados", aviso, icon='warning', parent=janela_pai):
         return
         
-    backup_path = filedialog.askopenfilename(title="Selecionar Arquivo de Backup para Restaurar", filetypes=[("Arquivos de Banco de Dados", "*.db"), ("Todos os arquivos", "*.*")], parent=janela_pai)
-    if backup_path:
-        try:
-            database.restore_database(backup_path)
-            messagebox.showinfo("Restauração Concluída", "O banco de dados foi restaurado com sucesso.\n\nO aplicativo será encerrado. Por favor, abra-o novamente.", parent=janela_pai)
-            janela_pai.destroy()
-        except FileNotFoundError as e:
-            messagebox.showerror("Erro", str(e), parent=janela_pai)
-        except Exception as e:
-            messagebox.showerror("Erro de Restauração", f"Ocorreu um erro inesperado ao restaurar o banco de dados:\n{e}", parent=janela_pai)
+    backup_path = filedialog.askopenfilename(title="Selecionar Arquivo de Backup para Restaurar", filetypes=[("Arquivos de Backup", "*.db *.gz manifesto.json"), ("Todos os arquivos", "*.*")], parent=janela_pai)
+    if not backup_path:
+        return
+
+    progresso = JanelaProgresso(janela_pai, "Restauração de Dados", "Preparando a restauração...")
+
+    def concluido(resultado):
+        progresso.fechar()
+        messagebox.showinfo(
+            "Restauração Concluída",
+            f"O banco de dados foi restaurado e verificado com sucesso em {resultado['segundos']:.1f} s "
+            f"(indisponível por {resultado['segundos_indisponivel'] * 1000:.0f} ms).\n\n"
+            f"Cópia do banco anterior: {resultado['copia_anterior'] or '-'}\n\n"
+            "O aplicativo será encerrado. Por favor, abra-o novamente.",
+            parent=janela_pai
+        )
+        janela_pai.destroy()
+
+    def falhou(erro):
+        progresso.fechar()
+        if isinstance(erro, FileNotFoundError):
+            messagebox.showerror("Erro", str(erro), parent=janela_pai)
+        else:
+            messagebox.showerror(
+                "Erro de Restauração",
+                f"Não foi possível restaurar o banco de dados:\n{erro}\n\nO banco de dados atual não foi alterado.",
+                parent=janela_pai
+            )
+
+    EXECUTOR_BANCO.executar(
+        progresso, database.restore_database, backup_path,
+        ao_progredir=progresso.informar, ao_concluir=concluido, ao_falhar=falhou
+    )
 
 def salvar_paciente(janela_cadastro, entry_nome, entry_data, entry_resp, entry_tel_resp, combo_plano, planos_map, entry_valor, text_terapias):
     """Coleta os dados dos campos de entrada e salva no banco de dados."""
@@ -321,6 +838,17 @@ def salvar_nova_sessao(janela_form, paciente_id, widgets):
         # Obter o ID do médico a partir do nome selecionado
         medico_id = widgets['medico_map'].get(nome_medico)
 
+        # Validação do formato de hora (antes do conflito, que compara os horários em minutos)
+        try:
+            if hora_inicio: datetime.strptime(hora_inicio, '%H:%M')
+            if hora_fim: datetime.strptime(hora_fim, '%H:%M')
+            if hora_inicio and hora_fim and datetime.strptime(hora_inicio, '%H:%M') >= datetime.strptime(hora_fim, '%H:%M'):
+                messagebox.showwarning("Lógica Inválida", "O horário de início deve ser anterior ao de fim.", parent=janela_form)
+                return
+        except ValueError:
+            messagebox.showerror("Formato Inválido", "O formato do horário deve ser HH:MM.", parent=janela_form)
+            return
+
         # --- VERIFICAÇÃO DE CONFLITO DE HORÁRIO ---
         sessoes_conflitantes = database.verificar_conflito_sessao(
             medico_id=medico_id, 
@@ -332,20 +860,12 @@ def salvar_nova_sessao(janela_form, paciente_id, widgets):
             messagebox.showwarning("Conflito de Horário", "O terapeuta já possui uma sessão agendada neste horário.", parent=janela_form)
             return
 
-        # Validação do formato de hora
-        try:
-            if hora_inicio: datetime.strptime(hora_inicio, '%H:%M')
-            if hora_fim: datetime.strptime(hora_fim, '%H:%M')
-            if hora_inicio and hora_fim and datetime.strptime(hora_inicio, '%H:%M') >= datetime.strptime(hora_fim, '%H:%M'):
-                messagebox.showwarning("Lógica Inválida", "O horário de início deve ser anterior ao de fim.", parent=janela_form)
-                return
-        except ValueError:
-            messagebox.showerror("Formato Inválido", "O formato do horário deve ser HH:MM.", parent=janela_form)
-            return
-
         database.adicionar_sessao(paciente_id, medico_id, data_sessao_db, hora_inicio, hora_fim, resumo, evolucao, obs_evolucao, plano)
         messagebox.showinfo("Sucesso", "Nova sessão registrada com sucesso!", parent=janela_form)
         janela_form.destroy()
+    except ValueError as e:
+        # Outra estação agendou o horário entre a verificação acima e a gravação
+        messagebox.showwarning("Conflito de Horário", str(e), parent=janela_form)
     except KeyError as e:
         messagebox.showerror("Erro de Programação", f"Faltando widget no formulário: {e}", parent=janela_form)
     except sqlite3.Error as e:
@@ -375,6 +895,17 @@ def salvar_alteracoes_sessao(janela_form, sessao_id, widgets):
         # Obter o ID do médico a partir do nome selecionado
         medico_id = widgets['medico_map'].get(nome_medico)
 
+        # Validação do formato de hora (antes do conflito, que compara os horários em minutos)
+        try:
+            if hora_inicio: datetime.strptime(hora_inicio, '%H:%M')
+            if hora_fim: datetime.strptime(hora_fim, '%H:%M')
+            if hora_inicio and hora_fim and datetime.strptime(hora_inicio, '%H:%M') >= datetime.strptime(hora_fim, '%H:%M'):
+                messagebox.showwarning("Lógica Inválida", "O horário de início deve ser anterior ao de fim.", parent=janela_form)
+                return
+        except ValueError:
+            messagebox.showerror("Formato Inválido", "O formato do horário deve ser HH:MM.", parent=janela_form)
+            return
+
         # --- VERIFICAÇÃO DE CONFLITO DE HORÁRIO (AO EDITAR) ---
         sessoes_conflitantes = database.verificar_conflito_sessao(
             medico_id=medico_id, 
@@ -387,20 +918,12 @@ def salvar_alteracoes_sessao(janela_form, sessao_id, widgets):
             messagebox.showwarning("Conflito de Horário", "O terapeuta já possui uma sessão agendada neste horário.", parent=janela_form)
             return
 
-        # Validação do formato de hora
-        try:
-            if hora_inicio: datetime.strptime(hora_inicio, '%H:%M')
-            if hora_fim: datetime.strptime(hora_fim, '%H:%M')
-            if hora_inicio and hora_fim and datetime.strptime(hora_inicio, '%H:%M') >= datetime.strptime(hora_fim, '%H:%M'):
-                messagebox.showwarning("Lógica Inválida", "O horário de início deve ser anterior ao de fim.", parent=janela_form)
-                return
-        except ValueError:
-            messagebox.showerror("Formato Inválido", "O formato do horário deve ser HH:MM.", parent=janela_form)
-            return
-
         database.atualizar_sessao(sessao_id, medico_id, data_sessao_db, hora_inicio, hora_fim, resumo, evolucao, obs_evolucao, plano)
         messagebox.showinfo("Sucesso", "Sessão atualizada com sucesso!", parent=janela_form)
         janela_form.destroy()
+    except ValueError as e:
+        # Outra estação agendou o horário entre a verificação acima e a gravação
+        messagebox.showwarning("Conflito de Horário", str(e), parent=janela_form)
     except KeyError as e:
         messagebox.showerror("Erro de Programação", f"Faltando widget no formulário: {e}", parent=janela_form)
     except sqlite3.Error as e:
@@ -521,11 +1044,12 @@ def abrir_janela_disponibilidade(janela_pai, medico_id, medico_nome):
     # Tabela de horários
     tree_frame = ttk.Frame(right_frame)
     tree_frame.pack(fill='both', expand=True, pady=5)
-    cols = ('ID', 'Início', 'Fim')
+    cols = ('ID', 'Início', 'Fim', 'Repetição')
     tree_horarios = ttk.Treeview(tree_frame, columns=cols, show='headings')
     tree_horarios.heading('ID', text='ID'); tree_horarios.column('ID', width=0, stretch=tk.NO) # Oculto
     tree_horarios.heading('Início', text='Horário de Início'); tree_horarios.column('Início', anchor='center', width=100)
     tree_horarios.heading('Fim', text='Horário de Fim'); tree_horarios.column('Fim', anchor='center', width=100)
+    tree_horarios.heading('Repetição', text='Repetição'); tree_horarios.column('Repetição', anchor='center', width=120)
     tree_horarios.pack(side='left', fill='both', expand=True)
     scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree_horarios.yview)
     tree_horarios.configure(yscroll=scrollbar.set); scrollbar.pack(side='right', fill='y')
@@ -539,11 +1063,20 @@ def abrir_janela_disponibilidade(janela_pai, medico_id, medico_nome):
     ttk.Label(add_frame, text="Fim (HH:MM):").grid(row=0, column=2, padx=5, pady=5)
     entry_fim = ttk.Entry(add_frame, width=10)
     entry_fim.grid(row=0, column=3, padx=5, pady=5)
+    # Horários semanais valem a partir da data selecionada, sem precisar cadastrar cada dia
+    ttk.Label(add_frame, text="Repetir:").grid(row=1, column=0, padx=5, pady=5)
+    nao_repetir = "Não repetir"
+    combo_repeticao = ttk.Combobox(add_frame, values=[nao_repetir] + DIAS_SEMANA_LISTA, state='readonly', width=14)
+    combo_repeticao.set(nao_repetir)
+    combo_repeticao.grid(row=1, column=1, padx=5, pady=5)
+    ttk.Label(add_frame, text="Até (opcional):").grid(row=1, column=2, padx=5, pady=5)
+    entry_repetir_ate = ttk.Entry(add_frame, width=12)
+    entry_repetir_ate.grid(row=1, column=3, padx=5, pady=5)
 
     def marcar_dias_disponiveis():
         """Pinta os dias com disponibilidade no calendário."""
         cal.calevent_remove('all')
-        ano, mes = cal.get_displayed_month()
+        mes, ano = cal.get_displayed_month() # O tkcalendar retorna (mês, ano)
         datas_disponiveis = database.listar_datas_disponiveis_por_mes(medico_id, ano, mes)
         for data_str in datas_disponiveis:
             try:
@@ -560,7 +1093,11 @@ def abrir_janela_disponibilidade(janela_pai, medico_id, medico_nome):
         data_db = formatar_data_para_db(data_selecionada)
         horarios = database.listar_disponibilidade_por_data(medico_id, data_db)
         for horario in horarios:
-            tree_horarios.insert("", "end", values=(horario['id'], horario['hora_inicio'], horario['hora_fim']))
+            if horario['modelo_id']:
+                iid, repeticao = f"modelo-{horario['modelo_id']}", "Semanal"
+            else:
+                iid, repeticao = f"avulso-{horario['id']}", "Somente neste dia"
+            tree_horarios.insert("", "end", iid=iid, values=(horario['id'] or horario['modelo_id'], horario['hora_inicio'], horario['hora_fim'], repeticao))
 
     def adicionar_horario():
         inicio, fim = entry_inicio.get().strip(), entry_fim.get().strip()
@@ -574,9 +1111,17 @@ def abrir_janela_disponibilidade(janela_pai, medico_id, medico_nome):
             messagebox.showerror("Formato Inválido", "O formato do horário deve ser HH:MM.", parent=janela_disp); return
         if datetime.strptime(inicio, '%H:%M') >= datetime.strptime(fim, '%H:%M'):
             messagebox.showwarning("Lógica Inválida", "O horário de início deve ser anterior ao de fim.", parent=janela_disp); return
+        repeticao = combo_repeticao.get()
+        repetir_ate_str = entry_repetir_ate.get().strip()
+        repetir_ate_db = formatar_data_para_db(repetir_ate_str) if repetir_ate_str else None
+        if repetir_ate_str and (not repetir_ate_db or repetir_ate_db < data_db):
+            messagebox.showerror("Data Inválida", "A data final da repetição deve estar no formato DD/MM/AAAA e não pode ser anterior ao dia selecionado.", parent=janela_disp); return
 
         try:
-            database.adicionar_disponibilidade(medico_id, data_db, inicio, fim)
+            if repeticao == nao_repetir:
+                database.adicionar_disponibilidade(medico_id, data_db, inicio, fim)
+            else:
+                database.adicionar_modelo_disponibilidade(medico_id, DIAS_SEMANA_MAP[repeticao], inicio, fim, data_db, repetir_ate_db)
             entry_inicio.delete(0, 'end'); entry_fim.delete(0, 'end')
             atualizar_horarios_do_dia()
             marcar_dias_disponiveis() # Garante que o dia seja marcado
@@ -587,14 +1132,30 @@ def abrir_janela_disponibilidade(janela_pai, medico_id, medico_nome):
         selected_item = tree_horarios.focus()
         if not selected_item:
             messagebox.showwarning("Nenhuma Seleção", "Selecione um horário para excluir.", parent=janela_disp); return
-        if messagebox.askyesno("Confirmar", "Tem certeza que deseja excluir este horário?", parent=janela_disp):
-            try:
-                disponibilidade_id = tree_horarios.item(selected_item)['values'][0]
-                database.excluir_disponibilidade(disponibilidade_id)
-                atualizar_horarios_do_dia()
-                marcar_dias_disponiveis() # Atualiza o calendário caso o dia fique sem horários
-            except sqlite3.Error as e:
-                messagebox.showerror("Erro", f"Não foi possível excluir o horário: {e}", parent=janela_disp)
+        tipo, _, registro_id = selected_item.partition('-')
+        data_db = formatar_data_para_db(cal.get_date())
+        try:
+            if tipo == 'modelo':
+                resposta = messagebox.askyesnocancel(
+                    "Horário Semanal",
+                    "Este horário se repete toda semana.\n\n"
+                    "Sim: excluir somente neste dia.\nNão: encerrar a repetição a partir deste dia.",
+                    parent=janela_disp
+                )
+                if resposta is None:
+                    return
+                if resposta:
+                    database.excluir_ocorrencia_modelo_disponibilidade(int(registro_id), data_db)
+                else:
+                    database.encerrar_modelo_disponibilidade(int(registro_id), data_db)
+            elif messagebox.askyesno("Confirmar", "Tem certeza que deseja excluir este horário?", parent=janela_disp):
+                database.excluir_disponibilidade(int(registro_id))
+            else:
+                return
+            atualizar_horarios_do_dia()
+            marcar_dias_disponiveis() # Atualiza o calendário caso o dia fique sem horários
+        except sqlite3.Error as e:
+            messagebox.showerror("Erro", f"Não foi possível excluir o horário: {e}", parent=janela_disp)
 
     # --- Botões e Eventos ---
     ttk.Button(add_frame, text="Adicionar", command=adicionar_horario).grid(row=0, column=4, padx=5)
@@ -682,6 +1243,89 @@ def abrir_janela_agenda_geral(janela_pai):
     # Carrega a disponibilidade para o dia de hoje ao abrir
     atualizar_disponibilidade_geral()
 
+def abrir_janela_horarios_livres(janela_pai):
+    """Abre uma janela com os próximos horários livres dos terapeutas (disponibilidade menos sessões marcadas)."""
+    janela_livres = tk.Toplevel(janela_pai)
+    janela_livres.title("Próximos Horários Livres")
+    janela_livres.geometry("800x500")
+    janela_livres.transient(janela_pai)
+    janela_livres.grab_set()
+
+    main_frame = ttk.Frame(janela_livres, padding=10)
+    main_frame.pack(fill='both', expand=True)
+
+    # --- Frame de Filtros ---
+    filtro_frame = ttk.Frame(main_frame)
+    filtro_frame.pack(fill='x', pady=(0, 10))
+
+    todos = "Todos os terapeutas"
+    medico_map = {m['nome_completo']: m['id'] for m in database.listar_medicos()}
+    ttk.Label(filtro_frame, text="Terapeuta:").pack(side='left', padx=(0, 5))
+    combo_medico = ttk.Combobox(filtro_frame, values=[todos] + list(medico_map.keys()), state='readonly', width=30)
+    combo_medico.set(todos)
+    combo_medico.pack(side='left')
+
+    ttk.Label(filtro_frame, text="Duração (min):").pack(side='left', padx=(15, 5))
+    spin_duracao = ttk.Spinbox(filtro_frame, from_=15, to=240, increment=15, width=5)
+    spin_duracao.set(DURACAO_PADRAO_SESSAO_MINUTOS)
+    spin_duracao.pack(side='left')
+
+    ttk.Label(filtro_frame, text="Próximos dias:").pack(side='left', padx=(15, 5))
+    spin_dias = ttk.Spinbox(filtro_frame, from_=1, to=90, width=5)
+    spin_dias.set(14)
+    spin_dias.pack(side='left')
+
+    ttk.Button(filtro_frame, text="Buscar", command=lambda: buscar_horarios()).pack(side='left', padx=15)
+
+    # --- Tabela de Horários ---
+    tree_frame = ttk.Frame(main_frame)
+    tree_frame.pack(fill='both', expand=True)
+    cols = ('data', 'dia', 'inicio', 'fim', 'terapeuta')
+    tree = ttk.Treeview(tree_frame, columns=cols, show='headings')
+    tree.heading('data', text='Data'); tree.column('data', width=100, anchor='center')
+    tree.heading('dia', text='Dia da Semana'); tree.column('dia', width=120, anchor='center')
+    tree.heading('inicio', text='Livre de'); tree.column('inicio', width=80, anchor='center')
+    tree.heading('fim', text='Até'); tree.column('fim', width=80, anchor='center')
+    tree.heading('terapeuta', text='Terapeuta'); tree.column('terapeuta', width=300)
+    tree.grid(row=0, column=0, sticky='nsew')
+    scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree.yview)
+    tree.configure(yscroll=scrollbar.set)
+    scrollbar.grid(row=0, column=1, sticky='ns')
+    tree_frame.grid_rowconfigure(0, weight=1)
+    tree_frame.grid_columnconfigure(0, weight=1)
+
+    def buscar_horarios(event=None):
+        try:
+            duracao = int(spin_duracao.get())
+            dias = int(spin_dias.get())
+        except ValueError:
+            messagebox.showerror("Erro de Validação", "A duração e o número de dias devem ser números inteiros.", parent=janela_livres)
+            return
+        agora = datetime.now()
+        medico_id = medico_map.get(combo_medico.get())
+        EXECUTOR_BANCO.executar(
+            janela_livres, database.buscar_horarios_livres,
+            agora.strftime('%Y-%m-%d'), (agora + timedelta(days=max(dias, 1) - 1)).strftime('%Y-%m-%d'), duracao,
+            medico_ids=[medico_id] if medico_id else None, hora_minima=agora.strftime('%H:%M'),
+            ao_concluir=exibir_horarios, chave='horarios_livres',
+            ao_falhar=lambda e: messagebox.showerror("Erro de Banco de Dados", f"Erro ao buscar horários livres: {e}", parent=janela_livres)
+        )
+
+    def exibir_horarios(horarios):
+        tree.delete(*tree.get_children())
+        if not horarios:
+            tree.insert("", "end", values=("", "", "", "", "Nenhum horário livre no período."))
+            return
+        for horario in horarios:
+            dia_semana = DIAS_SEMANA_INV_MAP[datetime.strptime(horario['data'], '%Y-%m-%d').weekday()]
+            tree.insert("", "end", values=(
+                formatar_data_para_exibicao(horario['data']), dia_semana,
+                horario['hora_inicio'], horario['hora_fim'], horario['medico_nome']
+            ))
+
+    combo_medico.bind("<<ComboboxSelected>>", buscar_horarios)
+    buscar_horarios()
+
 def abrir_janela_relatorio_por_plano(janela_pai, data_inicio_db, data_fim_db):
     """Abre uma janela para exibir o relatório de receitas agrupadas por plano de saúde."""
     janela_relatorio = tk.Toplevel(janela_pai)
@@ -804,23 +1448,30 @@ def abrir_janela_controle_pagamentos(janela_pai):
     tree.heading('Valor', text='Valor (R$)'); tree.column('Valor', width=100, anchor='e')
     tree.pack(side='left', fill='both', expand=True)
     scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree.yview)
-    tree.configure(yscroll=scrollbar.set)
     scrollbar.pack(side='right', fill='y')
 
+    filtro = {'termo': ''}
+
+    def formatar_pendencia(sessao):
+        valor = sessao.get('valor_sessao', 0.0)
+        return sessao['id'], (
+            sessao['id'], sessao['paciente_nome'],
+            formatar_data_para_exibicao(sessao['data_sessao']),
+            f"{valor:.2f}"
+        ), ()
+
+    paginacao = TreeviewPaginada(
+        tree, scrollbar,
+        lambda ordenar_por, decrescente, limite, deslocamento: database.listar_todas_sessoes_pendentes(
+            filtro['termo'], ordenar_por=ordenar_por, decrescente=decrescente, limite=limite, deslocamento=deslocamento),
+        formatar_pendencia,
+        colunas_ordenaveis={'Paciente': 'paciente_nome', 'Data da Sessão': 'data_sessao', 'Valor': 'valor_sessao'},
+        mensagem_erro="Erro ao carregar pendências"
+    )
+
     def recarregar_lista_pendencias():
-        termo_busca = entry_busca.get().strip()
-        for i in tree.get_children(): tree.delete(i)
-        try:
-            sessoes_pendentes = database.listar_todas_sessoes_pendentes(termo_busca)
-            for sessao in sessoes_pendentes:
-                valor = sessao.get('valor_sessao', 0.0)
-                tree.insert("", "end", iid=sessao['id'], values=(
-                    sessao['id'], sessao['paciente_nome'], 
-                    formatar_data_para_exibicao(sessao['data_sessao']), 
-                    f"{valor:.2f}"
-                ))
-        except sqlite3.Error as e:
-            messagebox.showerror("Erro de Banco de Dados", f"Erro ao carregar pendências: {e}", parent=janela_ctrl_pgto)
+        filtro['termo'] = entry_busca.get().strip()
+        paginacao.recarregar()
 
     def marcar_selecionadas_como_pagas():
         itens_selecionados = tree.selection()
@@ -828,16 +1479,22 @@ def abrir_janela_controle_pagamentos(janela_pai):
             messagebox.showwarning("Nenhuma Seleção", "Selecione uma ou mais sessões para marcar como pagas.", parent=janela_ctrl_pgto)
             return
         
-        if messagebox.askyesno("Confirmar Pagamento", f"Deseja marcar as {len(itens_selecionados)} sessões selecionadas como 'Pagas'?", parent=janela_ctrl_pgto):
-            try:
-                for item_id in itens_selecionados:
-                    valores = tree.item(item_id, 'values')
-                    valor_sessao = float(valores[3])
-                    database.atualizar_financeiro_sessao(item_id, valor_sessao, 'Pago')
-                messagebox.showinfo("Sucesso", "Pagamentos registrados com sucesso!", parent=janela_ctrl_pgto)
-                recarregar_lista_pendencias()
-            except Exception as e:
-                messagebox.showerror("Erro", f"Não foi possível atualizar os pagamentos: {e}", parent=janela_ctrl_pgto)
+        if not messagebox.askyesno("Confirmar Pagamento", f"Deseja marcar as {len(itens_selecionados)} sessões selecionadas como 'Pagas'?", parent=janela_ctrl_pgto):
+            return
+
+        def concluido(resultado):
+            for item_id in itens_selecionados:
+                paginacao.remover_linha(item_id) # Quitada, deixa de ser pendência
+            messagebox.showinfo(
+                "Sucesso",
+                f"{resultado['sessoes_alteradas']} pagamentos registrados, totalizando R$ {resultado['valor_total']:.2f}.",
+                parent=janela_ctrl_pgto
+            )
+
+        EXECUTOR_BANCO.executar(
+            janela_ctrl_pgto, database.atualizar_status_pagamento_sessoes, itens_selecionados, 'Pago', ao_concluir=concluido,
+            ao_falhar=lambda e: messagebox.showerror("Erro", f"Não foi possível atualizar os pagamentos: {e}", parent=janela_ctrl_pgto)
+        )
 
     ttk.Button(busca_frame, text="Buscar", command=recarregar_lista_pendencias).pack(side='left', padx=5)
     ttk.Button(frame, text="Marcar Selecionadas como Pagas", command=marcar_selecionadas_como_pagas).pack(side='bottom', pady=(10, 0))
@@ -892,9 +1549,36 @@ class FluxoCaixaWindow(tk.Toplevel):
         self.tree_receitas.heading('terapeuta', text='Terapeuta'); self.tree_receitas.column('terapeuta', width=250)
         self.tree_receitas.heading('valor', text='Valor (R$)'); self.tree_receitas.column('valor', width=100, anchor='e')
         self.tree_receitas.heading('status', text='Status'); self.tree_receitas.column('status', width=100, anchor='center')
-        self.tree_receitas.pack(fill='both', expand=True)
+        self.tree_receitas.pack(side='left', fill='both', expand=True)
+        scrollbar_receitas = ttk.Scrollbar(aba_receitas, orient='vertical', command=self.tree_receitas.yview)
+        scrollbar_receitas.pack(side='right', fill='y')
         self.tree_receitas.tag_configure('pago', background='#d9ead3')
         self.tree_receitas.tag_configure('pendente', background='#fce5cd')
+        self.periodo = (None, None)
+        self.paginacao_receitas = TreeviewPaginada(
+            self.tree_receitas, scrollbar_receitas, self._buscar_pagina_receitas, self._formatar_receita,
+            colunas_ordenaveis={
+                'data': 'data_sessao', 'paciente': 'paciente_nome', 'terapeuta': 'medico_nome',
+                'valor': 'valor_sessao', 'status': 'status_pagamento',
+            },
+            mensagem_erro="Erro ao carregar as movimentações"
+        )
+
+        # --- Aba de Resumo (totais agregados no banco) ---
+        aba_resumo = ttk.Frame(notebook, padding=10)
+        notebook.add(aba_resumo, text=' Resumo ')
+        cols_resumo = ('grupo', 'quantidade', 'recebido', 'a_receber')
+        self.trees_resumo = {}
+        for chave, titulo in (('terapeuta', 'Por Terapeuta'), ('mes', 'Por Mês')):
+            grupo_frame = ttk.LabelFrame(aba_resumo, text=titulo, padding=5)
+            grupo_frame.pack(side='left', fill='both', expand=True, padx=(0, 5))
+            tree = ttk.Treeview(grupo_frame, columns=cols_resumo, show='headings')
+            tree.heading('grupo', text='Terapeuta' if chave == 'terapeuta' else 'Mês'); tree.column('grupo', width=160)
+            tree.heading('quantidade', text='Sessões'); tree.column('quantidade', width=60, anchor='center')
+            tree.heading('recebido', text='Recebido (R$)'); tree.column('recebido', width=100, anchor='e')
+            tree.heading('a_receber', text='A Receber (R$)'); tree.column('a_receber', width=100, anchor='e')
+            tree.pack(fill='both', expand=True)
+            self.trees_resumo[chave] = tree
 
         # --- Aba de Despesas ---
         aba_despesas = ttk.Frame(notebook, padding=10)
@@ -938,6 +1622,8 @@ class FluxoCaixaWindow(tk.Toplevel):
         botoes_financeiro_frame.pack(fill='x', pady=(5,0))
         btn_relatorio = ttk.Button(botoes_financeiro_frame, text="Gerar Relatório por Plano de Saúde", command=self.gerar_relatorio_planos)
         btn_relatorio.pack(side='left')
+        ttk.Button(botoes_financeiro_frame, text="Exportar Relatórios de Sessões", command=lambda: abrir_janela_exportar_relatorios(self)).pack(side='left', padx=5)
+        ttk.Button(botoes_financeiro_frame, text="Recalcular Resumo Financeiro", command=self.recalcular_resumo).pack(side='right')
 
         # --- Menu de Contexto para a tabela de receitas ---
         self.menu_contexto_receitas = tk.Menu(self.tree_receitas, tearoff=0)
@@ -946,35 +1632,71 @@ class FluxoCaixaWindow(tk.Toplevel):
         self.tree_receitas.bind("<Button-3>", self.mostrar_menu_receitas)
 
     def carregar_dados_financeiros(self):
-        data_inicio_db = formatar_data_para_db(self.cal_inicio.get_date())
-        data_fim_db = formatar_data_para_db(self.cal_fim.get_date())
+        """
+        Busca as despesas e os totais do período em segundo plano; as movimentações de sessões
+        são carregadas por páginas conforme a tabela é rolada.
+        """
+        self.periodo = (formatar_data_para_db(self.cal_inicio.get_date()), formatar_data_para_db(self.cal_fim.get_date()))
+        self.carregar_totais_e_despesas()
+        self.paginacao_receitas.recarregar()
+
+    def carregar_totais_e_despesas(self):
+        """Recarrega só as despesas, a barra de totais e o resumo do período filtrado."""
+        data_inicio_db, data_fim_db = self.periodo
+
+        # Os totais vêm somados do banco, pois a tabela de receitas só tem as páginas já carregadas.
+        # Cada parte é buscada separadamente para a barra de totais não esperar pelas listas.
+        EXECUTOR_BANCO.executar(
+            self, database.calcular_totais_financeiros_por_periodo, data_inicio_db, data_fim_db,
+            ao_concluir=self._exibir_totais, chave='totais'
+        )
 
-        for i in self.tree_receitas.get_children(): self.tree_receitas.delete(i)
-        for i in self.tree_despesas.get_children(): self.tree_despesas.delete(i)
+        def buscar_resumo():
+            return (database.calcular_totais_por_terapeuta(data_inicio_db, data_fim_db),
+                    database.calcular_totais_por_data(data_inicio_db, data_fim_db, agrupar_por='mes'))
+
+        EXECUTOR_BANCO.executar(self, buscar_resumo, ao_concluir=self._exibir_resumo, chave='resumo')
+        EXECUTOR_BANCO.executar(
+            self, database.listar_despesas_por_periodo, data_inicio_db, data_fim_db,
+            ao_concluir=self._exibir_despesas, chave='despesas'
+        )
 
-        total_recebido, total_a_receber, total_despesas = 0, 0, 0
+    def _buscar_pagina_receitas(self, ordenar_por, decrescente, limite, deslocamento):
+        data_inicio_db, data_fim_db = self.periodo
+        return database.listar_sessoes_financeiro_por_periodo(
+            data_inicio_db, data_fim_db, ordenar_por=ordenar_por, decrescente=decrescente, limite=limite, deslocamento=deslocamento
+        )
 
-        sessoes = database.listar_sessoes_financeiro_por_periodo(data_inicio_db, data_fim_db)
-        for s in sessoes:
-            valor = s.get('valor_sessao', 0.0)
-            status = s.get('status_pagamento', 'Pendente')
-            tag = 'pago' if status == 'Pago' else 'pendente'
-            if status == 'Pago':
-                total_recebido += valor
-            else:
-                total_a_receber += valor
-            
-            self.tree_receitas.insert("", "end", iid=s['id'], values=(
-                s['id'], formatar_data_para_exibicao(s['data_sessao']), s['paciente_nome'], 
-                s['medico_nome'], f"{valor:.2f}", status
-            ), tags=(tag,))
+    def _formatar_receita(self, s):
+        valor = s.get('valor_sessao', 0.0)
+        status = s.get('status_pagamento', 'Pendente')
+        tag = 'pago' if status == 'Pago' else 'pendente'
+        return s['id'], (
+            s['id'], formatar_data_para_exibicao(s['data_sessao']), s['paciente_nome'],
+            s['medico_nome'], f"{valor:.2f}", status
+        ), (tag,)
 
-        despesas = database.listar_despesas_por_periodo(data_inicio_db, data_fim_db)
+    def _exibir_despesas(self, despesas):
+        for i in self.tree_despesas.get_children(): self.tree_despesas.delete(i)
         for d in despesas:
             valor = d.get('valor', 0.0)
-            total_despesas += valor
             self.tree_despesas.insert("", "end", values=(formatar_data_para_exibicao(d['data']), d['descricao'], f"{valor:.2f}"))
 
+    def _exibir_resumo(self, resumo):
+        por_terapeuta, por_mes = resumo
+        linhas = {
+            'terapeuta': [(t['medico_nome'] or '(terapeuta excluído)', t) for t in por_terapeuta],
+            'mes': [(datetime.strptime(m['periodo'], '%Y-%m').strftime('%m/%Y'), m) for m in por_mes],
+        }
+        for chave, tree in self.trees_resumo.items():
+            tree.delete(*tree.get_children())
+            for grupo, t in linhas[chave]:
+                tree.insert("", "end", values=(grupo, t['quantidade'], f"{t['total_recebido']:.2f}", f"{t['total_a_receber']:.2f}"))
+
+    def _exibir_totais(self, totais):
+        total_recebido = totais['total_recebido']
+        total_a_receber = totais['total_a_receber']
+        total_despesas = totais['total_despesas']
         saldo = total_recebido - total_despesas
         self.lbl_total_recebido.config(text=f"Total Recebido: R$ {total_recebido:.2f}")
         self.lbl_total_a_receber.config(text=f"Total a Receber: R$ {total_a_receber:.2f}")
@@ -1001,7 +1723,7 @@ class FluxoCaixaWindow(tk.Toplevel):
             database.adicionar_despesa(desc, valor, data_db)
             self.entry_desc_despesa.delete(0, 'end')
             self.entry_valor_despesa.delete(0, 'end')
-            self.carregar_dados_financeiros()
+            self.carregar_totais_e_despesas()
         except ValueError:
             messagebox.showerror("Erro", "O valor da despesa deve ser um número.", parent=self)
         except sqlite3.Error as e:
@@ -1013,29 +1735,41 @@ class FluxoCaixaWindow(tk.Toplevel):
         data_fim_db = formatar_data_para_db(self.cal_fim.get_date())
         abrir_janela_relatorio_por_plano(self, data_inicio_db, data_fim_db)
 
+    def recalcular_resumo(self):
+        """Reconstrói o resumo financeiro diário em segundo plano e recarrega os totais."""
+        if not messagebox.askyesno("Recalcular Resumo", "Recalcular o resumo financeiro a partir de todas as sessões e despesas?", parent=self):
+            return
+
+        def concluido(linhas):
+            self.carregar_totais_e_despesas()
+            messagebox.showinfo("Resumo Recalculado", f"Resumo financeiro recalculado ({linhas} linhas).", parent=self)
+
+        EXECUTOR_BANCO.executar(self, database.reconstruir_resumo_financeiro, ao_concluir=concluido, chave='resumo_diario')
+
     def mostrar_menu_receitas(self, event):
         """Exibe o menu de contexto na tabela de receitas."""
         item_id = self.tree_receitas.identify_row(event.y)
         if item_id:
-            self.tree_receitas.selection_set(item_id)
+            if item_id not in self.tree_receitas.selection(): # Mantém a seleção múltipla ao clicar sobre ela
+                self.tree_receitas.selection_set(item_id)
             self.tree_receitas.focus(item_id)
             self.menu_contexto_receitas.post(event.x_root, event.y_root)
 
     def alterar_status_pagamento_sessao(self, novo_status):
-        """Altera o status de pagamento da sessão selecionada na tabela de receitas."""
-        selected_item_id = self.tree_receitas.focus()
-        if not selected_item_id:
+        """Altera o status de pagamento das sessões selecionadas na tabela de receitas."""
+        itens_selecionados = self.tree_receitas.selection()
+        if not itens_selecionados:
             return
-        
-        try:
-            valores = self.tree_receitas.item(selected_item_id, 'values')
-            valor_atual = float(valores[4]) # O valor está na 5ª coluna (índice 4)
-            database.atualizar_financeiro_sessao(selected_item_id, valor_atual, novo_status)
-            self.carregar_dados_financeiros()
-        except (ValueError, IndexError) as e:
-            messagebox.showerror("Erro", f"Não foi possível obter os dados da sessão: {e}", parent=self)
-        except sqlite3.Error as e:
-            messagebox.showerror("Erro de Banco de Dados", f"Não foi possível atualizar o status: {e}", parent=self)
+
+        def concluido(resultado):
+            for item_id in itens_selecionados:
+                self.paginacao_receitas.atualizar_linha(item_id, status_pagamento=novo_status)
+            self.carregar_totais_e_despesas()
+
+        EXECUTOR_BANCO.executar(
+            self, database.atualizar_status_pagamento_sessoes, itens_selecionados, novo_status, ao_concluir=concluido,
+            ao_falhar=lambda e: messagebox.showerror("Erro de Banco de Dados", f"Não foi possível alterar o status: {e}", parent=self)
+        )
 
 # --- Funções para Abrir Janelas de Pacientes ---
 
@@ -1314,7 +2048,6 @@ def abrir_janela_sessoes(janela_pai, paciente_id, paciente_nome, callback_atuali
     
     tree.grid(row=0, column=0, sticky='nsew')
     scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=tree.yview)
-    tree.configure(yscroll=scrollbar.set)
     scrollbar.grid(row=0, column=1, sticky='ns')
     tree_frame.grid_rowconfigure(0, weight=1)
     tree_frame.grid_columnconfigure(0, weight=1)
@@ -1323,32 +2056,38 @@ def abrir_janela_sessoes(janela_pai, paciente_id, paciente_nome, callback_atuali
     tree.tag_configure('pago', background='#d9ead3') # Verde claro
     tree.tag_configure('pendente', background='#fce5cd') # Laranja claro
 
-    def recarregar_sessoes():
-        for i in tree.get_children():
-            tree.delete(i)
-        try:
-            for sessao in database.listar_sessoes_por_paciente(paciente_id):
-                data_exibicao = formatar_data_para_exibicao(sessao['data_sessao'])
-                valor = sessao.get('valor_sessao', 0.0)
-                status = sessao.get('status_pagamento', 'Pendente')
-
-                tag = ''
-                if status == 'Pago':
-                    tag = 'pago'
-                elif status == 'Pendente':
-                    tag = 'pendente'
-
-                tree.insert("", "end", iid=sessao['id'], values=(
-                    sessao['id'], data_exibicao, sessao['hora_inicio_sessao'] or '',
-                    sessao['medico_nome'] or 'Não definido',
-                    f"{valor:.2f}", status
-                ), tags=(tag,))
-        except sqlite3.Error as e:
-            messagebox.showerror("Erro", f"Erro ao carregar sessões: {e}", parent=janela_sessoes)
+    def formatar_sessao(sessao):
+        data_exibicao = formatar_data_para_exibicao(sessao['data_sessao'])
+        valor = sessao.get('valor_sessao', 0.0)
+        status = sessao.get('status_pagamento', 'Pendente')
+
+        tag = ''
+        if status == 'Pago':
+            tag = 'pago'
+        elif status == 'Pendente':
+            tag = 'pendente'
+
+        return sessao['id'], (
+            sessao['id'], data_exibicao, sessao['hora_inicio_sessao'] or '',
+            sessao['medico_nome'] or 'Não definido',
+            f"{valor:.2f}", status
+        ), (tag,)
+
+    paginacao = TreeviewPaginada(
+        tree, scrollbar,
+        lambda ordenar_por, decrescente, limite, deslocamento: database.listar_sessoes_por_paciente(
+            paciente_id, ordenar_por=ordenar_por, decrescente=decrescente, limite=limite, deslocamento=deslocamento),
+        formatar_sessao,
+        colunas_ordenaveis={
+            'ID': 'id', 'Data': 'data_sessao', 'Horário': 'hora_inicio_sessao', 'Terapeuta': 'medico_nome',
+            'Valor': 'valor_sessao', 'Status': 'status_pagamento',
+        },
+        mensagem_erro="Erro ao carregar sessões"
+    )
 
     def callback_combinado():
         """Função que atualiza tanto a lista de sessões quanto o calendário principal."""
-        recarregar_sessoes()
+        paginacao.atualizar()
         if callback_atualizar_calendario:
             callback_atualizar_calendario()
 
@@ -1365,7 +2104,7 @@ def abrir_janela_sessoes(janela_pai, paciente_id, paciente_nome, callback_atuali
             valor_atual = float(valores[4])
             
             database.atualizar_financeiro_sessao(selected_item_id, valor_atual, novo_status)
-            recarregar_sessoes() # Atualiza a lista para refletir a mudança
+            paginacao.atualizar_linha(selected_item_id, status_pagamento=novo_status) # Redesenha só a linha alterada
         except Exception as e:
             messagebox.showerror("Erro", f"Não foi possível atualizar o status: {e}", parent=janela_sessoes)
 
@@ -1406,6 +2145,12 @@ def abrir_janela_sessoes(janela_pai, paciente_id, paciente_nome, callback_atuali
     )
     btn_adicionar.pack(side='left', padx=5)
 
+    ttk.Button(
+        botoes_frame,
+        text="Agendar Recorrentes",
+        command=lambda: abrir_janela_agendamento_recorrente(janela_sessoes, paciente_id, paciente_nome, callback_combinado)
+    ).pack(side='left', padx=5)
+
     btn_editar = ttk.Button(
         botoes_frame,
         text="Editar Sessão",
@@ -1454,10 +2199,14 @@ def abrir_janela_sessoes(janela_pai, paciente_id, paciente_nome, callback_atuali
                 messagebox.showerror("Erro", f"Erro ao excluir sessão: {e}", parent=janela_sessoes)
 
     ttk.Button(botoes_frame, text="Gerar Relatório PDF", command=gerar_relatorio_selecionado).pack(side='right', padx=5)
+    ttk.Button(
+        botoes_frame, text="Exportar Todos (ZIP)",
+        command=lambda: abrir_janela_exportar_relatorios(janela_sessoes, paciente_id, paciente_nome)
+    ).pack(side='right', padx=5)
     ttk.Button(botoes_frame, text="Excluir Sessão", command=excluir_sessao_selecionada).pack(side='right', padx=5)
 
     # Carrega os dados iniciais
-    recarregar_sessoes()
+    paginacao.recarregar()
 
 def abrir_janela_form_sessao(janela_pai, callback_atualizar, paciente_id=None, sessao_id=None):
     """Abre um formulário para adicionar ou editar uma sessão."""
@@ -1540,6 +2289,40 @@ def abrir_janela_form_sessao(janela_pai, callback_atualizar, paciente_id=None, s
     else:  # Modo de criação
         entry_data.insert(0, date.today().strftime('%d/%m/%Y'))
 
+        # Sugere o primeiro horário livre do terapeuta na data, enquanto o usuário não digitar outro
+        sugestao = {'inicio': '', 'fim': ''}
+
+        def horario_digitado():
+            return (entry_inicio.get().strip() not in ('', sugestao['inicio'])
+                    or entry_fim.get().strip() not in ('', sugestao['fim']))
+
+        def sugerir_horario(event=None):
+            medico_id = medico_map.get(combo_medico.get())
+            data_db = formatar_data_para_db(entry_data.get().strip())
+            if horario_digitado() or not medico_id or not data_db:
+                return
+            agora = datetime.now()
+            EXECUTOR_BANCO.executar(
+                janela_form, database.buscar_horarios_livres, data_db, data_db, DURACAO_PADRAO_SESSAO_MINUTOS,
+                medico_ids=[medico_id], hora_minima=agora.strftime('%H:%M') if data_db == agora.strftime('%Y-%m-%d') else None,
+                limite=1, ao_concluir=preencher_sugestao, chave='sugestao_horario'
+            )
+
+        def preencher_sugestao(horarios):
+            if horario_digitado():
+                return
+            inicio = fim = ''
+            if horarios:
+                inicio = horarios[0]['hora_inicio']
+                fim = database.minutos_para_hora(database.hora_para_minutos(inicio) + DURACAO_PADRAO_SESSAO_MINUTOS)
+            for entry, valor in ((entry_inicio, inicio), (entry_fim, fim)):
+                entry.delete(0, 'end')
+                entry.insert(0, valor)
+            sugestao.update(inicio=inicio, fim=fim)
+
+        combo_medico.bind("<<ComboboxSelected>>", sugerir_horario)
+        entry_data.bind("<FocusOut>", sugerir_horario)
+
     # Botão Salvar
     comando_salvar = lambda: (salvar_alteracoes_sessao(janela_form, sessao_id, widgets) if sessao_id 
                                else salvar_nova_sessao(janela_form, paciente_id, widgets))
@@ -1560,6 +2343,160 @@ def abrir_janela_edicao_sessao(janela_pai, sessao_id, callback_atualizar):
     # A função de salvar alterações usará o sessao_id.
     abrir_janela_form_sessao(janela_pai, callback_atualizar=callback_atualizar, sessao_id=sessao_id)
 
+def abrir_janela_agendamento_recorrente(janela_pai, paciente_id, paciente_nome, callback_atualizar):
+    """
+    Abre uma janela para agendar várias sessões de uma vez a partir de uma regra
+    (dias da semana, horário e período). Os conflitos são mostrados todos juntos antes de gravar.
+    """
+    janela_rec = tk.Toplevel(janela_pai)
+    janela_rec.title(f"Agendamento Recorrente - {paciente_nome}")
+    janela_rec.geometry("750x600")
+    janela_rec.transient(janela_pai)
+    janela_rec.grab_set()
+
+    frame = ttk.Frame(janela_rec, padding=10)
+    frame.pack(fill='both', expand=True)
+
+    # --- Regra de Recorrência ---
+    regra_frame = ttk.LabelFrame(frame, text="Regra", padding=10)
+    regra_frame.pack(fill='x')
+
+    medico_map = {m['nome_completo']: m['id'] for m in database.listar_medicos()}
+    ttk.Label(regra_frame, text="Terapeuta:").grid(row=0, column=0, sticky='w', padx=5, pady=2)
+    combo_medico = ttk.Combobox(regra_frame, values=list(medico_map.keys()), state='readonly', width=30)
+    combo_medico.grid(row=0, column=1, columnspan=3, sticky='w', pady=2)
+
+    hoje = date.today()
+    ttk.Label(regra_frame, text="De:").grid(row=1, column=0, sticky='w', padx=5, pady=2)
+    entry_de = ttk.Entry(regra_frame, width=12)
+    entry_de.insert(0, hoje.strftime('%d/%m/%Y'))
+    entry_de.grid(row=1, column=1, sticky='w', pady=2)
+    ttk.Label(regra_frame, text="Até:").grid(row=1, column=2, sticky='w', padx=5, pady=2)
+    entry_ate = ttk.Entry(regra_frame, width=12)
+    entry_ate.insert(0, (hoje + timedelta(weeks=26)).strftime('%d/%m/%Y'))
+    entry_ate.grid(row=1, column=3, sticky='w', pady=2)
+
+    ttk.Label(regra_frame, text="Início:").grid(row=2, column=0, sticky='w', padx=5, pady=2)
+    entry_inicio = ttk.Entry(regra_frame, width=8)
+    entry_inicio.grid(row=2, column=1, sticky='w', pady=2)
+    ttk.Label(regra_frame, text="Fim:").grid(row=2, column=2, sticky='w', padx=5, pady=2)
+    entry_fim = ttk.Entry(regra_frame, width=8)
+    entry_fim.grid(row=2, column=3, sticky='w', pady=2)
+
+    ttk.Label(regra_frame, text="A cada (semanas):").grid(row=3, column=0, sticky='w', padx=5, pady=2)
+    spin_intervalo = ttk.Spinbox(regra_frame, from_=1, to=8, width=5)
+    spin_intervalo.set(1)
+    spin_intervalo.grid(row=3, column=1, sticky='w', pady=2)
+
+    dias_frame = ttk.Frame(regra_frame)
+    dias_frame.grid(row=4, column=0, columnspan=4, sticky='w', pady=(5, 0))
+    dias_vars = {}
+    for nome_dia in DIAS_SEMANA_LISTA:
+        dias_vars[nome_dia] = tk.BooleanVar(value=False)
+        ttk.Checkbutton(dias_frame, text=nome_dia.split('-')[0], variable=dias_vars[nome_dia]).pack(side='left', padx=3)
+
+    # --- Prévia das Sessões ---
+    tree_frame = ttk.Frame(frame)
+    tree_frame.pack(fill='both', expand=True, pady=10)
+    cols = ('data', 'dia', 'horario', 'situacao')
+    tree = ttk.Treeview(tree_frame, columns=cols, show='headings')
+    tree.heading('data', text='Data'); tree.column('data', width=100, anchor='center')
+    tree.heading('dia', text='Dia da Semana'); tree.column('dia', width=120, anchor='center')
+    tree.heading('horario', text='Horário'); tree.column('horario', width=110, anchor='center')
+    tree.heading('situacao', text='Situação'); tree.column('situacao', width=350)
+    tree.tag_configure('conflito', background='#f4cccc')
+    tree.pack(side='left', fill='both', expand=True)
+    scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree.yview)
+    tree.configure(yscroll=scrollbar.set)
+    scrollbar.pack(side='right', fill='y')
+
+    lbl_resumo = ttk.Label(frame, text="Defina a regra e clique em 'Verificar'.")
+    lbl_resumo.pack(anchor='w')
+
+    estado = {'medico_id': None, 'candidatos': []}
+
+    def montar_candidatos():
+        """Valida a regra e retorna (medico_id, [(data, inicio, fim), ...]) ou None."""
+        medico_id = medico_map.get(combo_medico.get())
+        de_db, ate_db = formatar_data_para_db(entry_de.get().strip()), formatar_data_para_db(entry_ate.get().strip())
+        inicio, fim = entry_inicio.get().strip(), entry_fim.get().strip()
+        dias = [DIAS_SEMANA_MAP[nome] for nome, var in dias_vars.items() if var.get()]
+        if not medico_id or not dias:
+            messagebox.showerror("Erro de Validação", "Escolha o terapeuta e ao menos um dia da semana.", parent=janela_rec)
+            return None
+        if not de_db or not ate_db or de_db > ate_db:
+            messagebox.showerror("Erro de Validação", "Informe um período válido (DD/MM/AAAA).", parent=janela_rec)
+            return None
+        try:
+            if datetime.strptime(inicio, '%H:%M') >= datetime.strptime(fim, '%H:%M'):
+                messagebox.showwarning("Lógica Inválida", "O horário de início deve ser anterior ao de fim.", parent=janela_rec)
+                return None
+            intervalo = int(spin_intervalo.get())
+        except ValueError:
+            messagebox.showerror("Formato Inválido", "Use HH:MM nos horários e um número inteiro de semanas.", parent=janela_rec)
+            return None
+        datas = database.gerar_datas_recorrentes(de_db, ate_db, dias, max(intervalo, 1))
+        return medico_id, [(data_db, inicio, fim) for data_db in datas]
+
+    def exibir_previa(conflitos):
+        tree.delete(*tree.get_children())
+        for i, (data_db, inicio, fim) in enumerate(estado['candidatos']):
+            dia_semana = DIAS_SEMANA_INV_MAP[datetime.strptime(data_db, '%Y-%m-%d').weekday()]
+            conflito = conflitos.get(i)
+            tree.insert("", "end", values=(
+                formatar_data_para_exibicao(data_db), dia_semana, f"{inicio} - {fim}",
+                f"Conflito: {conflito}" if conflito else "Livre"
+            ), tags=('conflito',) if conflito else ())
+        livres = len(estado['candidatos']) - len(conflitos)
+        lbl_resumo.config(text=f"{len(estado['candidatos'])} sessões na regra: {livres} livres, {len(conflitos)} com conflito.")
+
+    def verificar():
+        resultado = montar_candidatos()
+        if resultado is None:
+            return
+        estado['medico_id'], estado['candidatos'] = resultado
+        EXECUTOR_BANCO.executar(
+            janela_rec, database.verificar_conflitos_em_lote, estado['medico_id'], estado['candidatos'],
+            ao_concluir=exibir_previa, chave='conflitos'
+        )
+
+    def agendar():
+        resultado = montar_candidatos()
+        if resultado is None:
+            return
+        medico_id, candidatos = resultado
+        if not candidatos:
+            messagebox.showinfo("Agendamento", "A regra não gera nenhuma data no período.", parent=janela_rec)
+            return
+        if not messagebox.askyesno("Confirmar Agendamento", f"Agendar as sessões livres entre as {len(candidatos)} da regra?", parent=janela_rec):
+            return
+
+        def concluido(resultado):
+            btn_agendar.config(state='normal')
+            inseridas, conflitos = resultado
+            estado['medico_id'], estado['candidatos'] = medico_id, candidatos
+            exibir_previa(conflitos)
+            messagebox.showinfo("Agendamento", f"{inseridas} sessões agendadas. {len(conflitos)} puladas por conflito.", parent=janela_rec)
+            callback_atualizar()
+
+        def falhou(erro):
+            btn_agendar.config(state='normal')
+            messagebox.showerror("Erro de Banco de Dados", f"Não foi possível agendar as sessões: {erro}", parent=janela_rec)
+
+        # A verificação de conflitos e a inserção (com os triggers do resumo financeiro) rodam em segundo plano
+        btn_agendar.config(state='disabled') # Evita agendar duas vezes enquanto a gravação não termina
+        EXECUTOR_BANCO.executar(
+            janela_rec, database.agendar_sessoes_em_lote, paciente_id, medico_id, candidatos,
+            ao_concluir=concluido, ao_falhar=falhou
+        )
+
+    botoes_frame = ttk.Frame(frame)
+    botoes_frame.pack(fill='x', pady=(10, 0))
+    ttk.Button(botoes_frame, text="Verificar", command=verificar).pack(side='left')
+    btn_agendar = ttk.Button(botoes_frame, text="Agendar Sessões Livres", command=agendar)
+    btn_agendar.pack(side='left', padx=5)
+    ttk.Button(botoes_frame, text="Fechar", command=janela_rec.destroy).pack(side='right')
+
 def abrir_janela_prontuario(janela_pai, paciente_id, paciente_nome):
     """Abre a janela do prontuário do paciente com abas para diferentes seções."""
     janela_prontuario = tk.Toplevel(janela_pai)
@@ -1720,10 +2657,23 @@ class JanelaListaMedicos(tk.Toplevel):
 class JanelaListaPacientes(tk.Toplevel):
     """
     Janela para listar, buscar e gerenciar todos os pacientes.
+    A busca acontece enquanto se digita: com o índice em memória carregado, as teclas filtram
+    sem consultar o banco; sem ele (clínicas muito grandes) a busca vai à FTS5 do banco.
+    O índice só é montado na primeira busca e é descartado a cada edição, para não exibir
+    dados antigos (ex.: uma pendência já quitada); a busca seguinte o monta de novo.
     """
+    ATRASO_BUSCA_MS = 250 # Espera após a última tecla antes de buscar no banco
+    ATRASO_BUSCA_INDICE_MS = 60 # Com o índice em memória a busca é barata
+    LIMITE_INDICE_MEMORIA = 20000 # Acima disso a busca fica só no banco
+
     def __init__(self, parent: tk.Tk, callback_atualizar_calendario: Callable):
         super().__init__(parent)
         self.callback_atualizar_calendario = callback_atualizar_calendario
+        self.indice = None
+        self._geracao_indice = 0 # Incrementada a cada descarte; um índice montado antes dela é ignorado
+        self._montando_indice = False
+        self._indice_indisponivel = False # Pacientes demais para manter em memória
+        self._busca_agendada = None
 
         self.title("Lista de Pacientes Cadastrados")
         self.geometry("950x500") # Aumentado para caber a nova coluna
@@ -1746,6 +2696,7 @@ class JanelaListaPacientes(tk.Toplevel):
         self.entry_busca = ttk.Entry(busca_frame, width=40)
         self.entry_busca.pack(side='left', expand=True, fill='x', padx=5)
         self.entry_busca.bind("<Return>", lambda event: self.recarregar_lista())
+        self.entry_busca.bind("<KeyRelease>", self._agendar_busca)
 
         ttk.Button(busca_frame, text="Buscar", command=self.recarregar_lista).pack(side='left')
         ttk.Button(busca_frame, text="Limpar", command=self.limpar_busca).pack(side='left', padx=5)
@@ -1772,18 +2723,30 @@ class JanelaListaPacientes(tk.Toplevel):
         
         self.tree.grid(row=0, column=0, sticky='nsew')
         scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        self.tree.configure(yscroll=scrollbar.set)
         scrollbar.grid(row=0, column=1, sticky='ns')
         tree_frame.grid_rowconfigure(0, weight=1)
         tree_frame.grid_columnconfigure(0, weight=1)
 
+        # Os pacientes são carregados por páginas conforme a lista é rolada
+        self.termo_busca = ''
+        self.paginacao = TreeviewPaginada(
+            self.tree, scrollbar, self._buscar_pagina_pacientes, self._formatar_paciente,
+            colunas_ordenaveis={
+                'ID': 'id', 'Nome Completo': 'nome_completo', 'Status Pagamento': 'tem_pendencia',
+                'Nascimento': 'data_nascimento', 'Responsável': 'nome_responsavel', 'Telefone': 'telefone_responsavel',
+                'Plano de Saúde': 'plano_saude_nome', 'Valor Padrão': 'valor_sessao_padrao',
+            },
+            mensagem_erro="Ocorreu um erro ao buscar pacientes",
+            contexto_busca=lambda: (self.termo_busca, self.indice)
+        )
+
         # --- Botões de Ação Principais ---
         botoes_frame = ttk.Frame(frame)
         botoes_frame.pack(fill='x', side='bottom', pady=(10, 0))
         
         # Botões principais movidos para o menu de contexto para uma UI mais limpa
-        ttk.Button(botoes_frame, text="Adicionar Novo Paciente", command=lambda: abrir_janela_cadastro(self, self.recarregar_lista)).pack(side='left')
-        ttk.Button(botoes_frame, text="Atualizar Lista", command=self.recarregar_lista).pack(side='right')
+        ttk.Button(botoes_frame, text="Adicionar Novo Paciente", command=lambda: abrir_janela_cadastro(self, self.atualizar_lista)).pack(side='left')
+        ttk.Button(botoes_frame, text="Atualizar Lista", command=self.atualizar_lista).pack(side='right')
 
         # --- Menu de Contexto ---
         self.menu_contexto = tk.Menu(self.tree, tearoff=0)
@@ -1801,31 +2764,107 @@ class JanelaListaPacientes(tk.Toplevel):
         self.tree.bind("<Button-1>", self.on_cell_click)
 
     def recarregar_lista(self):
-        termo_busca = self.entry_busca.get().strip()
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-        try:
-            pacientes = database.buscar_pacientes_por_nome(termo_busca) if termo_busca else database.listar_pacientes()
-            for paciente in pacientes:
-                # Verifica se o paciente tem pendências financeiras
-                tem_pendencia = database.verificar_pendencias_paciente(paciente['id'])
-                status_pagamento = "Pendente" if tem_pendencia else "Em dia"
-                tag = 'paciente_pendente' if tem_pendencia else ''
-
-                idade = calcular_idade(paciente.get('data_nascimento', ''))
-                data_nasc_exibicao = formatar_data_para_exibicao(paciente['data_nascimento'])
-                # Valores reordenados para corresponder às novas colunas
-                valores = (
-                    paciente['id'], paciente['nome_completo'], status_pagamento,
-                    idade, 
-                    data_nasc_exibicao, paciente['nome_responsavel'], 
-                    paciente.get('telefone_responsavel') or "",
-                    paciente.get('plano_saude_nome') or "Não definido",
-                    f"{paciente.get('valor_sessao_padrao', 0.0):.2f}"
-                )
-                self.tree.insert("", "end", values=valores, tags=(tag,))
-        except sqlite3.Error as e:
-            messagebox.showerror("Erro de Banco de Dados", f"Ocorreu um erro ao buscar pacientes: {e}", parent=self)
+        self._cancelar_busca_agendada()
+        self.termo_busca = self.entry_busca.get().strip()
+        self._preparar_indice()
+        self.paginacao.recarregar()
+
+    def atualizar_lista(self):
+        """Após uma edição, atualiza só as linhas que mudaram, mantendo busca, rolagem e seleção."""
+        self._descartar_indice()
+        self.paginacao.atualizar()
+
+    def _agendar_busca(self, event=None):
+        """Reinicia a espera a cada tecla; a busca só roda quando o usuário para de digitar."""
+        self._cancelar_busca_agendada()
+        atraso = self.ATRASO_BUSCA_INDICE_MS if self.indice is not None else self.ATRASO_BUSCA_MS
+        self._busca_agendada = self.after(atraso, self._buscar_digitado)
+
+    def _cancelar_busca_agendada(self):
+        if self._busca_agendada is not None:
+            self.after_cancel(self._busca_agendada)
+            self._busca_agendada = None
+
+    def _buscar_digitado(self):
+        self._busca_agendada = None
+        termo = self.entry_busca.get().strip()
+        if termo == self.termo_busca:
+            return # Teclas que não mudam o texto (setas, Shift...)
+        self.termo_busca = termo
+        self._preparar_indice()
+        # Aplica só a diferença na tabela; uma busca ainda em andamento é descartada pela paginação
+        self.paginacao.atualizar()
+
+    def _preparar_indice(self):
+        """Na primeira busca, monta em segundo plano o índice em memória; até ele ficar pronto a busca vai ao banco."""
+        if not self.termo_busca or self.indice is not None or self._montando_indice or self._indice_indisponivel:
+            return
+        limite = self.LIMITE_INDICE_MEMORIA
+
+        def construir():
+            if database.contar_pacientes() > limite:
+                return None
+            pacientes = database.listar_pacientes_com_pendencias()
+            return IndicePrefixos(pacientes, lambda p: ' '.join((
+                p['nome_completo'], p['nome_responsavel'] or '', p['telefone_responsavel'] or '',
+                re.sub(r'\D', '', p['telefone_responsavel'] or '')
+            )))
+
+        def falhou(erro):
+            self._montando_indice = False
+            print(f"Índice de busca em memória indisponível: {erro}")
+
+        self._montando_indice = True
+        geracao = self._geracao_indice
+        EXECUTOR_BANCO.executar(self, construir, ao_concluir=lambda indice: self._definir_indice(indice, geracao),
+                                ao_falhar=falhou, chave='indice')
+
+    def _definir_indice(self, indice, geracao):
+        self._montando_indice = False
+        if geracao != self._geracao_indice:
+            return # Houve uma edição enquanto o índice era montado; a próxima busca monta outro
+        if indice is None:
+            self._indice_indisponivel = True
+        self.indice = indice
+
+    def _descartar_indice(self):
+        """Depois de uma edição o índice pode estar desatualizado; a próxima busca monta outro."""
+        self.indice = None
+        self._geracao_indice += 1
+        self._montando_indice = False
+        self._indice_indisponivel = False # O número de pacientes pode ter mudado
+
+    @staticmethod
+    def _buscar_pagina_pacientes(ordenar_por, decrescente, limite, deslocamento, termo_busca, indice):
+        """Roda em segundo plano: o termo e o índice chegam como argumentos, lidos na thread do Tk."""
+        if termo_busca and indice is not None:
+            # Filtra no índice em memória, com a mesma ordenação que o banco usaria
+            pacientes = indice.filtrar(termo_busca)
+            if ordenar_por:
+                pacientes.sort(key=lambda p: (p[ordenar_por] is not None, p[ordenar_por]), reverse=decrescente)
+            return pacientes[deslocamento:deslocamento + limite]
+        # A situação financeira já vem na mesma consulta (sem uma ida ao banco por paciente)
+        return database.listar_pacientes_com_pendencias(
+            termo_busca, ordenar_por=ordenar_por, decrescente=decrescente, limite=limite, deslocamento=deslocamento
+        )
+
+    def _formatar_paciente(self, paciente):
+        tem_pendencia = paciente['tem_pendencia']
+        status_pagamento = "Pendente" if tem_pendencia else "Em dia"
+        tag = 'paciente_pendente' if tem_pendencia else ''
+
+        idade = calcular_idade(paciente.get('data_nascimento', ''))
+        data_nasc_exibicao = formatar_data_para_exibicao(paciente['data_nascimento'])
+        # Valores reordenados para corresponder às novas colunas
+        valores = (
+            paciente['id'], paciente['nome_completo'], status_pagamento,
+            idade,
+            data_nasc_exibicao, paciente['nome_responsavel'],
+            paciente.get('telefone_responsavel') or "",
+            paciente.get('plano_saude_nome') or "Não definido",
+            f"{paciente.get('valor_sessao_padrao', 0.0):.2f}"
+        )
+        return paciente['id'], valores, (tag,)
 
     def limpar_busca(self):
         self.entry_busca.delete(0, 'end')
@@ -1881,7 +2920,7 @@ class JanelaListaPacientes(tk.Toplevel):
         paciente_info = self._get_selected_paciente_info()
         if paciente_info:
             paciente_id = paciente_info[0]
-            abrir_janela_edicao(self, paciente_id, self.recarregar_lista)
+            abrir_janela_edicao(self, paciente_id, self.atualizar_lista)
 
     def ver_sessoes_selecionado(self):
         paciente_info = self._get_selected_paciente_info()
@@ -1899,7 +2938,7 @@ class JanelaListaPacientes(tk.Toplevel):
         paciente_info = self._get_selected_paciente_info()
         if paciente_info:
             paciente_id, paciente_nome = paciente_info[0], paciente_info[1]
-            abrir_janela_pagamentos_pendentes(self, paciente_id, paciente_nome, self.recarregar_lista)
+            abrir_janela_pagamentos_pendentes(self, paciente_id, paciente_nome, self.atualizar_lista)
 
     def excluir_selecionado(self):
         paciente_info = self._get_selected_paciente_info()
@@ -1908,8 +2947,9 @@ class JanelaListaPacientes(tk.Toplevel):
             if messagebox.askyesno("Confirmar Exclusão", f"Tem certeza que deseja excluir '{paciente_nome}'?", parent=self):
                 try:
                     database.excluir_paciente(paciente_id)
+                    self.paginacao.remover_linha(paciente_id)
+                    self._descartar_indice()
                     messagebox.showinfo("Sucesso", "Paciente excluído com sucesso.", parent=self)
-                    self.recarregar_lista()
                 except sqlite3.Error as e:
                     messagebox.showerror("Erro de Banco de Dados", f"Ocorreu um erro ao excluir: {e}", parent=self)
 
@@ -2160,23 +3200,47 @@ def abrir_janela_principal():
 
     # --- Funções e Botões (que dependem do calendário) ---
 
-    def atualizar_eventos_calendario(calendario):
-        """Busca as datas com sessões e as marca no calendário."""
-        # Limpa todos os eventos antigos para não duplicar
-        calendario.calevent_remove('all')
-        
-        datas_sessoes = database.listar_datas_sessoes()
-        for data_str in datas_sessoes:
-            try:
-                data_obj = datetime.strptime(data_str, '%Y-%m-%d').date()
-                # Cria um evento naquela data com uma tag específica
-                calendario.calevent_create(data_obj, 'Sessão Agendada', tags='sessao_marcada')
-            except (ValueError, TypeError):
-                continue # Ignora datas em formato inválido
+    eventos_calendario = {} # data -> id do evento criado no calendário
+
+    def atualizar_eventos_calendario(calendario, ao_concluir=None):
+        """
+        Marca no calendário os dias com sessões do mês exibido e dos meses vizinhos.
+        A busca usa o cache por mês do banco e só os dias que mudaram são recriados.
+        """
+        mes, ano = calendario.get_displayed_month()
+        meses = []
+        for deslocamento in (-1, 0, 1):
+            ano_m, mes_m = divmod((ano * 12 + mes - 1) + deslocamento, 12)
+            meses.append((ano_m, mes_m + 1))
+
+        def buscar_datas():
+            datas = set()
+            for ano_m, mes_m in meses:
+                datas.update(database.listar_datas_sessoes_do_mes(ano_m, mes_m))
+            return datas
+
+        def marcar_datas(datas_sessoes):
+            datas_desejadas = set()
+            for data_str in datas_sessoes:
+                try:
+                    datas_desejadas.add(datetime.strptime(data_str, '%Y-%m-%d').date())
+                except (ValueError, TypeError):
+                    continue # Ignora datas em formato inválido
+            # Remove apenas os dias que deixaram de ter sessões (ou saíram da janela de meses)
+            for data_obj in set(eventos_calendario) - datas_desejadas:
+                calendario.calevent_remove(eventos_calendario.pop(data_obj))
+            # Cria eventos apenas para os dias novos
+            for data_obj in datas_desejadas - set(eventos_calendario):
+                eventos_calendario[data_obj] = calendario.calevent_create(data_obj, 'Sessão Agendada', tags='sessao_marcada')
+            if ao_concluir:
+                ao_concluir()
+
+        EXECUTOR_BANCO.executar(calendario, buscar_datas, ao_concluir=marcar_datas, chave='calendario')
 
     # --- Botões de Ação (no frame da esquerda) ---
     botoes = [
         ("Agenda Geral", lambda: abrir_janela_agenda_geral(root)),
+        ("Próximos Horários Livres", lambda: abrir_janela_horarios_livres(root)),
         ("Cadastrar Paciente", lambda: abrir_janela_cadastro(root, lambda: atualizar_eventos_calendario(cal))),
         ("Controle de Pagamentos", lambda: abrir_janela_controle_pagamentos(root)),
         ("Gestão Financeira", lambda: FluxoCaixaWindow(root)),
@@ -2187,6 +3251,7 @@ def abrir_janela_principal():
     if USUARIO_LOGADO and USUARIO_LOGADO['nivel_acesso'] == 'admin':
         botoes.extend([
             ("Backup do Sistema", lambda: realizar_backup(root)),
+            ("Backup Incremental", lambda: realizar_backup_incremental(root)),
             ("Gerenciar Médicos", lambda: JanelaListaMedicos(root)),
             ("Gerenciar Planos", lambda: JanelaGerenciarPlanos(root)),
             ("Gerenciar Usuários", lambda: abrir_janela_gerenciar_usuarios(root)),
@@ -2200,9 +3265,9 @@ def abrir_janela_principal():
 
     def atualizar_dashboard():
         """Função que atualiza todos os componentes do dashboard."""
-        atualizar_eventos_calendario(cal)
         atualizar_agenda_do_dia()
-        messagebox.showinfo("Atualização", "Dashboard atualizado com sucesso!", parent=root)
+        database.limpar_cache_datas_sessoes() # Força a releitura (inclui alterações de outras estações)
+        atualizar_eventos_calendario(cal, ao_concluir=lambda: messagebox.showinfo("Atualização", "Dashboard atualizado com sucesso!", parent=root))
 
     def atualizar_agenda_do_dia(event=None):
         """Busca e exibe as sessões para o dia selecionado no calendário."""
@@ -2219,6 +3284,7 @@ def abrir_janela_principal():
 
     # --- Binds e Carregamento Inicial ---
     cal.bind("<<CalendarSelected>>", atualizar_agenda_do_dia)
+    cal.bind("<<CalendarMonthChanged>>", lambda e: atualizar_eventos_calendario(cal))
 
     btn_atualizar_dash = tk.Button(left_frame, text="Atualizar Dashboard", font=("Helvetica", 11), command=atualizar_dashboard)
     btn_atualizar_dash.pack(side='bottom', pady=10, fill='x')
@@ -2226,6 +3292,8 @@ def abrir_janela_principal():
     # Carregamento inicial
     atualizar_eventos_calendario(cal)
     atualizar_agenda_do_dia() # Carrega a agenda para o dia de hoje
+    agendar_backup_automatico(root)
+    agendar_otimizacao_estatisticas(root)
 
     root.mainloop()
 
@@ -2233,11 +3301,11 @@ def abrir_janela_login():
     """Abre a janela de login inicial do sistema."""
     login_window = tk.Tk()
     login_window.title("Login - Sistema de Clínica")
-    login_window.geometry("350x180")
+    login_window.geometry("350x205")
     login_window.resizable(True, True)
 
     # Centraliza a janela na tela
-    window_width, window_height = 350, 180
+    window_width, window_height = 350, 205
     screen_width = login_window.winfo_screenwidth()
     screen_height = login_window.winfo_screenheight()
     center_x = int(screen_width/2 - window_width / 2)
@@ -2256,24 +3324,54 @@ def abrir_janela_login():
     entry_pass = ttk.Entry(frame, width=30, show="*")
     entry_pass.pack(fill='x', pady=(0, 15))
 
-    def tentar_login():
-        usuario = entry_user.get().strip()
-        senha = entry_pass.get().strip()
-        if not usuario or not senha:
-            messagebox.showerror("Erro", "Usuário e senha são obrigatórios.", parent=login_window)
-            return
+    btn_login = ttk.Button(frame, text="Login")
+    btn_login.pack(fill='x')
+    # Indicador exibido enquanto a senha é verificada (o PBKDF2 leva algumas centenas de milissegundos)
+    spinner = ttk.Progressbar(frame, mode='indeterminate')
+
+    def aguardar_verificacao(ativo):
+        estado = 'disabled' if ativo else 'normal'
+        for widget in (entry_user, entry_pass, btn_login):
+            widget.config(state=estado)
+        if ativo:
+            spinner.pack(fill='x', pady=(10, 0))
+            spinner.start(15)
+        else:
+            spinner.stop()
+            spinner.pack_forget()
 
-        usuario_valido = database.verificar_usuario(usuario, senha)
+    def login_verificado(usuario_valido):
         if usuario_valido:
             global USUARIO_LOGADO
             USUARIO_LOGADO = usuario_valido
             login_window.destroy()
             abrir_janela_principal()
         else:
+            aguardar_verificacao(False)
             messagebox.showerror("Falha no Login", "Nome de usuário ou senha incorretos.", parent=login_window)
+            entry_pass.focus_set()
+
+    def falha_verificacao(erro):
+        aguardar_verificacao(False)
+        messagebox.showerror("Erro de Banco de Dados", f"Não foi possível verificar o login: {erro}", parent=login_window)
+
+    def tentar_login():
+        if str(btn_login.cget('state')) == 'disabled':
+            return # Uma verificação já está em andamento
+        usuario = entry_user.get().strip()
+        senha = entry_pass.get().strip()
+        if not usuario or not senha:
+            messagebox.showerror("Erro", "Usuário e senha são obrigatórios.", parent=login_window)
+            return
+
+        aguardar_verificacao(True)
+        EXECUTOR_BANCO.executar(
+            login_window, database.verificar_usuario, usuario, senha,
+            ao_concluir=login_verificado, ao_falhar=falha_verificacao
+        )
 
     entry_pass.bind("<Return>", lambda event: tentar_login())
-    ttk.Button(frame, text="Login", command=tentar_login).pack(fill='x')
+    btn_login.config(command=tentar_login)
     login_window.mainloop()
 
 def main():
@@ -2285,6 +3383,8 @@ def main():
         messagebox.showerror("Erro Crítico", f"Erro ao inicializar o banco de dados:\n\n{e}")
         return
     abrir_janela_login()
+    # Ao sair, as conexões atualizam as estatísticas das tabelas que consultaram (PRAGMA optimize)
+    database.fechar_conexoes(otimizar=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
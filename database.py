@@ -3,32 +3,573 @@ import hashlib # Para criptografar senhas
 import hmac # Para comparação segura de hashes em versões mais antigas do Python
 import os # Para gerar o "salt" das senhas
 import shutil
+import gzip
+import json
+import struct
+import tempfile
+import urllib.request
+import queue
+import random
+import threading
+import time
+import functools
+import calendar
+import re
+import sys
+import multiprocessing
+import tracemalloc
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
 
 DB_FILE = 'clinica.db'
 
+# --- Gerenciamento de Conexões ---
+
+POOL_TAMANHO = 4 # Número máximo de conexões abertas ao mesmo tempo
+POOL_TIMEOUT = 30.0 # Segundos de espera por uma conexão livre antes de desistir
+CACHE_INSTRUCOES = 256 # Instruções preparadas mantidas em cache por conexão
+
+# --- Concorrência entre estações de trabalho ---
+# None = automático: WAL para discos locais e DELETE para caminhos de rede (\\servidor\pasta),
+# já que o WAL depende de memória compartilhada e não funciona em pastas de rede.
+JOURNAL_MODE = None
+ANALISE_LIMITE_LINHAS = 1000 # Linhas examinadas por índice ao refazer as estatísticas (PRAGMA analysis_limit)
+BUSY_TIMEOUT_MS = 5000 # Tempo que o SQLite espera por um bloqueio antes de retornar "database is locked"
+ESCRITA_TENTATIVAS = 5 # Tentativas de uma transação de escrita antes de desistir
+ESCRITA_BACKOFF_INICIAL = 0.1 # Segundos de espera após a primeira falha (dobra a cada tentativa)
+ESCRITA_BACKOFF_MAXIMO = 2.0
+
+def _modo_journal(caminho):
+    """Retorna o modo de journal configurado ou o padrão adequado para o local do arquivo."""
+    if JOURNAL_MODE:
+        return JOURNAL_MODE
+    caminho_abs = os.path.abspath(caminho)
+    if caminho_abs.startswith(('\\\\', '//')):
+        return 'DELETE'
+    return 'WAL'
+
+class PoolConexoes:
+    """
+    Pool de conexões SQLite reutilizáveis.
+    Cada conexão é aberta uma única vez (já com foreign_keys=ON) e devolvida ao pool
+    após o uso, preservando o cache de instruções preparadas entre as chamadas.
+    """
+    def __init__(self, caminho, tamanho=POOL_TAMANHO, timeout=POOL_TIMEOUT):
+        self.caminho = caminho
+        self.tamanho = tamanho
+        self.timeout = timeout
+        self._livres = queue.LifoQueue()
+        self._todas = []
+        self._abertas = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.acertos = 0 # Conexões reutilizadas
+        self.falhas = 0 # Conexões que precisaram ser abertas
+        self.tempo_espera = 0.0 # Tempo total (s) aguardando uma conexão livre
+
+    def _criar_conexao(self):
+        conn = sqlite3.connect(self.caminho, cached_statements=CACHE_INSTRUCOES, check_same_thread=False)
+        conn.row_factory = sqlite3.Row # Resultados acessíveis por nome e por índice
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT_MS):d}")
+        modo = conn.execute(f"PRAGMA journal_mode = {_modo_journal(self.caminho)}").fetchone()[0]
+        if modo.lower() == 'wal':
+            conn.execute("PRAGMA synchronous = NORMAL") # Seguro em WAL e evita um fsync por commit
+        return conn
+
+    def _adquirir(self):
+        """Obtém uma conexão livre, abrindo uma nova se o limite ainda não foi atingido."""
+        try:
+            conn = self._livres.get_nowait()
+            with self._lock:
+                self.acertos += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            pode_criar = self._abertas < self.tamanho
+            if pode_criar:
+                self._abertas += 1 # Reserva a vaga antes de abrir a conexão fora do lock
+        if pode_criar:
+            try:
+                conn = self._criar_conexao()
+            except sqlite3.Error:
+                with self._lock:
+                    self._abertas -= 1
+                raise
+            with self._lock:
+                self._todas.append(conn)
+                self.falhas += 1
+            return conn
+
+        inicio = time.perf_counter()
+        try:
+            conn = self._livres.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Tempo esgotado aguardando uma conexão livre com o banco de dados.")
+        finally:
+            with self._lock:
+                self.tempo_espera += time.perf_counter() - inicio
+        with self._lock:
+            self.acertos += 1
+        return conn
+
+    @contextmanager
+    def conexao(self):
+        """
+        Empresta uma conexão do pool. Faz commit ao sair normalmente e rollback em caso de erro.
+        Chamadas aninhadas na mesma thread reaproveitam a conexão (e a transação) já em uso.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            with self._lock:
+                self.acertos += 1
+            yield conn
+            return
+
+        conn = self._adquirir()
+        self._local.conn = conn
+        self._local.apos_commit = []
+        confirmado = False
+        try:
+            with conn:
+                yield conn
+            confirmado = True
+        finally:
+            callbacks = self._local.apos_commit
+            self._local.conn = None
+            self._local.apos_commit = []
+            self._livres.put(conn)
+        if confirmado:
+            for callback in callbacks:
+                callback()
+
+    @contextmanager
+    def conexao_dedicada(self):
+        """
+        Empresta uma conexão só para o bloco, sem registrá-la como a conexão da thread: as outras
+        chamadas da mesma thread continuam com a sua própria conexão e transação. Usada pelos
+        geradores iter_*, que podem ficar pausados (ou ser finalizados em outra thread).
+        """
+        conn = self._adquirir()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._livres.put(conn)
+
+    def apos_commit(self, callback):
+        """Agenda callback para depois do commit da transação desta thread (ou executa já, se não houver uma)."""
+        if getattr(self._local, 'conn', None) is None:
+            callback()
+        else:
+            self._local.apos_commit.append(callback)
+
+    def conexao_atual(self):
+        """Retorna a conexão já emprestada para a thread atual, ou None."""
+        return getattr(self._local, 'conn', None)
+
+    def estatisticas(self):
+        """Retorna os contadores de uso do pool."""
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': self.acertos / total if total else 0.0,
+                'tempo_espera': self.tempo_espera,
+                'conexoes_abertas': self._abertas,
+                'tamanho': self.tamanho,
+            }
+
+    def otimizar(self):
+        """
+        Roda PRAGMA optimize nas conexões livres: o SQLite refaz as estatísticas (sqlite_stat1) das
+        tabelas que cada conexão consultou e que cresceram muito desde a última análise.
+        """
+        livres = []
+        try:
+            while True:
+                livres.append(self._livres.get_nowait())
+        except queue.Empty:
+            pass
+        try:
+            for conn in livres:
+                _otimizar_conexao(conn)
+        finally:
+            for conn in livres:
+                self._livres.put(conn)
+
+    def fechar(self, aguardar=None, otimizar=False):
+        """
+        Fecha todas as conexões abertas. Sem 'aguardar' não deve haver operações em andamento;
+        com ele, espera até 'aguardar' segundos que as conexões emprestadas sejam devolvidas
+        e lança OperationalError se alguma continuar em uso. Com 'otimizar', roda PRAGMA optimize
+        em cada conexão antes de fechá-la (recomendado ao encerrar o aplicativo).
+        """
+        if aguardar is not None:
+            limite = time.monotonic() + aguardar
+            with self._lock:
+                abertas = self._abertas
+            devolvidas = []
+            while len(devolvidas) < abertas:
+                try:
+                    devolvidas.append(self._livres.get(timeout=max(limite - time.monotonic(), 0)))
+                except queue.Empty:
+                    for conn in devolvidas:
+                        self._livres.put(conn)
+                    raise sqlite3.OperationalError("O banco de dados ainda está em uso. Tente novamente em instantes.")
+        with self._lock:
+            conexoes, self._todas = self._todas, []
+            self._abertas = 0
+            self._livres = queue.LifoQueue()
+        for conn in conexoes:
+            if otimizar:
+                _otimizar_conexao(conn)
+            conn.close()
+
+def _otimizar_conexao(conn):
+    try:
+        conn.execute(f"PRAGMA analysis_limit = {int(ANALISE_LIMITE_LINHAS):d}") # Mantém a análise rápida em tabelas grandes
+        conn.execute("PRAGMA optimize")
+    except sqlite3.Error as e:
+        print(f"Não foi possível atualizar as estatísticas do banco: {e}")
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_liberado = threading.Condition(_pool_lock) # Avisada quando termina uma troca do arquivo do banco
+_pool_em_troca = False
+
+def _obter_pool():
+    """
+    Retorna o pool do arquivo atual, recriando-o se DB_FILE tiver mudado.
+    Durante uma troca do arquivo (_banco_fechado), só passa a thread que já tem uma conexão
+    emprestada, para terminar a operação em andamento; as demais esperam a troca acabar.
+    """
+    global _pool
+    with _pool_lock:
+        while _pool_em_troca and (_pool is None or _pool.conexao_atual() is None):
+            _pool_liberado.wait()
+        if _pool is None or _pool.caminho != DB_FILE:
+            if _pool is not None:
+                _pool.fechar()
+            _pool = PoolConexoes(DB_FILE)
+        return _pool
+
+def _conexao():
+    """Atalho usado por todas as funções de consulta para obter uma conexão do pool."""
+    return _obter_pool().conexao()
+
+def configurar_pool(tamanho=None, timeout=None):
+    """Ajusta o tamanho máximo e o tempo de espera do pool de conexões."""
+    global POOL_TAMANHO, POOL_TIMEOUT
+    if tamanho is not None:
+        if tamanho < 1:
+            raise ValueError("O pool precisa de pelo menos uma conexão.")
+        POOL_TAMANHO = tamanho
+    if timeout is not None:
+        POOL_TIMEOUT = timeout
+    pool = _obter_pool()
+    pool.tamanho, pool.timeout = POOL_TAMANHO, POOL_TIMEOUT
+
+def estatisticas_pool():
+    """Retorna os contadores de acertos/falhas e o tempo de espera do pool de conexões."""
+    return _obter_pool().estatisticas()
+
+def fechar_conexoes(otimizar=False):
+    """
+    Fecha todas as conexões do pool (ex.: antes de substituir o arquivo do banco).
+    Com 'otimizar', atualiza antes as estatísticas do planejador (ver PoolConexoes.otimizar).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.fechar(otimizar=otimizar)
+            _pool = None
+
+def otimizar_estatisticas():
+    """
+    Atualiza as estatísticas do planejador de consultas nas conexões livres do pool. Chamada
+    periodicamente: estatísticas tiradas com o banco ainda pequeno levam o SQLite a preferir
+    varrer tabelas inteiras a usar os índices depois que elas crescem.
+    """
+    _obter_pool().otimizar()
+
+@contextmanager
+def _banco_fechado(aguardar):
+    """
+    Fecha todas as conexões do pool e impede que novas sejam abertas até o fim do bloco,
+    para que o arquivo do banco possa ser substituído. As operações em andamento têm até
+    'aguardar' segundos para terminar.
+    """
+    global _pool, _pool_em_troca
+    with _pool_lock:
+        while _pool_em_troca:
+            _pool_liberado.wait()
+        _pool_em_troca = True # Novas chamadas a _obter_pool esperam até o fim do bloco
+        pool = _pool
+    try:
+        if pool is not None:
+            # Sem segurar _pool_lock: a operação em andamento ainda passa por _obter_pool para terminar
+            pool.fechar(aguardar=aguardar)
+            with _pool_lock:
+                if _pool is pool:
+                    _pool = None
+        yield
+    finally:
+        with _pool_lock:
+            _pool_em_troca = False
+            _pool_liberado.notify_all()
+
+def configurar_concorrencia(journal_mode=None, busy_timeout_ms=None, tentativas=None):
+    """
+    Ajusta o modo de journal ('WAL', 'DELETE', ...), o busy_timeout e o número de tentativas
+    das escritas. As conexões abertas são fechadas para que as novas usem a configuração.
+    """
+    global JOURNAL_MODE, BUSY_TIMEOUT_MS, ESCRITA_TENTATIVAS
+    if journal_mode is not None:
+        JOURNAL_MODE = journal_mode.upper()
+    if busy_timeout_ms is not None:
+        BUSY_TIMEOUT_MS = busy_timeout_ms
+    if tentativas is not None:
+        if tentativas < 1:
+            raise ValueError("É necessária pelo menos uma tentativa de escrita.")
+        ESCRITA_TENTATIVAS = tentativas
+    fechar_conexoes()
+
+# Tempo de espera por bloqueio, por função de escrita
+_estatisticas_bloqueio = {}
+_estatisticas_bloqueio_lock = threading.Lock()
+
+def _erro_de_bloqueio(erro):
+    mensagem = str(erro).lower()
+    return 'locked' in mensagem or 'busy' in mensagem
+
+def _registrar_espera(nome_funcao, espera, tentativas):
+    with _estatisticas_bloqueio_lock:
+        estat = _estatisticas_bloqueio.setdefault(nome_funcao, {
+            'chamadas': 0, 'novas_tentativas': 0, 'espera_total': 0.0, 'espera_maxima': 0.0, 'ultima_espera': 0.0
+        })
+        estat['chamadas'] += 1
+        estat['novas_tentativas'] += tentativas - 1
+        estat['espera_total'] += espera
+        estat['espera_maxima'] = max(estat['espera_maxima'], espera)
+        estat['ultima_espera'] = espera
+    if tentativas > 1:
+        print(f"Banco ocupado: '{nome_funcao}' aguardou {espera * 1000:.0f} ms ({tentativas} tentativas).")
+
+def estatisticas_bloqueio():
+    """Retorna, por função de escrita, o número de chamadas, novas tentativas e o tempo (s) aguardando bloqueios."""
+    with _estatisticas_bloqueio_lock:
+        return {nome: dict(estat) for nome, estat in _estatisticas_bloqueio.items()}
+
+def _transacao_escrita(funcao):
+    """
+    Decorador para funções que escrevem no banco. Abre a transação com BEGIN IMMEDIATE
+    (o bloqueio de escrita é obtido logo no início, respeitando o busy_timeout) e, se o banco
+    continuar bloqueado, tenta novamente com espera exponencial até ESCRITA_TENTATIVAS vezes.
+    Chamadas dentro de uma transação já aberta apenas participam dela.
+    """
+    @functools.wraps(funcao)
+    def wrapper(*args, **kwargs):
+        pool = _obter_pool()
+        if pool.conexao_atual() is not None:
+            return funcao(*args, **kwargs)
+
+        espera = 0.0
+        for tentativa in range(1, ESCRITA_TENTATIVAS + 1):
+            inicio = time.perf_counter()
+            try:
+                with pool.conexao() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    espera += time.perf_counter() - inicio
+                    resultado = funcao(*args, **kwargs)
+                _registrar_espera(funcao.__name__, espera, tentativa)
+                return resultado
+            except sqlite3.OperationalError as e:
+                if not _erro_de_bloqueio(e):
+                    raise
+                if tentativa == ESCRITA_TENTATIVAS:
+                    _registrar_espera(funcao.__name__, espera + time.perf_counter() - inicio, tentativa)
+                    raise
+                pausa = min(ESCRITA_BACKOFF_MAXIMO, ESCRITA_BACKOFF_INICIAL * 2 ** (tentativa - 1))
+                pausa *= random.uniform(0.5, 1.5) # Evita que as estações tentem de novo ao mesmo tempo
+                time.sleep(pausa)
+                espera += time.perf_counter() - inicio
+    return wrapper
+
+# --- Tipos de Linha ---
+
+# As consultas devolvem tuplas nomeadas em vez de um dicionário por linha: ocupam bem menos memória
+# (sem __dict__) e continuam acessíveis como antes, por nome (linha['campo'], linha.get('campo'),
+# dict(linha)), por atributo e por índice. Cada consulta tem seu tipo, criado a partir das colunas.
+# Como tuplas, 'x in linha' procura entre os valores; para saber se a coluna existe, use linha.keys().
+LOTE_ITERACAO = 500 # Linhas lidas por vez pelas funções iter_*
+
+class _LinhaBase:
+    """Acesso por nome, no estilo de um dicionário, para os tipos criados por tipo_linha."""
+    __slots__ = ()
+    _colunas = ()
+    _indices = {}
+
+    def __getitem__(self, chave):
+        if isinstance(chave, str):
+            return tuple.__getitem__(self, self._indices[chave])
+        return tuple.__getitem__(self, chave)
+
+    def get(self, chave, padrao=None):
+        indice = self._indices.get(chave)
+        return padrao if indice is None else tuple.__getitem__(self, indice)
+
+    def keys(self):
+        return self._colunas
+
+    def values(self):
+        return tuple(self)
+
+    def items(self):
+        return zip(self._colunas, self)
+
+    def __reduce__(self):
+        # Os tipos são criados em tempo de execução; o pickle (ex.: envio aos processos de exportação) os recria pelo nome e colunas
+        return (_recriar_linha, (type(self).__name__, self._colunas, tuple(self)))
+
+@functools.lru_cache(maxsize=None)
+def tipo_linha(nome, colunas):
+    """
+    Retorna o tipo de linha 'nome' com as colunas dadas (tupla de nomes, na ordem do SELECT).
+    Nomes de coluna que não são identificadores válidos continuam acessíveis por linha['nome'].
+    """
+    indices = {}
+    for indice, coluna in enumerate(colunas):
+        indices.setdefault(coluna, indice) # Coluna repetida: vale a primeira, como no sqlite3.Row
+    base = namedtuple(nome, colunas, rename=True)
+    return type(nome, (_LinhaBase, base), {
+        '__slots__': (), '__module__': __name__, '_colunas': colunas, '_indices': indices,
+    })
+
+def _recriar_linha(nome, colunas, valores):
+    return tuple.__new__(tipo_linha(nome, colunas), valores)
+
+def _linhas(cursor, nome):
+    """Faz o cursor (já executado) devolver linhas do tipo 'nome' e o retorna, para fetchone/fetchall."""
+    tipo = tipo_linha(nome, tuple(coluna[0] for coluna in cursor.description))
+    cursor.row_factory = lambda _cursor, valores: tuple.__new__(tipo, valores)
+    return cursor
+
+def _listar_linhas(sql, params, nome):
+    """Executa a consulta na conexão da thread e retorna a lista de linhas do tipo 'nome'."""
+    with _conexao() as conn:
+        return _linhas(conn.execute(sql, params), nome).fetchall()
+
+def _iterar_linhas(sql, params, nome, tamanho_lote=None):
+    """
+    Executa a consulta e gera as linhas do tipo 'nome' em lotes de 'tamanho_lote' (fetchmany),
+    sem montar a lista inteira. O gerador usa uma conexão própria do pool (ver conexao_dedicada),
+    devolvida quando ele termina, é fechado ou coletado; enquanto isso ela ocupa uma vaga do pool.
+    """
+    tamanho_lote = tamanho_lote or LOTE_ITERACAO
+    with _obter_pool().conexao_dedicada() as conn:
+        cursor = _linhas(conn.execute(sql, params), nome)
+        try:
+            while True:
+                lote = cursor.fetchmany(tamanho_lote)
+                if not lote:
+                    return
+                yield from lote
+        finally:
+            cursor.close()
+
 # --- Funções de Segurança ---
 
-def gerar_hash_com_salt(senha):
+# As senhas são guardadas como 'pbkdf2_<algoritmo>$<iterações>$<salt>$<hash>', então o custo usado
+# em cada hash fica registrado nele. Ao mudar o custo abaixo, as senhas são refeitas no próximo login.
+SENHA_ALGORITMO = 'sha256'
+SENHA_ITERACOES = 100000
+SENHA_ITERACOES_MINIMAS = 100000 # Piso usado pela calibração, mesmo em computadores lentos
+SENHA_TEMPO_ALVO_MS = 250 # Tempo de verificação buscado pela calibração (ver calibrar_custo_senha)
+_PREFIXO_HASH_SENHA = 'pbkdf2_'
+_ITERACOES_FORMATO_ANTIGO = 100000 # Hashes 'salt:hash', anteriores ao custo no próprio hash
+
+def _pbkdf2(senha, salt, algoritmo, iteracoes):
+    return hashlib.pbkdf2_hmac(algoritmo, senha.encode('utf-8'), salt, iteracoes)
+
+def _ler_hash_com_salt(senha_hash_com_salt):
+    """
+    Retorna (algoritmo, iterações, salt, hash) de um hash armazenado, no formato atual ou no antigo
+    'salt:hash'. Lança ValueError se o formato for inválido.
     """
-    Gera um hash seguro para a senha usando um salt aleatório (PBKDF2).
-    Retorna o hash no formato 'salt:hash' para armazenamento.
+    if senha_hash_com_salt.startswith(_PREFIXO_HASH_SENHA):
+        esquema, iteracoes, salt_hex, hash_hex = senha_hash_com_salt.split('$')
+        algoritmo, iteracoes = esquema[len(_PREFIXO_HASH_SENHA):], int(iteracoes)
+        if algoritmo not in hashlib.algorithms_available or iteracoes < 1:
+            raise ValueError(f"Hash de senha com parâmetros inválidos: {esquema}, {iteracoes}.")
+    else:
+        salt_hex, hash_hex = senha_hash_com_salt.split(':')
+        algoritmo, iteracoes = 'sha256', _ITERACOES_FORMATO_ANTIGO
+    return algoritmo, iteracoes, bytes.fromhex(salt_hex), bytes.fromhex(hash_hex)
+
+def gerar_hash_com_salt(senha, iteracoes=None, algoritmo=None):
     """
+    Gera um hash seguro para a senha usando um salt aleatório (PBKDF2), com o custo configurado
+    em SENHA_ALGORITMO/SENHA_ITERACOES. Retorna 'pbkdf2_<algoritmo>$<iterações>$<salt>$<hash>'.
+    """
+    algoritmo = algoritmo or SENHA_ALGORITMO
+    iteracoes = iteracoes or SENHA_ITERACOES
     salt = os.urandom(16) # Gera um salt aleatório de 16 bytes
-    pwdhash = hashlib.pbkdf2_hmac('sha256', senha.encode('utf-8'), salt, 100000)
-    return f"{salt.hex()}:{pwdhash.hex()}"
+    pwdhash = _pbkdf2(senha, salt, algoritmo, iteracoes)
+    return f"{_PREFIXO_HASH_SENHA}{algoritmo}${iteracoes}${salt.hex()}${pwdhash.hex()}"
 
 def verificar_hash_com_salt(senha_hash_com_salt, senha):
-    """Verifica a senha fornecida contra o hash armazenado que contém o salt."""
+    """Verifica a senha fornecida contra o hash armazenado, usando o algoritmo e o custo gravados nele."""
     try:
-        salt_hex, hash_armazenado_hex = senha_hash_com_salt.split(':')
-        salt = bytes.fromhex(salt_hex)
-        pwdhash_novo = hashlib.pbkdf2_hmac('sha256', senha.encode('utf-8'), salt, 100000)
+        algoritmo, iteracoes, salt, hash_armazenado = _ler_hash_com_salt(senha_hash_com_salt)
         # Usa compare_digest para uma comparação segura que previne "timing attacks".
-        return hmac.compare_digest(bytes.fromhex(hash_armazenado_hex), pwdhash_novo)
+        return hmac.compare_digest(hash_armazenado, _pbkdf2(senha, salt, algoritmo, iteracoes))
     except (ValueError, TypeError):
         # Retorna False se o formato do hash for inválido.
         return False
 
+def hash_senha_desatualizado(senha_hash_com_salt):
+    """Indica se o hash armazenado foi gerado com um formato ou custo diferente do configurado."""
+    try:
+        algoritmo, iteracoes, _, _ = _ler_hash_com_salt(senha_hash_com_salt)
+    except (ValueError, TypeError):
+        return True
+    return (not senha_hash_com_salt.startswith(_PREFIXO_HASH_SENHA)
+            or algoritmo != SENHA_ALGORITMO or iteracoes != SENHA_ITERACOES)
+
+def calibrar_custo_senha(tempo_alvo_ms=None, algoritmo=None, amostras=3):
+    """
+    Mede o PBKDF2 neste computador e retorna o número de iterações que leva cerca de 'tempo_alvo_ms'
+    (padrão: SENHA_TEMPO_ALVO_MS) por verificação, arredondado para milhares e nunca abaixo de
+    SENHA_ITERACOES_MINIMAS. Retorna um dicionário com 'iteracoes', 'ms_por_verificacao' (medido com
+    as iterações sugeridas) e 'iteracoes_por_segundo'. Para usar o resultado, ajuste SENHA_ITERACOES.
+    """
+    tempo_alvo_ms = tempo_alvo_ms or SENHA_TEMPO_ALVO_MS
+    algoritmo = algoritmo or SENHA_ALGORITMO
+    salt = os.urandom(16)
+
+    def medir(iteracoes):
+        # Menor de algumas medições: descarta pausas causadas por outros programas
+        melhor = float('inf')
+        for _ in range(amostras):
+            inicio = time.perf_counter()
+            _pbkdf2('calibracao', salt, algoritmo, iteracoes)
+            melhor = min(melhor, time.perf_counter() - inicio)
+        return melhor
+
+    # Uma medição com o custo mínimo estima a velocidade; a segunda confirma com o valor sugerido
+    por_segundo = SENHA_ITERACOES_MINIMAS / medir(SENHA_ITERACOES_MINIMAS)
+    iteracoes = max(SENHA_ITERACOES_MINIMAS, round(por_segundo * tempo_alvo_ms / 1000, -3))
+    ms = medir(int(iteracoes)) * 1000
+    print(f"Calibração de senha ({algoritmo}): {int(iteracoes)} iterações em {ms:.0f} ms (alvo: {tempo_alvo_ms} ms).")
+    return {'iteracoes': int(iteracoes), 'ms_por_verificacao': ms, 'iteracoes_por_segundo': por_segundo}
+
 # --- Inicialização e Migração ---
 
 def _add_column_if_not_exists(cursor, table_name, column_name, column_type):
@@ -42,129 +583,491 @@ def _add_column_if_not_exists(cursor, table_name, column_name, column_type):
 def inicializar_banco_de_dados():
     """
     Cria e atualiza as tabelas do banco de dados de forma segura.
-    Deve ser chamada no início da aplicação.
+    Deve ser chamada no início da aplicação. Um banco já atualizado (PRAGMA user_version
+    igual à última migração) é liberado com uma única consulta.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    inicio = time.perf_counter()
+    with _conexao() as conn:
         cursor = conn.cursor()
-        cursor.execute("PRAGMA foreign_keys = ON")
-
-        # --- 1. Criação das Tabelas Principais ---
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS pacientes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome_completo TEXT NOT NULL,
-            data_nascimento TEXT NOT NULL,
-            nome_responsavel TEXT NOT NULL
-        )
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS medicos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome_completo TEXT NOT NULL,
-            especialidade TEXT,
-            contato TEXT
-        )
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS sessoes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            paciente_id INTEGER NOT NULL,
-            data_sessao TEXT NOT NULL,
-            resumo_sessao TEXT,
-            FOREIGN KEY (paciente_id) REFERENCES pacientes (id) ON DELETE CASCADE
-        )
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS disponibilidade_medico (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            medico_id INTEGER NOT NULL,
-            data_disponivel TEXT NOT NULL,
-            hora_inicio TEXT NOT NULL,
-            hora_fim TEXT NOT NULL,
-            FOREIGN KEY (medico_id) REFERENCES medicos (id) ON DELETE CASCADE
-        )
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS prontuarios (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            paciente_id INTEGER NOT NULL UNIQUE,
-            queixa_principal TEXT,
-            historico_medico_relevante TEXT,
-            anamnese TEXT,
-            informacoes_adicionais TEXT,
-            FOREIGN KEY (paciente_id) REFERENCES pacientes (id) ON DELETE CASCADE
-        )
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS usuarios (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome_usuario TEXT NOT NULL UNIQUE,
-            senha_hash TEXT NOT NULL,
-            nivel_acesso TEXT NOT NULL DEFAULT 'terapeuta'
+        versao = _aplicar_migracoes(cursor)
+    duracao_ms = (time.perf_counter() - inicio) * 1000
+    print(f"Banco de dados pronto (versão {versao}) em {duracao_ms:.1f} ms.")
+
+# --- Migrações ---
+
+def _migracao_esquema_inicial(cursor):
+    """Cria as tabelas principais e as colunas adicionadas em versões anteriores ao controle de versão."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS pacientes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nome_completo TEXT NOT NULL,
+        data_nascimento TEXT NOT NULL,
+        nome_responsavel TEXT NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS medicos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nome_completo TEXT NOT NULL,
+        especialidade TEXT,
+        contato TEXT
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sessoes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        paciente_id INTEGER NOT NULL,
+        data_sessao TEXT NOT NULL,
+        resumo_sessao TEXT,
+        FOREIGN KEY (paciente_id) REFERENCES pacientes (id) ON DELETE CASCADE
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS disponibilidade_medico (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        medico_id INTEGER NOT NULL,
+        data_disponivel TEXT NOT NULL,
+        hora_inicio TEXT NOT NULL,
+        hora_fim TEXT NOT NULL,
+        FOREIGN KEY (medico_id) REFERENCES medicos (id) ON DELETE CASCADE
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS prontuarios (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        paciente_id INTEGER NOT NULL UNIQUE,
+        queixa_principal TEXT,
+        historico_medico_relevante TEXT,
+        anamnese TEXT,
+        informacoes_adicionais TEXT,
+        FOREIGN KEY (paciente_id) REFERENCES pacientes (id) ON DELETE CASCADE
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS usuarios (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nome_usuario TEXT NOT NULL UNIQUE,
+        senha_hash TEXT NOT NULL,
+        nivel_acesso TEXT NOT NULL DEFAULT 'terapeuta'
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS despesas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        descricao TEXT NOT NULL,
+        valor REAL NOT NULL,
+        data TEXT NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS planos_saude (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nome TEXT NOT NULL UNIQUE
+    )
+    """)
+
+    # Colunas acrescentadas em versões antigas do sistema, antes do controle por user_version
+    _add_column_if_not_exists(cursor, "pacientes", "telefone_responsavel", "TEXT")
+    _add_column_if_not_exists(cursor, "pacientes", "plano_saude_id", "INTEGER REFERENCES planos_saude(id)")
+    _add_column_if_not_exists(cursor, "pacientes", "valor_sessao_padrao", "REAL DEFAULT 0.0")
+
+    _add_column_if_not_exists(cursor, "sessoes", "nivel_evolucao", "TEXT")
+    _add_column_if_not_exists(cursor, "sessoes", "observacoes_evolucao", "TEXT")
+    _add_column_if_not_exists(cursor, "sessoes", "plano_terapeutico", "TEXT")
+    _add_column_if_not_exists(cursor, "sessoes", "medico_id", "INTEGER REFERENCES medicos(id)")
+    _add_column_if_not_exists(cursor, "sessoes", "hora_inicio_sessao", "TEXT")
+    _add_column_if_not_exists(cursor, "sessoes", "hora_fim_sessao", "TEXT")
+    _add_column_if_not_exists(cursor, "sessoes", "valor_sessao", "REAL DEFAULT 0.0")
+    _add_column_if_not_exists(cursor, "sessoes", "status_pagamento", "TEXT")
+
+def _migracao_indices(cursor):
+    """Cria os índices usados pelas consultas mais frequentes de sessões, agenda e financeiro."""
+    # Sessões do dia (agenda), períodos do financeiro e datas do calendário
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessoes_data ON sessoes (data_sessao, hora_inicio_sessao)")
+    # Histórico de sessões de um paciente
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessoes_paciente_data ON sessoes (paciente_id, data_sessao)")
+    # Conflito de horário e sessões de um terapeuta em uma data
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessoes_medico_data ON sessoes (medico_id, data_sessao, hora_inicio_sessao, hora_fim_sessao)")
+    # Índice parcial: apenas sessões pendentes (normalmente uma fração pequena da tabela)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_sessoes_pendentes
+        ON sessoes (paciente_id, data_sessao, valor_sessao)
+        WHERE status_pagamento = 'Pendente'
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_disponibilidade_medico_data ON disponibilidade_medico (medico_id, data_disponivel, hora_inicio)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_disponibilidade_data ON disponibilidade_medico (data_disponivel)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_despesas_data ON despesas (data)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pacientes_nome ON pacientes (nome_completo)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pacientes_plano ON pacientes (plano_saude_id)")
+
+def _migracao_dados_iniciais(cursor):
+    """Cria o usuário admin padrão e popula os planos de saúde, se necessário."""
+    # Criar usuário admin padrão
+    cursor.execute("SELECT 1 FROM usuarios WHERE nivel_acesso = 'admin'")
+    if not cursor.fetchone():
+        nome_admin_padrao = 'admin'
+        senha_admin_padrao = 'admin123'
+        senha_hashed = gerar_hash_com_salt(senha_admin_padrao)
+        cursor.execute(
+            "INSERT INTO usuarios (nome_usuario, senha_hash, nivel_acesso) VALUES (?, ?, ?)",
+            (nome_admin_padrao, senha_hashed, 'admin')
         )
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS despesas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            descricao TEXT NOT NULL,
-            valor REAL NOT NULL,
-            data TEXT NOT NULL
+        print("="*50)
+        print("NENHUM USUÁRIO ADMIN ENCONTRADO. UM PADRÃO FOI CRIADO:")
+        print(f"  Usuário: {nome_admin_padrao}\n  Senha:   {senha_admin_padrao}")
+        print("="*50)
+
+    # Popular planos de saúde
+    cursor.execute("SELECT COUNT(id) FROM planos_saude")
+    if cursor.fetchone()[0] == 0:
+        print("Populando tabela 'planos_saude' com valores iniciais...")
+        planos_iniciais = [
+            ('Particular',), ('Unimed',), ('Hapvida',), ('Bradesco Saúde',),
+            ('Amil',), ('SulAmérica Saúde',), ('NotreDame Intermédica',), ('Outro',)
+        ]
+        cursor.executemany("INSERT INTO planos_saude (nome) VALUES (?)", planos_iniciais)
+
+def _telefone_para_busca(coluna):
+    """Expressão SQL com o telefone como digitado seguido só dos dígitos, para achar '(11) 9876-...' e '119876...'."""
+    digitos = f"COALESCE({coluna}, '')"
+    for caractere in (' ', '-', '(', ')', '.', '+', '/'):
+        digitos = f"replace({digitos}, '{caractere}', '')"
+    return f"COALESCE({coluna}, '') || ' ' || {digitos}"
+
+def _migracao_busca_pacientes(cursor):
+    """
+    Cria o índice de texto completo (FTS5) de nome, responsável e telefone dos pacientes.
+    O tokenizador remove acentos e ignora maiúsculas ('Joao' encontra 'João'); triggers mantêm o índice em dia.
+    """
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS pacientes_busca USING fts5(
+            nome_completo, nome_responsavel, telefone,
+            tokenize = 'unicode61 remove_diacritics 2'
         )
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS planos_saude (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome TEXT NOT NULL UNIQUE
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS pacientes_busca_ai AFTER INSERT ON pacientes BEGIN
+            INSERT INTO pacientes_busca (rowid, nome_completo, nome_responsavel, telefone)
+            VALUES (new.id, new.nome_completo, new.nome_responsavel, {_telefone_para_busca('new.telefone_responsavel')});
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS pacientes_busca_ad AFTER DELETE ON pacientes BEGIN
+            DELETE FROM pacientes_busca WHERE rowid = old.id;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS pacientes_busca_au AFTER UPDATE OF nome_completo, nome_responsavel, telefone_responsavel ON pacientes BEGIN
+            DELETE FROM pacientes_busca WHERE rowid = old.id;
+            INSERT INTO pacientes_busca (rowid, nome_completo, nome_responsavel, telefone)
+            VALUES (new.id, new.nome_completo, new.nome_responsavel, {_telefone_para_busca('new.telefone_responsavel')});
+        END
+    """)
+    # Popula (ou refaz) o índice com os pacientes já cadastrados
+    cursor.execute("DELETE FROM pacientes_busca")
+    cursor.execute(f"""
+        INSERT INTO pacientes_busca (rowid, nome_completo, nome_responsavel, telefone)
+        SELECT id, nome_completo, nome_responsavel, {_telefone_para_busca('telefone_responsavel')} FROM pacientes
+    """)
+
+def _migracao_horarios_com_dois_digitos(cursor):
+    """
+    Padroniza os horários gravados como 'H:MM' para 'HH:MM'. Os horários são comparados como texto
+    nas consultas, e '9:00' ficaria depois de '10:00'.
+    """
+    for tabela, colunas in (('sessoes', ('hora_inicio_sessao', 'hora_fim_sessao')),
+                            ('disponibilidade_medico', ('hora_inicio', 'hora_fim'))):
+        for coluna in colunas:
+            cursor.execute(f"UPDATE {tabela} SET {coluna} = '0' || {coluna} WHERE {coluna} GLOB '[0-9]:[0-5][0-9]'")
+
+def _migracao_disponibilidade_semanal(cursor):
+    """
+    Cria os modelos semanais de disponibilidade (ex.: toda segunda das 08:00 às 12:00) e suas exceções.
+    As datas são calculadas na consulta, então um horário recorrente ocupa uma única linha.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS disponibilidade_semanal (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        medico_id INTEGER NOT NULL,
+        dia_semana INTEGER NOT NULL CHECK (dia_semana BETWEEN 0 AND 6), -- 0 = segunda-feira, como date.weekday()
+        hora_inicio TEXT NOT NULL,
+        hora_fim TEXT NOT NULL,
+        valido_de TEXT NOT NULL,
+        valido_ate TEXT, -- NULL = sem data final
+        FOREIGN KEY (medico_id) REFERENCES medicos (id) ON DELETE CASCADE
+    )
+    """)
+    # Datas em que um modelo não vale (feriado, folga...)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS disponibilidade_excecoes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        modelo_id INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        UNIQUE (modelo_id, data),
+        FOREIGN KEY (modelo_id) REFERENCES disponibilidade_semanal (id) ON DELETE CASCADE
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_disponibilidade_semanal_medico ON disponibilidade_semanal (medico_id, dia_semana)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_disponibilidade_semanal_dia ON disponibilidade_semanal (dia_semana)")
+
+def _migracao_indice_financeiro(cursor):
+    """
+    Índice de cobertura para os totais financeiros: as somas por período, status e terapeuta
+    são respondidas só pelo índice, sem ler as linhas da tabela de sessões.
+    """
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_sessoes_financeiro
+        ON sessoes (data_sessao, status_pagamento, valor_sessao, medico_id)
+    """)
+
+# Soma os valores de um INSERT ao resumo diário quando a linha (data, terapeuta, plano) já existe
+_SQL_ACUMULAR_RESUMO = """
+    ON CONFLICT (data, medico_id, plano_saude_id) DO UPDATE SET
+        total_recebido = total_recebido + excluded.total_recebido,
+        total_a_receber = total_a_receber + excluded.total_a_receber,
+        total_despesas = total_despesas + excluded.total_despesas,
+        quantidade_sessoes = quantidade_sessoes + excluded.quantidade_sessoes
+"""
+
+def _sql_resumo_sessao(registro, sinal):
+    """SQL de trigger que soma ('+') ou subtrai ('-') a sessão 'new' ou 'old' do resumo diário."""
+    return f"""
+        INSERT INTO resumo_financeiro_diario
+            (data, medico_id, plano_saude_id, total_recebido, total_a_receber, quantidade_sessoes)
+        VALUES (
+            {registro}.data_sessao, COALESCE({registro}.medico_id, 0),
+            COALESCE((SELECT plano_saude_id FROM pacientes WHERE id = {registro}.paciente_id), 0),
+            {sinal}(CASE WHEN {registro}.status_pagamento = 'Pago' THEN COALESCE({registro}.valor_sessao, 0) ELSE 0 END),
+            {sinal}(CASE WHEN {registro}.status_pagamento = 'Pago' THEN 0 ELSE COALESCE({registro}.valor_sessao, 0) END),
+            {sinal}1
         )
-        """)
-
-        # --- 2. Migrações de Schema (Adicionar colunas que faltam) ---
-        _add_column_if_not_exists(cursor, "pacientes", "telefone_responsavel", "TEXT")
-        _add_column_if_not_exists(cursor, "pacientes", "plano_saude_id", "INTEGER REFERENCES planos_saude(id)")
-        _add_column_if_not_exists(cursor, "pacientes", "valor_sessao_padrao", "REAL DEFAULT 0.0")
-
-        _add_column_if_not_exists(cursor, "sessoes", "nivel_evolucao", "TEXT")
-        _add_column_if_not_exists(cursor, "sessoes", "observacoes_evolucao", "TEXT")
-        _add_column_if_not_exists(cursor, "sessoes", "plano_terapeutico", "TEXT")
-        _add_column_if_not_exists(cursor, "sessoes", "medico_id", "INTEGER REFERENCES medicos(id)")
-        _add_column_if_not_exists(cursor, "sessoes", "hora_inicio_sessao", "TEXT")
-        _add_column_if_not_exists(cursor, "sessoes", "hora_fim_sessao", "TEXT")
-        _add_column_if_not_exists(cursor, "sessoes", "valor_sessao", "REAL DEFAULT 0.0")
-        _add_column_if_not_exists(cursor, "sessoes", "status_pagamento", "TEXT")
-
-        # --- 3. Dados Iniciais ---
-        # Criar usuário admin padrão
-        cursor.execute("SELECT 1 FROM usuarios WHERE nivel_acesso = 'admin'")
-        if not cursor.fetchone():
-            nome_admin_padrao = 'admin'
-            senha_admin_padrao = 'admin123'
-            senha_hashed = gerar_hash_com_salt(senha_admin_padrao)
-            cursor.execute(
-                "INSERT INTO usuarios (nome_usuario, senha_hash, nivel_acesso) VALUES (?, ?, ?)",
-                (nome_admin_padrao, senha_hashed, 'admin')
-            )
-            print("="*50)
-            print("NENHUM USUÁRIO ADMIN ENCONTRADO. UM PADRÃO FOI CRIADO:")
-            print(f"  Usuário: {nome_admin_padrao}\n  Senha:   {senha_admin_padrao}")
-            print("="*50)
-
-        # Popular planos de saúde
-        cursor.execute("SELECT COUNT(id) FROM planos_saude")
-        if cursor.fetchone()[0] == 0:
-            print("Populando tabela 'planos_saude' com valores iniciais...")
-            planos_iniciais = [
-                ('Particular',), ('Unimed',), ('Hapvida',), ('Bradesco Saúde',),
-                ('Amil',), ('SulAmérica Saúde',), ('NotreDame Intermédica',), ('Outro',)
-            ]
-            cursor.executemany("INSERT INTO planos_saude (nome) VALUES (?)", planos_iniciais)
-
-        print("Banco de dados pronto.")
+        {_SQL_ACUMULAR_RESUMO};
+    """
+
+def _sql_resumo_sessoes_do_paciente(plano, sinal):
+    """SQL de trigger que soma ou subtrai todas as sessões do paciente 'new' no plano informado."""
+    return f"""
+        INSERT INTO resumo_financeiro_diario
+            (data, medico_id, plano_saude_id, total_recebido, total_a_receber, quantidade_sessoes)
+        SELECT data_sessao, COALESCE(medico_id, 0), COALESCE({plano}, 0),
+               {sinal}TOTAL(CASE WHEN status_pagamento = 'Pago' THEN valor_sessao END),
+               {sinal}TOTAL(CASE WHEN status_pagamento = 'Pago' THEN NULL ELSE valor_sessao END),
+               {sinal}COUNT(*)
+        FROM sessoes
+        WHERE paciente_id = new.id
+        GROUP BY data_sessao, medico_id
+        {_SQL_ACUMULAR_RESUMO};
+    """
+
+def _sql_resumo_despesa(registro, sinal):
+    """SQL de trigger que soma ou subtrai a despesa 'new' ou 'old' do resumo diário (terapeuta e plano 0)."""
+    return f"""
+        INSERT INTO resumo_financeiro_diario (data, medico_id, plano_saude_id, total_despesas)
+        VALUES ({registro}.data, 0, 0, {sinal}COALESCE({registro}.valor, 0))
+        {_SQL_ACUMULAR_RESUMO};
+    """
+
+def _reconstruir_resumo_financeiro(cursor):
+    """Refaz o resumo diário inteiro a partir das sessões e despesas."""
+    cursor.execute("DELETE FROM resumo_financeiro_diario")
+    cursor.execute("""
+        INSERT INTO resumo_financeiro_diario
+            (data, medico_id, plano_saude_id, total_recebido, total_a_receber, quantidade_sessoes)
+        SELECT s.data_sessao, COALESCE(s.medico_id, 0), COALESCE(p.plano_saude_id, 0),
+               TOTAL(CASE WHEN s.status_pagamento = 'Pago' THEN s.valor_sessao END),
+               TOTAL(CASE WHEN s.status_pagamento = 'Pago' THEN NULL ELSE s.valor_sessao END),
+               COUNT(*)
+        FROM sessoes s
+        LEFT JOIN pacientes p ON p.id = s.paciente_id
+        GROUP BY 1, 2, 3
+    """)
+    cursor.execute(f"""
+        INSERT INTO resumo_financeiro_diario (data, medico_id, plano_saude_id, total_despesas)
+        SELECT data, 0, 0, TOTAL(valor) FROM despesas GROUP BY data
+        {_SQL_ACUMULAR_RESUMO}
+    """)
+
+def _migracao_resumo_financeiro_diario(cursor):
+    """
+    Cria o resumo financeiro por dia, terapeuta e plano de saúde, mantido por triggers a cada
+    alteração de sessões, despesas ou do plano do paciente. Os totais de períodos longos somam
+    algumas linhas por dia em vez de todas as sessões. Sem terapeuta ou sem plano, o id é 0.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS resumo_financeiro_diario (
+        data TEXT NOT NULL,
+        medico_id INTEGER NOT NULL DEFAULT 0,
+        plano_saude_id INTEGER NOT NULL DEFAULT 0,
+        total_recebido REAL NOT NULL DEFAULT 0,
+        total_a_receber REAL NOT NULL DEFAULT 0,
+        total_despesas REAL NOT NULL DEFAULT 0,
+        quantidade_sessoes INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (data, medico_id, plano_saude_id)
+    ) WITHOUT ROWID
+    """)
+    triggers = {
+        'resumo_sessoes_ai': ("AFTER INSERT ON sessoes", _sql_resumo_sessao('new', '+')),
+        'resumo_sessoes_ad': ("AFTER DELETE ON sessoes", _sql_resumo_sessao('old', '-')),
+        'resumo_sessoes_au': (
+            "AFTER UPDATE OF data_sessao, medico_id, paciente_id, valor_sessao, status_pagamento ON sessoes",
+            _sql_resumo_sessao('old', '-') + _sql_resumo_sessao('new', '+')
+        ),
+        'resumo_despesas_ai': ("AFTER INSERT ON despesas", _sql_resumo_despesa('new', '+')),
+        'resumo_despesas_ad': ("AFTER DELETE ON despesas", _sql_resumo_despesa('old', '-')),
+        'resumo_despesas_au': (
+            "AFTER UPDATE OF data, valor ON despesas",
+            _sql_resumo_despesa('old', '-') + _sql_resumo_despesa('new', '+')
+        ),
+        # O resumo agrupa pelo plano atual do paciente, como o relatório por plano
+        'resumo_pacientes_plano_au': (
+            "AFTER UPDATE OF plano_saude_id ON pacientes WHEN old.plano_saude_id IS NOT new.plano_saude_id",
+            _sql_resumo_sessoes_do_paciente('old.plano_saude_id', '-') + _sql_resumo_sessoes_do_paciente('new.plano_saude_id', '+')
+        ),
+        # Na exclusão em cascata o paciente já não existe quando o trigger das sessões roda e o plano
+        # não seria encontrado; por isso as sessões são excluídas antes, ainda com o paciente no banco.
+        'resumo_pacientes_bd': ("BEFORE DELETE ON pacientes", "DELETE FROM sessoes WHERE paciente_id = old.id;"),
+    }
+    for nome, (evento, corpo) in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {nome} {evento} BEGIN {corpo} END")
+    _reconstruir_resumo_financeiro(cursor)
+
+# Lista ordenada de migrações: (versão, função). Cada passo roda uma única vez por banco
+# e é idempotente, para que um banco interrompido no meio possa ser migrado de novo.
+MIGRACOES = [
+    (1, _migracao_esquema_inicial),
+    (2, _migracao_indices),
+    (3, _migracao_dados_iniciais),
+    (4, _migracao_busca_pacientes),
+    (5, _migracao_horarios_com_dois_digitos),
+    (6, _migracao_disponibilidade_semanal),
+    (7, _migracao_indice_financeiro),
+    (8, _migracao_resumo_financeiro_diario),
+]
+VERSAO_ESQUEMA = MIGRACOES[-1][0]
+
+def _aplicar_migracoes(cursor):
+    """
+    Aplica, em ordem, as migrações com versão maior que o PRAGMA user_version do banco.
+    Retorna a versão final do esquema.
+    """
+    cursor.execute("PRAGMA user_version")
+    versao_atual = cursor.fetchone()[0]
+    if versao_atual >= VERSAO_ESQUEMA:
+        return versao_atual
+    for versao, migracao in MIGRACOES:
+        if versao > versao_atual:
+            print(f"Aplicando migração {versao} ({migracao.__name__})...")
+            migracao(cursor)
+            cursor.execute(f"PRAGMA user_version = {versao:d}")
+            versao_atual = versao
+    return versao_atual
+
+def verificar_planos_de_consulta():
+    """
+    Executa as consultas mais frequentes sob EXPLAIN QUERY PLAN e retorna uma lista de
+    (função, detalhe) para cada uma que faça varredura completa de tabela.
+    Uma lista vazia significa que todas estão usando índices.
+    """
+    hoje = time.strftime('%Y-%m-%d')
+    chamadas = [
+        (listar_sessoes_por_data, (hoje,)),
+        (listar_sessoes_por_paciente, (0,)),
+        (listar_sessoes_por_medico_e_data, (0, hoje)),
+        (verificar_conflito_sessao, (0, hoje, '08:00', '09:00')),
+        (verificar_conflitos_em_lote, (0, [(hoje, '08:00', '09:00')])),
+        (verificar_pendencias_paciente, (0,)),
+        (listar_sessoes_pendentes_por_paciente, (0,)),
+        (listar_todas_sessoes_pendentes, ()),
+        (listar_sessoes_financeiro_por_periodo, (hoje, hoje)),
+        (listar_receitas_agrupadas_por_plano, (hoje, hoje)),
+        (listar_receitas_agrupadas_por_plano, ('2000-01-01', hoje)),
+        (calcular_totais_financeiros_por_periodo, ('2000-01-01', hoje)),
+        (calcular_totais_por_data, ('2000-01-01', hoje, 'mes')),
+        (calcular_totais_por_terapeuta, ('2000-01-01', hoje)),
+        (listar_despesas_por_periodo, (hoje, hoje)),
+        (listar_sessoes_para_relatorio, (hoje, hoje)),
+        (listar_sessoes_para_relatorio, (hoje, hoje, 0)),
+        (listar_sessoes_para_relatorio, (hoje, hoje, None, 0)),
+        (calcular_totais_financeiros_por_periodo, (hoje, hoje)),
+        (calcular_totais_por_status, (hoje, hoje)),
+        (calcular_totais_por_data, (hoje, hoje)),
+        (calcular_totais_por_data, (hoje, hoje, 'mes')),
+        (calcular_totais_por_terapeuta, (hoje, hoje)),
+        (listar_disponibilidade_por_data, (0, hoje)),
+        (listar_datas_disponiveis_por_mes, (0, 2000, 1)),
+        (listar_disponibilidade_geral_por_data, (hoje,)),
+        (buscar_horarios_livres, (hoje, hoje, 30)),
+        (buscar_horarios_livres, (hoje, hoje, 30, [0])),
+        (listar_pacientes_com_pendencias, ()),
+        (listar_pacientes_com_pendencias, ('joao',)),
+        (listar_todas_sessoes_pendentes, ('joao',)),
+        (buscar_pacientes_por_nome, ('joao',)),
+        (listar_datas_sessoes, ()),
+        (listar_datas_sessoes_do_mes, (1900, 1)),
+    ]
+    problemas = []
+    with _conexao() as conn:
+        for funcao, args in chamadas:
+            instrucoes = []
+            conn.set_trace_callback(instrucoes.append)
+            try:
+                funcao(*args)
+            finally:
+                conn.set_trace_callback(None)
+            for sql in instrucoes:
+                if sql.startswith('--') or "'main'." in sql:
+                    continue # Instruções internas de triggers e da FTS5 (que qualifica o esquema), não da própria função
+                plano = [linha[3] for linha in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+                # Subconsultas materializadas são percorridas em memória, não são tabelas
+                subconsultas = {d.split()[1] for d in plano if d.startswith(('MATERIALIZE', 'CO-ROUTINE'))}
+                for detalhe in plano:
+                    # "SCAN x USING [COVERING] INDEX" percorre um índice; "SCAN x" sozinho é varredura da tabela
+                    # (a busca FTS5 aparece como "SCAN x VIRTUAL TABLE INDEX" e usa o próprio índice)
+                    # ("SCAN CONSTANT ROW" é o ponto de partida de uma CTE recursiva, não uma tabela)
+                    if (detalhe.startswith('SCAN') and 'USING' not in detalhe and 'VIRTUAL TABLE' not in detalhe
+                            and detalhe != 'SCAN CONSTANT ROW' and detalhe.split()[1] not in subconsultas):
+                        problemas.append((funcao.__name__, detalhe))
+    return problemas
+
+# --- Ordenação e Paginação ---
+
+def _ordem_e_paginacao(colunas_ordenaveis, ordenar_por, decrescente, ordem_padrao, limite, deslocamento):
+    """
+    Monta o ORDER BY e o LIMIT/OFFSET das listagens paginadas.
+    'ordenar_por' precisa ser uma chave de 'colunas_ordenaveis' (nunca é interpolado direto no SQL);
+    a ordem padrão é mantida como desempate para que a paginação seja estável.
+    """
+    if ordenar_por:
+        if ordenar_por not in colunas_ordenaveis:
+            raise ValueError(f"Não é possível ordenar por '{ordenar_por}'.")
+        ordem = f"{colunas_ordenaveis[ordenar_por]} {'DESC' if decrescente else 'ASC'}, {ordem_padrao}"
+    else:
+        ordem = ordem_padrao
+    sql = f" ORDER BY {ordem}"
+    params = []
+    if limite is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [limite, deslocamento]
+    return sql, params
 
 # --- Funções de Pacientes ---
 
+def _expressao_busca_pacientes(termo_busca):
+    """
+    Converte o texto digitado em uma consulta FTS5: cada palavra vira um prefixo entre aspas
+    ('jo sil' -> '"jo"* "sil"*'), todas obrigatórias. Retorna None se não houver palavras.
+    """
+    palavras = re.findall(r'\w+', termo_busca or '')
+    if not palavras:
+        return None
+    return ' '.join(f'"{palavra}"*' for palavra in palavras)
+
+_SQL_FILTRO_BUSCA_PACIENTES = "p.id IN (SELECT rowid FROM pacientes_busca WHERE pacientes_busca MATCH ?)"
+
+@_transacao_escrita
 def adicionar_paciente(nome, data_nasc, responsavel, telefone_responsavel, plano_saude_id, valor_sessao_padrao, anamnese_inicial=None):
     """Adiciona um novo paciente e seu prontuário inicial ao banco de dados."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO pacientes (nome_completo, data_nascimento, nome_responsavel, telefone_responsavel, plano_saude_id, valor_sessao_padrao) VALUES (?, ?, ?, ?, ?, ?)",
@@ -179,25 +1082,27 @@ def adicionar_paciente(nome, data_nasc, responsavel, telefone_responsavel, plano
 
 def listar_pacientes():
     """Retorna uma lista de todos os pacientes cadastrados, ordenados por nome."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row  # Retorna resultados como dicionários
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT p.id, p.nome_completo, p.data_nascimento, p.nome_responsavel, p.telefone_responsavel, p.valor_sessao_padrao, ps.nome as plano_saude_nome FROM pacientes p LEFT JOIN planos_saude ps ON p.plano_saude_id = ps.id ORDER BY p.nome_completo")
-        # Converte os objetos Row para dicionários para desacoplar do sqlite3
-        return [dict(row) for row in cursor.fetchall()]
+        return _linhas(cursor, 'Paciente').fetchall()
+
+def contar_pacientes():
+    """Retorna quantos pacientes estão cadastrados."""
+    with _conexao() as conn:
+        return conn.execute("SELECT COUNT(*) FROM pacientes").fetchone()[0]
 
 def buscar_paciente_por_id(paciente_id):
     """Busca um paciente específico pelo seu ID."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, nome_completo, data_nascimento, nome_responsavel, telefone_responsavel, plano_saude_id, valor_sessao_padrao FROM pacientes WHERE id = ?", (paciente_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        return _linhas(cursor, 'Paciente').fetchone()
 
+@_transacao_escrita
 def atualizar_paciente(paciente_id, nome, data_nasc, responsavel, telefone_responsavel, plano_saude_id, valor_sessao_padrao):
     """Atualiza os dados de um paciente existente."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute(
             """
@@ -213,28 +1118,81 @@ def atualizar_paciente(paciente_id, nome, data_nasc, responsavel, telefone_respo
             (nome, data_nasc, responsavel, telefone_responsavel, plano_saude_id, valor_sessao_padrao, paciente_id)
         )
 
+@_transacao_escrita
 def excluir_paciente(paciente_id):
     """Exclui um paciente do banco de dados pelo seu ID."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM pacientes WHERE id = ?", (paciente_id,))
+        _invalidar_cache_sessoes()
 
 def buscar_pacientes_por_nome(termo_busca):
-    """Busca pacientes cujo nome completo contenha o termo de busca (case-insensitive)."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    """
+    Busca pacientes pelo início das palavras do nome, do responsável ou do telefone,
+    sem diferenciar maiúsculas nem acentos (usa o índice FTS5 'pacientes_busca').
+    """
+    expressao = _expressao_busca_pacientes(termo_busca)
+    if expressao is None:
+        return []
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT p.id, p.nome_completo, p.data_nascimento, p.nome_responsavel, p.telefone_responsavel, p.valor_sessao_padrao, ps.nome as plano_saude_nome FROM pacientes p LEFT JOIN planos_saude ps ON p.plano_saude_id = ps.id WHERE lower(p.nome_completo) LIKE ? ORDER BY p.nome_completo",
-            ('%' + termo_busca.lower() + '%',)
+            "SELECT p.id, p.nome_completo, p.data_nascimento, p.nome_responsavel, p.telefone_responsavel, p.valor_sessao_padrao, ps.nome as plano_saude_nome FROM pacientes p LEFT JOIN planos_saude ps ON p.plano_saude_id = ps.id WHERE "
+            + _SQL_FILTRO_BUSCA_PACIENTES + " ORDER BY p.nome_completo",
+            (expressao,)
         )
-        return [dict(row) for row in cursor.fetchall()]
+        return _linhas(cursor, 'Paciente').fetchall()
+
+ORDENACAO_PACIENTES = {
+    'id': 'p.id', 'nome_completo': 'p.nome_completo', 'tem_pendencia': 'tem_pendencia',
+    'data_nascimento': 'p.data_nascimento', 'nome_responsavel': 'p.nome_responsavel',
+    'telefone_responsavel': 'p.telefone_responsavel', 'plano_saude_nome': 'ps.nome',
+    'valor_sessao_padrao': 'p.valor_sessao_padrao',
+}
+
+def listar_pacientes_com_pendencias(termo_busca=None, ordenar_por=None, decrescente=False, limite=None, deslocamento=0):
+    """
+    Retorna os pacientes (opcionalmente filtrados pela busca de texto) já com a situação financeira:
+    'tem_pendencia' e 'total_pendente' são calculados em uma única consulta agrupada,
+    evitando uma verificação por paciente. Aceita ordenação (chaves de ORDENACAO_PACIENTES)
+    e paginação por limite/deslocamento.
+    """
+    return _listar_linhas(*_consulta_pacientes_com_pendencias(termo_busca, ordenar_por, decrescente, limite, deslocamento), 'PacienteSituacao')
+
+def _consulta_pacientes_com_pendencias(termo_busca=None, ordenar_por=None, decrescente=False, limite=None, deslocamento=0):
+    """Monta o SQL e os parâmetros de listar_pacientes_com_pendencias/iter_pacientes_com_pendencias."""
+    query = """
+        SELECT p.id, p.nome_completo, p.data_nascimento, p.nome_responsavel, p.telefone_responsavel,
+               p.valor_sessao_padrao, ps.nome as plano_saude_nome,
+               pend.paciente_id IS NOT NULL as tem_pendencia,
+               COALESCE(pend.total_pendente, 0.0) as total_pendente
+        FROM pacientes p
+        LEFT JOIN planos_saude ps ON p.plano_saude_id = ps.id
+        LEFT JOIN (
+            SELECT paciente_id, SUM(valor_sessao) as total_pendente
+            FROM sessoes
+            WHERE status_pagamento = 'Pendente'
+            GROUP BY paciente_id
+        ) pend ON pend.paciente_id = p.id
+    """
+    params = []
+    expressao = _expressao_busca_pacientes(termo_busca)
+    if expressao:
+        query += " WHERE " + _SQL_FILTRO_BUSCA_PACIENTES
+        params.append(expressao)
+    sql_ordem, params_ordem = _ordem_e_paginacao(ORDENACAO_PACIENTES, ordenar_por, decrescente, "p.nome_completo, p.id", limite, deslocamento)
+    return query + sql_ordem, params + params_ordem
+
+def iter_pacientes_com_pendencias(termo_busca=None, ordenar_por=None, decrescente=False, limite=None, deslocamento=0):
+    """Como listar_pacientes_com_pendencias, mas gera as linhas aos poucos (ver _iterar_linhas)."""
+    return _iterar_linhas(*_consulta_pacientes_com_pendencias(termo_busca, ordenar_por, decrescente, limite, deslocamento), 'PacienteSituacao')
 
 # --- Funções de Médicos ---
 
+@_transacao_escrita
 def adicionar_medico(nome, especialidade, contato):
     """Adiciona um novo médico ao banco de dados."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO medicos (nome_completo, especialidade, contato) VALUES (?, ?, ?)",
@@ -243,68 +1201,136 @@ def adicionar_medico(nome, especialidade, contato):
 
 def listar_medicos():
     """Retorna uma lista de todos os médicos cadastrados."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, nome_completo, especialidade, contato FROM medicos ORDER BY nome_completo")
-        return [dict(row) for row in cursor.fetchall()]
+        return _linhas(cursor, 'Medico').fetchall()
 
 def buscar_medico_por_id(medico_id):
     """Busca um médico específico pelo seu ID."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, nome_completo, especialidade, contato FROM medicos WHERE id = ?", (medico_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        return _linhas(cursor, 'Medico').fetchone()
 
+@_transacao_escrita
 def atualizar_medico(medico_id, nome, especialidade, contato):
     """Atualiza os dados de um médico existente."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("UPDATE medicos SET nome_completo = ?, especialidade = ?, contato = ? WHERE id = ?",
                        (nome, especialidade, contato, medico_id))
 
+@_transacao_escrita
 def excluir_medico(medico_id):
     """Exclui um médico do banco de dados."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM medicos WHERE id = ?", (medico_id,))
 
 # --- Funções de Disponibilidade de Médicos ---
 
+# A disponibilidade de um período é a união dos horários avulsos (disponibilidade_medico, uma linha por data)
+# com os modelos semanais expandidos para cada dia do período, menos as exceções de cada modelo.
+# O dia da semana de strftime('%w') começa no domingo; (%w + 6) % 7 converte para 0 = segunda-feira.
+_SQL_DISPONIBILIDADE_EXPANDIDA = """
+    WITH RECURSIVE dias(data) AS (
+        SELECT :inicio WHERE :inicio <= :fim
+        UNION ALL
+        SELECT date(data, '+1 day') FROM dias WHERE data < :fim
+    ),
+    disponibilidade(id, modelo_id, medico_id, data, hora_inicio, hora_fim) AS (
+        SELECT d.id, NULL, d.medico_id, d.data_disponivel, d.hora_inicio, d.hora_fim
+        FROM disponibilidade_medico d
+        WHERE d.data_disponivel BETWEEN :inicio AND :fim {filtro_avulsos}
+        UNION ALL
+        SELECT NULL, m.id, m.medico_id, dias.data, m.hora_inicio, m.hora_fim
+        FROM dias
+        JOIN disponibilidade_semanal m ON m.dia_semana = (CAST(strftime('%w', dias.data) AS INTEGER) + 6) % 7
+        WHERE dias.data >= m.valido_de AND (m.valido_ate IS NULL OR dias.data <= m.valido_ate) {filtro_modelos}
+          AND NOT EXISTS (SELECT 1 FROM disponibilidade_excecoes e WHERE e.modelo_id = m.id AND e.data = dias.data)
+    )
+"""
+
+def _disponibilidade_expandida(data_inicio_db, data_fim_db, medico_ids=None):
+    """
+    Retorna (sql, params) com a CTE 'disponibilidade' (id, modelo_id, medico_id, data, hora_inicio, hora_fim)
+    do período, para ser completada com o SELECT desejado. 'id' é do horário avulso e 'modelo_id' do modelo semanal.
+    """
+    params = {'inicio': data_inicio_db, 'fim': data_fim_db}
+    filtro_avulsos = filtro_modelos = ""
+    if medico_ids:
+        marcadores = ', '.join(f':medico{i}' for i in range(len(medico_ids)))
+        params.update({f'medico{i}': medico_id for i, medico_id in enumerate(medico_ids)})
+        filtro_avulsos = f"AND d.medico_id IN ({marcadores})"
+        filtro_modelos = f"AND m.medico_id IN ({marcadores})"
+    sql = _SQL_DISPONIBILIDADE_EXPANDIDA.format(filtro_avulsos=filtro_avulsos, filtro_modelos=filtro_modelos)
+    return sql, params
+
+@_transacao_escrita
 def adicionar_disponibilidade(medico_id, data_disponivel, hora_inicio, hora_fim):
     """Adiciona um novo horário de disponibilidade para um médico."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO disponibilidade_medico (medico_id, data_disponivel, hora_inicio, hora_fim) VALUES (?, ?, ?, ?)",
-            (medico_id, data_disponivel, hora_inicio, hora_fim)
+            (medico_id, data_disponivel, normalizar_hora(hora_inicio), normalizar_hora(hora_fim))
         )
 
-def listar_disponibilidade_por_data(medico_id, data_disponivel):
-    """Retorna os horários de um médico para uma data específica."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+@_transacao_escrita
+def adicionar_modelo_disponibilidade(medico_id, dia_semana, hora_inicio, hora_fim, valido_de, valido_ate=None):
+    """
+    Adiciona um horário que se repete toda semana no 'dia_semana' (0 = segunda-feira),
+    a partir de 'valido_de' e até 'valido_ate' (ou sem data final).
+    """
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT id, hora_inicio, hora_fim FROM disponibilidade_medico WHERE medico_id = ? AND data_disponivel = ? ORDER BY hora_inicio",
-            (medico_id, data_disponivel)
+            """INSERT INTO disponibilidade_semanal (medico_id, dia_semana, hora_inicio, hora_fim, valido_de, valido_ate)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (medico_id, dia_semana, normalizar_hora(hora_inicio), normalizar_hora(hora_fim), valido_de, valido_ate)
         )
-        return [dict(row) for row in cursor.fetchall()]
+
+@_transacao_escrita
+def excluir_ocorrencia_modelo_disponibilidade(modelo_id, data_db):
+    """Remove um modelo semanal de uma única data (ex.: feriado), mantendo as demais semanas."""
+    with _conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT OR IGNORE INTO disponibilidade_excecoes (modelo_id, data) VALUES (?, ?)", (modelo_id, data_db))
+
+@_transacao_escrita
+def encerrar_modelo_disponibilidade(modelo_id, data_db):
+    """Encerra a repetição de um modelo semanal a partir de 'data_db' (as semanas anteriores continuam valendo)."""
+    with _conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE disponibilidade_semanal SET valido_ate = date(?, '-1 day') WHERE id = ?", (data_db, modelo_id))
+        # Se nenhuma semana sobrou, o modelo não tem mais razão de existir
+        cursor.execute("DELETE FROM disponibilidade_semanal WHERE id = ? AND valido_ate < valido_de", (modelo_id,))
+
+def listar_disponibilidade_por_data(medico_id, data_disponivel):
+    """
+    Retorna os horários de um médico para uma data específica, avulsos e dos modelos semanais.
+    Cada horário traz 'id' (avulso) ou 'modelo_id' (semanal); o outro campo vem como None.
+    """
+    sql, params = _disponibilidade_expandida(data_disponivel, data_disponivel, [medico_id])
+    with _conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql + "SELECT id, modelo_id, hora_inicio, hora_fim FROM disponibilidade ORDER BY hora_inicio", params)
+        return _linhas(cursor, 'Disponibilidade').fetchall()
 
 def listar_datas_disponiveis_por_mes(medico_id, ano, mes):
-    """Retorna as datas únicas com disponibilidade para um médico em um dado mês/ano."""
-    with sqlite3.connect(DB_FILE) as conn:
+    """Retorna as datas únicas com disponibilidade (avulsa ou semanal) para um médico em um dado mês/ano."""
+    ultimo_dia = calendar.monthrange(ano, mes)[1]
+    sql, params = _disponibilidade_expandida(f"{ano}-{mes:02d}-01", f"{ano}-{mes:02d}-{ultimo_dia:02d}", [medico_id])
+    with _conexao() as conn:
         cursor = conn.cursor()
-        # O formato YYYY-MM% garante que pegamos todos os dias do mês
-        cursor.execute("SELECT DISTINCT data_disponivel FROM disponibilidade_medico WHERE medico_id = ? AND data_disponivel LIKE ?",
-                       (medico_id, f"{ano}-{mes:02d}-%"))
+        cursor.execute(sql + "SELECT DISTINCT data FROM disponibilidade", params)
         return [row[0] for row in cursor.fetchall()]
 
+@_transacao_escrita
 def excluir_disponibilidade(disponibilidade_id):
     """Exclui um horário de disponibilidade específico pelo seu ID."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM disponibilidade_medico WHERE id = ?", (disponibilidade_id,))
 
@@ -314,37 +1340,44 @@ def buscar_ou_criar_prontuario(paciente_id):
     """
     Busca o prontuário de um paciente. Se não existir, cria um em branco e o retorna.
     """
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with _conexao() as conn:
         cursor = conn.cursor()
         
         # Tenta buscar o prontuário
         cursor.execute("SELECT * FROM prontuarios WHERE paciente_id = ?", (paciente_id,))
-        prontuario = cursor.fetchone()
+        prontuario = _linhas(cursor, 'Prontuario').fetchone()
         
-        if prontuario:
-            return dict(prontuario)
-        else:
-            # Se não existir, cria um novo
-            cursor.execute("INSERT INTO prontuarios (paciente_id) VALUES (?)", (paciente_id,))
-            conn.commit()
-            # Busca novamente para retornar o registro completo com o ID
-            cursor.execute("SELECT * FROM prontuarios WHERE paciente_id = ?", (paciente_id,))
-            novo_prontuario = cursor.fetchone()
-            return dict(novo_prontuario)
+    if prontuario:
+        return prontuario
+    # Se não existir, cria um novo e busca novamente para retornar o registro completo com o ID
+    _criar_prontuario_em_branco(paciente_id)
+    with _conexao() as conn:
+        cursor = conn.execute("SELECT * FROM prontuarios WHERE paciente_id = ?", (paciente_id,))
+        return _linhas(cursor, 'Prontuario').fetchone()
+
+@_transacao_escrita
+def _criar_prontuario_em_branco(paciente_id):
+    """Cria o prontuário vazio do paciente, a menos que outra estação tenha acabado de criá-lo."""
+    with _conexao() as conn:
+        conn.execute(
+            "INSERT INTO prontuarios (paciente_id) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM prontuarios WHERE paciente_id = ?)",
+            (paciente_id, paciente_id)
+        )
 
+@_transacao_escrita
 def atualizar_prontuario(prontuario_id, queixa, historico, anamnese, info_adicional):
     """Atualiza os dados de um prontuário existente."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute(
             """UPDATE prontuarios SET queixa_principal = ?, historico_medico_relevante = ?, anamnese = ?, informacoes_adicionais = ? WHERE id = ?""",
             (queixa, historico, anamnese, info_adicional, prontuario_id)
         )
 
+@_transacao_escrita
 def atualizar_anamnese_paciente(paciente_id, anamnese):
     """Atualiza o campo anamnese do prontuário de um paciente."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         # Garante que o prontuário exista antes de tentar atualizar (caso tenha sido criado sem um)
         cursor.execute("INSERT OR IGNORE INTO prontuarios (paciente_id) VALUES (?)", (paciente_id,))
@@ -357,8 +1390,12 @@ def atualizar_anamnese_paciente(paciente_id, anamnese):
 
 def adicionar_usuario(nome_usuario, senha, nivel_acesso):
     """Adiciona um novo usuário ao banco de dados. Lança ValueError se o usuário já existir."""
-    senha_hashed = gerar_hash_com_salt(senha)
-    with sqlite3.connect(DB_FILE) as conn:
+    # O hash (lento de propósito) é calculado antes de reservar a escrita no banco
+    _inserir_usuario(nome_usuario, gerar_hash_com_salt(senha), nivel_acesso)
+
+@_transacao_escrita
+def _inserir_usuario(nome_usuario, senha_hashed, nivel_acesso):
+    with _conexao() as conn:
         cursor = conn.cursor()
         try:
             cursor.execute(
@@ -370,33 +1407,37 @@ def adicionar_usuario(nome_usuario, senha, nivel_acesso):
 
 def listar_usuarios():
     """Retorna uma lista de todos os usuários cadastrados."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, nome_usuario, nivel_acesso FROM usuarios ORDER BY nome_usuario")
-        return [dict(row) for row in cursor.fetchall()]
+        return _linhas(cursor, 'Usuario').fetchall()
 
 def atualizar_senha_usuario(usuario_id, nova_senha):
     """Atualiza a senha de um usuário específico."""
-    nova_senha_hashed = gerar_hash_com_salt(nova_senha)
-    with sqlite3.connect(DB_FILE) as conn:
+    # O hash (lento de propósito) é calculado antes de reservar a escrita no banco
+    _gravar_hash_senha(usuario_id, gerar_hash_com_salt(nova_senha))
+
+@_transacao_escrita
+def _gravar_hash_senha(usuario_id, nova_senha_hashed):
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("UPDATE usuarios SET senha_hash = ? WHERE id = ?", (nova_senha_hashed, usuario_id))
 
+@_transacao_escrita
 def excluir_usuario(usuario_id):
     """Exclui um usuário do banco de dados."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM usuarios WHERE id = ?", (usuario_id,))
 
 def verificar_usuario(nome_usuario, senha):
     """
     Verifica as credenciais do usuário.
-    É compatível com o formato de hash antigo (sha256) e o novo (salt:hash).
-    Se um hash antigo for validado, ele é atualizado para o novo formato.
+    É compatível com os formatos de hash antigos (sha256 simples e 'salt:hash') e o atual.
+    Se a senha estiver correta e o hash usar um formato ou custo diferente do configurado,
+    ele é refeito com o custo atual. O PBKDF2 é lento de propósito: chame fora da thread da interface.
     """
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with _conexao() as conn:
         cursor = conn.cursor()
         # 1. Busca o usuário pelo nome para obter o hash armazenado
         cursor.execute(
@@ -405,32 +1446,49 @@ def verificar_usuario(nome_usuario, senha):
         )
         usuario = cursor.fetchone()
 
-        if not usuario:
-            return None
-
-        senha_hash_armazenado = usuario['senha_hash']
-        
-        # Tenta verificar com o novo método (que contém ':')
-        if ':' in senha_hash_armazenado:
-            if verificar_hash_com_salt(senha_hash_armazenado, senha):
-                return {'id': usuario['id'], 'nome_usuario': usuario['nome_usuario'], 'nivel_acesso': usuario['nivel_acesso']}
-        else:
-            # Fallback para o método antigo (sha256 simples) para compatibilidade
-            senha_fornecida_hash_antigo = hashlib.sha256(senha.encode('utf-8')).hexdigest()
-            if hmac.compare_digest(senha_hash_armazenado, senha_fornecida_hash_antigo):
-                # Senha antiga correta! Atualiza para o novo formato.
-                print(f"Atualizando formato da senha para o usuário '{nome_usuario}'...")
-                novo_hash_com_salt = gerar_hash_com_salt(senha)
-                cursor.execute("UPDATE usuarios SET senha_hash = ? WHERE id = ?", (novo_hash_com_salt, usuario['id']))
-                return {'id': usuario['id'], 'nome_usuario': usuario['nome_usuario'], 'nivel_acesso': usuario['nivel_acesso']}
-    return None
+    # A conexão volta ao pool antes do cálculo do hash, que pode levar algumas centenas de milissegundos
+    if not usuario:
+        return None
+
+    senha_hash_armazenado = usuario['senha_hash']
+
+    # Tenta verificar com o método PBKDF2 (formato atual ou 'salt:hash')
+    if senha_hash_armazenado.startswith(_PREFIXO_HASH_SENHA) or ':' in senha_hash_armazenado:
+        senha_correta = verificar_hash_com_salt(senha_hash_armazenado, senha)
+    else:
+        # Fallback para o método antigo (sha256 simples) para compatibilidade
+        senha_fornecida_hash_antigo = hashlib.sha256(senha.encode('utf-8')).hexdigest()
+        senha_correta = hmac.compare_digest(senha_hash_armazenado, senha_fornecida_hash_antigo)
+    if not senha_correta:
+        return None
+
+    if hash_senha_desatualizado(senha_hash_armazenado):
+        print(f"Atualizando o hash da senha do usuário '{nome_usuario}' para {SENHA_ALGORITMO}/{SENHA_ITERACOES} iterações...")
+        _atualizar_hash_no_login(usuario['id'], senha_hash_armazenado, gerar_hash_com_salt(senha))
+    return {'id': usuario['id'], 'nome_usuario': usuario['nome_usuario'], 'nivel_acesso': usuario['nivel_acesso']}
+
+@_transacao_escrita
+def _atualizar_hash_no_login(usuario_id, hash_anterior, novo_hash):
+    """Grava o hash refeito, a menos que a senha tenha sido trocada enquanto o login era verificado."""
+    with _conexao() as conn:
+        conn.execute(
+            "UPDATE usuarios SET senha_hash = ? WHERE id = ? AND senha_hash = ?",
+            (novo_hash, usuario_id, hash_anterior)
+        )
 
 # --- Funções de Sessões ---
 
+@_transacao_escrita
 def adicionar_sessao(paciente_id, medico_id, data, hora_inicio, hora_fim, resumo, evolucao, obs_evolucao, plano):
-    """Adiciona uma nova sessão para um paciente."""
-    with sqlite3.connect(DB_FILE) as conn:
+    """
+    Adiciona uma nova sessão para um paciente. Lança ValueError se o terapeuta já tiver uma sessão
+    no horário (verificado dentro da transação, já com a escrita reservada).
+    """
+    with _conexao() as conn:
         cursor = conn.cursor()
+        conflito = _conflito_sessao(cursor, medico_id, data, hora_inicio, hora_fim)
+        if conflito:
+            raise ValueError(f"O terapeuta já possui uma sessão agendada neste horário ({conflito}).")
         # Busca o valor padrão da sessão do paciente
         cursor.execute("SELECT valor_sessao_padrao FROM pacientes WHERE id = ?", (paciente_id,))
         result = cursor.fetchone()
@@ -441,30 +1499,40 @@ def adicionar_sessao(paciente_id, medico_id, data, hora_inicio, hora_fim, resumo
                                   resumo_sessao, nivel_evolucao, observacoes_evolucao, plano_terapeutico, valor_sessao,
                                   status_pagamento)
                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (paciente_id, medico_id, data, hora_inicio, hora_fim, resumo, evolucao, obs_evolucao, plano, valor_padrao, 'Pendente')
+            (paciente_id, medico_id, data, normalizar_hora(hora_inicio), normalizar_hora(hora_fim), resumo, evolucao, obs_evolucao, plano, valor_padrao, 'Pendente')
         )
+        _invalidar_cache_sessoes()
 
-def listar_sessoes_por_paciente(paciente_id):
-    """Retorna uma lista de todas as sessões de um paciente, ordenadas pela data mais recente."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+ORDENACAO_SESSOES_PACIENTE = {
+    'id': 's.id', 'data_sessao': 's.data_sessao', 'hora_inicio_sessao': 's.hora_inicio_sessao',
+    'medico_nome': 'm.nome_completo', 'valor_sessao': 's.valor_sessao', 'status_pagamento': 's.status_pagamento',
+}
+
+def listar_sessoes_por_paciente(paciente_id, ordenar_por=None, decrescente=False, limite=None, deslocamento=0):
+    """
+    Retorna uma lista das sessões de um paciente, ordenadas pela data mais recente
+    (ou pela chave de ORDENACAO_SESSOES_PACIENTE informada), opcionalmente paginada.
+    """
+    with _conexao() as conn:
         cursor = conn.cursor()
+        sql_ordem, params_ordem = _ordem_e_paginacao(
+            ORDENACAO_SESSOES_PACIENTE, ordenar_por, decrescente,
+            "s.data_sessao DESC, s.hora_inicio_sessao DESC, s.id DESC", limite, deslocamento
+        )
         cursor.execute(
             """
             SELECT s.id, s.data_sessao, s.hora_inicio_sessao, s.nivel_evolucao, s.resumo_sessao, m.nome_completo as medico_nome, s.valor_sessao, s.status_pagamento
             FROM sessoes s
             LEFT JOIN medicos m ON s.medico_id = m.id
-            WHERE s.paciente_id = ? 
-            ORDER BY s.data_sessao DESC, s.hora_inicio_sessao DESC
-            """,
-            (paciente_id,)
+            WHERE s.paciente_id = ?
+            """ + sql_ordem,
+            [paciente_id] + params_ordem
         )
-        return [dict(row) for row in cursor.fetchall()]
+        return _linhas(cursor, 'SessaoResumo').fetchall()
 
 def buscar_sessao_por_id(sessao_id):
     """Busca uma sessão específica com todos os seus detalhes pelo ID."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with _conexao() as conn:
         cursor = conn.cursor()
         # Juntando com pacientes e medicos para obter nomes
         cursor.execute("""
@@ -477,13 +1545,52 @@ def buscar_sessao_por_id(sessao_id):
             LEFT JOIN medicos m ON s.medico_id = m.id
             WHERE s.id = ?
         """, (sessao_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        return _linhas(cursor, 'SessaoDetalhada').fetchone()
 
+def listar_sessoes_para_relatorio(data_inicio_db, data_fim_db, paciente_id=None, plano_saude_id=None):
+    """
+    Retorna, em uma única consulta, as sessões do período com todos os campos usados no relatório
+    em PDF (os mesmos de buscar_sessao_por_id), opcionalmente de um paciente ou de um plano de saúde.
+    Ordenadas por paciente e data, na ordem em que são exportadas.
+    """
+    return _listar_linhas(*_consulta_sessoes_para_relatorio(data_inicio_db, data_fim_db, paciente_id, plano_saude_id), 'SessaoDetalhada')
+
+def _consulta_sessoes_para_relatorio(data_inicio_db, data_fim_db, paciente_id=None, plano_saude_id=None):
+    """Monta o SQL e os parâmetros de listar_sessoes_para_relatorio/iter_sessoes_para_relatorio."""
+    filtros, params = ["s.data_sessao BETWEEN ? AND ?"], [data_inicio_db, data_fim_db]
+    if paciente_id is not None:
+        filtros.append("s.paciente_id = ?")
+        params.append(paciente_id)
+    if plano_saude_id is not None:
+        filtros.append("p.plano_saude_id = ?")
+        params.append(plano_saude_id)
+    return f"""
+        SELECT
+            s.*,
+            p.nome_completo as paciente_nome,
+            m.nome_completo as medico_nome
+        FROM sessoes s
+        JOIN pacientes p ON s.paciente_id = p.id
+        LEFT JOIN medicos m ON s.medico_id = m.id
+        WHERE {' AND '.join(filtros)}
+        ORDER BY p.nome_completo, s.paciente_id, s.data_sessao, s.hora_inicio_sessao
+    """, params
+
+def iter_sessoes_para_relatorio(data_inicio_db, data_fim_db, paciente_id=None, plano_saude_id=None):
+    """Como listar_sessoes_para_relatorio, mas gera as linhas aos poucos (ver _iterar_linhas)."""
+    return _iterar_linhas(*_consulta_sessoes_para_relatorio(data_inicio_db, data_fim_db, paciente_id, plano_saude_id), 'SessaoDetalhada')
+
+@_transacao_escrita
 def atualizar_sessao(sessao_id, medico_id, data, hora_inicio, hora_fim, resumo, evolucao, obs_evolucao, plano):
-    """Atualiza os dados de uma sessão existente."""
-    with sqlite3.connect(DB_FILE) as conn:
+    """
+    Atualiza os dados de uma sessão existente. Lança ValueError se o novo horário conflitar com
+    outra sessão do terapeuta (verificado dentro da transação, já com a escrita reservada).
+    """
+    with _conexao() as conn:
         cursor = conn.cursor()
+        conflito = _conflito_sessao(cursor, medico_id, data, hora_inicio, hora_fim, sessao_id)
+        if conflito:
+            raise ValueError(f"O terapeuta já possui uma sessão agendada neste horário ({conflito}).")
         cursor.execute(
             """UPDATE sessoes SET 
                     medico_id = ?,
@@ -495,27 +1602,176 @@ def atualizar_sessao(sessao_id, medico_id, data, hora_inicio, hora_fim, resumo,
                     observacoes_evolucao = ?,
                     plano_terapeutico = ?
                WHERE id = ?""",
-            (medico_id, data, hora_inicio, hora_fim, resumo, evolucao, obs_evolucao, plano, sessao_id)
+            (medico_id, data, normalizar_hora(hora_inicio), normalizar_hora(hora_fim), resumo, evolucao, obs_evolucao, plano, sessao_id)
         )
+        _invalidar_cache_sessoes()
 
+@_transacao_escrita
 def atualizar_financeiro_sessao(sessao_id, valor, status_pagamento):
     """Atualiza apenas os campos financeiros de uma sessão específica."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE sessoes SET valor_sessao = ?, status_pagamento = ? WHERE id = ?",
             (valor, status_pagamento, sessao_id)
         )
 
+LOTE_IDS_SESSOES = 500 # Ids por comando, bem abaixo do limite de parâmetros do SQLite
+
+@_transacao_escrita
+def atualizar_status_pagamento_sessoes(sessao_ids, status_pagamento):
+    """
+    Altera o status de pagamento de várias sessões em uma única transação.
+    Sessões que já estão no status pedido são ignoradas. Retorna um dicionário com
+    'sessoes_alteradas' e 'valor_total' (soma do valor das sessões alteradas).
+    """
+    ids = list(dict.fromkeys(int(sessao_id) for sessao_id in sessao_ids))
+    sessoes_alteradas, valor_total = 0, 0.0
+    with _conexao() as conn:
+        cursor = conn.cursor()
+        for i in range(0, len(ids), LOTE_IDS_SESSOES):
+            lote = ids[i:i + LOTE_IDS_SESSOES]
+            filtro = f"id IN ({','.join('?' * len(lote))}) AND status_pagamento IS NOT ?"
+            cursor.execute(f"SELECT COUNT(*), TOTAL(valor_sessao) FROM sessoes WHERE {filtro}", (*lote, status_pagamento))
+            quantidade, total = cursor.fetchone()
+            cursor.execute(f"UPDATE sessoes SET status_pagamento = ? WHERE {filtro}", (status_pagamento, *lote, status_pagamento))
+            sessoes_alteradas += quantidade
+            valor_total += total
+    return {'sessoes_alteradas': sessoes_alteradas, 'valor_total': valor_total}
+
+@_transacao_escrita
 def excluir_sessao(sessao_id):
     """Exclui uma sessão do banco de dados."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM sessoes WHERE id = ?", (sessao_id,))
+        _invalidar_cache_sessoes()
+
+# --- Agendamento Recorrente ---
+
+LOTE_VERIFICACAO_CONFLITOS = 500 # Candidatos por consulta (4 parâmetros cada, bem abaixo do limite do SQLite)
+
+def gerar_datas_recorrentes(data_inicio_db, data_fim_db, dias_semana, intervalo_semanas=1):
+    """
+    Expande uma regra de recorrência em datas (YYYY-MM-DD): os 'dias_semana' (0 = segunda-feira)
+    entre as duas datas, a cada 'intervalo_semanas' semanas contadas da semana de início.
+    """
+    inicio, fim = date.fromisoformat(data_inicio_db), date.fromisoformat(data_fim_db)
+    segunda_inicial = inicio - timedelta(days=inicio.weekday())
+    datas = []
+    dia = inicio
+    while dia <= fim:
+        semana = (dia - segunda_inicial).days // 7
+        if dia.weekday() in dias_semana and semana % intervalo_semanas == 0:
+            datas.append(dia.isoformat())
+        dia += timedelta(days=1)
+    return datas
+
+def verificar_conflitos_em_lote(medico_id, candidatos, cursor=None):
+    """
+    Verifica de uma vez uma lista de candidatos (data, hora_inicio, hora_fim) contra as sessões do terapeuta
+    e entre si. Retorna {índice do candidato: descrição do conflito} apenas para os que conflitam.
+    """
+    if cursor is None:
+        with _conexao() as conn:
+            return verificar_conflitos_em_lote(medico_id, candidatos, conn.cursor())
+    candidatos = [(data, normalizar_hora(inicio), normalizar_hora(fim)) for data, inicio, fim in candidatos]
+    conflitos = {}
+
+    # Contra as sessões já gravadas: uma consulta por lote, juntando os candidatos (VALUES) com 'sessoes'
+    for inicio_lote in range(0, len(candidatos), LOTE_VERIFICACAO_CONFLITOS):
+        lote = candidatos[inicio_lote:inicio_lote + LOTE_VERIFICACAO_CONFLITOS]
+        valores = ', '.join(['(?, ?, ?, ?)'] * len(lote))
+        params = [valor for i, candidato in enumerate(lote, start=inicio_lote) for valor in (i, *candidato)]
+        cursor.execute(f"""
+            WITH candidatos(indice, data, hora_inicio, hora_fim) AS (VALUES {valores})
+            SELECT candidatos.indice, s.hora_inicio_sessao, s.hora_fim_sessao, p.nome_completo as paciente_nome
+            FROM candidatos
+            JOIN sessoes s ON s.medico_id = ? AND s.data_sessao = candidatos.data
+                          AND s.hora_inicio_sessao < candidatos.hora_fim AND s.hora_fim_sessao > candidatos.hora_inicio
+            JOIN pacientes p ON s.paciente_id = p.id
+        """, params + [medico_id])
+        for indice, hora_inicio, hora_fim, paciente_nome in cursor.fetchall():
+            conflitos.setdefault(indice, f"Sessão de {paciente_nome} das {hora_inicio} às {hora_fim}")
+
+    # Entre os próprios candidatos (ex.: regra com horários sobrepostos no mesmo dia)
+    por_data = {}
+    for i, (data, inicio, fim) in enumerate(candidatos):
+        por_data.setdefault(data, []).append((hora_para_minutos(inicio), hora_para_minutos(fim), i))
+    for intervalos in por_data.values():
+        intervalos.sort()
+        maior_fim, dono = -1, None
+        for inicio, fim, i in intervalos:
+            if inicio < maior_fim:
+                conflitos.setdefault(i, f"Sobrepõe outro horário do mesmo agendamento ({candidatos[dono][1]})")
+            if fim > maior_fim:
+                maior_fim, dono = fim, i
+    return conflitos
+
+@_transacao_escrita
+def agendar_sessoes_em_lote(paciente_id, medico_id, candidatos, plano=''):
+    """
+    Agenda várias sessões (data, hora_inicio, hora_fim) de um paciente em uma única transação.
+    Os conflitos são verificados de novo dentro da transação, já com a escrita reservada; os candidatos
+    que conflitam são pulados. Retorna (quantidade inserida, {índice: conflito}).
+    """
+    with _conexao() as conn:
+        cursor = conn.cursor()
+        conflitos = verificar_conflitos_em_lote(medico_id, candidatos, cursor)
+        cursor.execute("SELECT valor_sessao_padrao FROM pacientes WHERE id = ?", (paciente_id,))
+        result = cursor.fetchone()
+        valor_padrao = result[0] if result else 0.0
+        linhas = [
+            (paciente_id, medico_id, data, normalizar_hora(inicio), normalizar_hora(fim), plano, valor_padrao, 'Pendente')
+            for i, (data, inicio, fim) in enumerate(candidatos) if i not in conflitos
+        ]
+        cursor.executemany(
+            """INSERT INTO sessoes (paciente_id, medico_id, data_sessao, hora_inicio_sessao, hora_fim_sessao,
+                                  plano_terapeutico, valor_sessao, status_pagamento)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            linhas
+        )
+        _invalidar_cache_sessoes()
+        return len(linhas), conflitos
+
+# Cache das datas com sessões por mês, usado pelo calendário do painel principal.
+# É descartado após o commit de qualquer escrita em sessões desta estação.
+_cache_datas_sessoes = {}
+_cache_datas_sessoes_geracao = 0
+_cache_datas_sessoes_lock = threading.Lock()
+
+def limpar_cache_datas_sessoes():
+    """Descarta o cache de datas com sessões (ex.: para ver alterações feitas em outra estação)."""
+    global _cache_datas_sessoes_geracao
+    with _cache_datas_sessoes_lock:
+        _cache_datas_sessoes.clear()
+        _cache_datas_sessoes_geracao += 1
+
+def _invalidar_cache_sessoes():
+    _obter_pool().apos_commit(limpar_cache_datas_sessoes)
+
+def listar_datas_sessoes_do_mes(ano, mes):
+    """Retorna as datas (YYYY-MM-DD) com sessões em um mês, usando o cache por mês."""
+    with _cache_datas_sessoes_lock:
+        if (ano, mes) in _cache_datas_sessoes:
+            return list(_cache_datas_sessoes[(ano, mes)])
+        geracao = _cache_datas_sessoes_geracao
+    with _conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT DISTINCT data_sessao FROM sessoes WHERE data_sessao BETWEEN ? AND ?",
+            (f"{ano}-{mes:02d}-01", f"{ano}-{mes:02d}-31")
+        )
+        datas = [row[0] for row in cursor.fetchall()]
+    with _cache_datas_sessoes_lock:
+        # Só guarda se nenhuma escrita tiver invalidado o cache durante a consulta
+        if geracao == _cache_datas_sessoes_geracao:
+            _cache_datas_sessoes[(ano, mes)] = datas
+    return list(datas)
 
 def listar_datas_sessoes():
     """Retorna uma lista de datas únicas (YYYY-MM-DD) que possuem sessões agendadas."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT DISTINCT data_sessao FROM sessoes")
         # Retorna uma lista de strings de data, ex: ['2023-10-26', '2023-10-27']
@@ -523,7 +1779,7 @@ def listar_datas_sessoes():
 
 def listar_sessoes_por_medico_e_data(medico_id, data_db):
     """Retorna os horários de início das sessões já agendadas para um médico em uma data."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT hora_inicio_sessao FROM sessoes WHERE medico_id = ? AND data_sessao = ?",
@@ -531,30 +1787,161 @@ def listar_sessoes_por_medico_e_data(medico_id, data_db):
         )
         return [row[0] for row in cursor.fetchall()]
 
+# --- Horários das Sessões ---
+
+def hora_para_minutos(hora):
+    """
+    Converte 'H:MM' ou 'HH:MM' (segundos são ignorados) em minutos desde a meia-noite.
+    Retorna None para horário vazio e levanta ValueError para um horário inválido.
+    """
+    if hora is None or not str(hora).strip():
+        return None
+    horas, _, minutos = str(hora).strip().partition(':')
+    try:
+        total = int(horas) * 60 + int(minutos[:2])
+    except ValueError:
+        raise ValueError(f"Horário inválido: '{hora}'.") from None
+    if not (0 <= int(minutos[:2]) < 60 and 0 <= total <= 24 * 60):
+        raise ValueError(f"Horário inválido: '{hora}'.")
+    return total
+
+def minutos_para_hora(minutos):
+    """Converte minutos desde a meia-noite em 'HH:MM'."""
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+def normalizar_hora(hora):
+    """Grava os horários sempre como 'HH:MM' ('9:00' -> '09:00'); vazio continua vazio."""
+    minutos = hora_para_minutos(hora)
+    return hora if minutos is None else minutos_para_hora(minutos)
+
+def _conflito_sessao(cursor, medico_id, data_db, hora_inicio, hora_fim, sessao_id_excluir=None):
+    """
+    Retorna a descrição da sessão do terapeuta que conflita com o horário, ou None.
+    A lógica de conflito é: (StartA < EndB) and (EndA > StartB). Os horários são gravados como 'HH:MM',
+    então a comparação é feita no próprio banco, pelo índice idx_sessoes_medico_data.
+    """
+    if medico_id is None or hora_para_minutos(hora_inicio) is None or hora_para_minutos(hora_fim) is None:
+        return None
+    cursor.execute("""
+        SELECT s.hora_inicio_sessao, s.hora_fim_sessao, p.nome_completo
+        FROM sessoes s
+        JOIN pacientes p ON s.paciente_id = p.id
+        WHERE s.medico_id = ? AND s.data_sessao = ?
+          AND s.hora_inicio_sessao < ? AND s.hora_fim_sessao > ? AND s.id IS NOT ?
+        LIMIT 1
+    """, (medico_id, data_db, normalizar_hora(hora_fim), normalizar_hora(hora_inicio),
+          int(sessao_id_excluir) if sessao_id_excluir else None))
+    conflito = cursor.fetchone()
+    return f"Sessão de {conflito[2]} das {conflito[0]} às {conflito[1]}" if conflito else None
+
 def verificar_conflito_sessao(medico_id, data_db, hora_inicio, hora_fim, sessao_id_excluir=None):
     """
     Verifica se já existe uma sessão para um médico que conflite com o novo horário.
-    A lógica de conflito é: (StartA < EndB) and (EndA > StartB)
+    Consulta o banco para enxergar também o que outras estações acabaram de gravar. adicionar_sessao e atualizar_sessao repetem a verificação
+    dentro da transação de escrita.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
+        return _conflito_sessao(conn.cursor(), medico_id, data_db, hora_inicio, hora_fim, sessao_id_excluir) is not None
+
+def _intervalos_em_minutos(linhas):
+    """Converte (hora_inicio, hora_fim) em intervalos de minutos ordenados, ignorando horários vazios ou inválidos."""
+    intervalos = []
+    for hora_inicio, hora_fim in linhas:
+        try:
+            inicio, fim = hora_para_minutos(hora_inicio), hora_para_minutos(hora_fim)
+        except ValueError:
+            continue
+        if inicio is not None and fim is not None and inicio < fim:
+            intervalos.append((inicio, fim))
+    intervalos.sort()
+    return intervalos
+
+def _unir_intervalos(intervalos):
+    """Junta intervalos ordenados que se sobrepõem ou se encostam (ex.: 08:00-12:00 e 11:00-14:00)."""
+    unidos = []
+    for inicio, fim in intervalos:
+        if unidos and inicio <= unidos[-1][1]:
+            unidos[-1] = (unidos[-1][0], max(unidos[-1][1], fim))
+        else:
+            unidos.append((inicio, fim))
+    return unidos
+
+def _subtrair_intervalos(disponiveis, ocupados, duracao_minima):
+    """
+    Subtrai os intervalos ocupados dos disponíveis (ambos ordenados pelo início) em uma única passada
+    e retorna os trechos livres com pelo menos 'duracao_minima' minutos.
+    """
+    livres = []
+    j = 0
+    for inicio_disp, fim_disp in disponiveis:
+        atual = inicio_disp
+        # Ocupados que terminam antes desta janela não afetam as próximas (as janelas vêm em ordem)
+        while j < len(ocupados) and ocupados[j][1] <= atual:
+            j += 1
+        k = j
+        while k < len(ocupados) and ocupados[k][0] < fim_disp:
+            inicio_ocup, fim_ocup = ocupados[k]
+            if inicio_ocup - atual >= duracao_minima:
+                livres.append((atual, inicio_ocup))
+            atual = max(atual, fim_ocup)
+            k += 1
+        if fim_disp - atual >= duracao_minima:
+            livres.append((atual, fim_disp))
+    return livres
+
+def buscar_horarios_livres(data_inicio_db, data_fim_db, duracao_minutos, medico_ids=None, hora_minima=None, limite=None):
+    """
+    Retorna os horários livres dos terapeutas entre duas datas: a disponibilidade (avulsa e semanal) menos as
+    sessões já marcadas, em trechos de pelo menos 'duracao_minutos'. Cada item traz medico_id, medico_nome,
+    data, hora_inicio e hora_fim, em ordem cronológica. 'medico_ids' restringe os terapeutas e
+    'hora_minima' descarta o que já passou no primeiro dia (ex.: a hora atual, quando ele é hoje).
+    """
+    sql_disponibilidade, params = _disponibilidade_expandida(data_inicio_db, data_fim_db, medico_ids)
+    filtro_sessoes = ""
+    if medico_ids:
+        filtro_sessoes = f" AND medico_id IN ({', '.join(f':medico{i}' for i in range(len(medico_ids)))})"
+    with _conexao() as conn:
         cursor = conn.cursor()
-        query = """
-            SELECT 1 FROM sessoes 
-            WHERE medico_id = ? AND data_sessao = ? 
-            AND hora_inicio_sessao < ? AND hora_fim_sessao > ?
-        """
-        params = [medico_id, data_db, hora_fim, hora_inicio]
-        if sessao_id_excluir:
-            query += " AND id != ?"
-            params.append(sessao_id_excluir)
-        
-        cursor.execute(query, params)
-        return cursor.fetchone() is not None
+        # Uma consulta para a disponibilidade (avulsa e semanal) e outra para as sessões do período inteiro,
+        # agrupadas depois por (terapeuta, data)
+        cursor.execute(sql_disponibilidade + """
+            SELECT medico_id, (SELECT m.nome_completo FROM medicos m WHERE m.id = disponibilidade.medico_id) as medico_nome,
+                   data, hora_inicio, hora_fim
+            FROM disponibilidade
+        """, params)
+        disponibilidades = cursor.fetchall()
+        cursor.execute(
+            "SELECT medico_id, data_sessao, hora_inicio_sessao, hora_fim_sessao FROM sessoes WHERE data_sessao BETWEEN :inicio AND :fim" + filtro_sessoes,
+            params
+        )
+        sessoes = cursor.fetchall()
+
+    ocupados = {}
+    for medico_id, data_sessao, hora_inicio, hora_fim in sessoes:
+        ocupados.setdefault((medico_id, data_sessao), []).append((hora_inicio, hora_fim))
+    disponiveis, nomes = {}, {}
+    for medico_id, medico_nome, data_disponivel, hora_inicio, hora_fim in disponibilidades:
+        disponiveis.setdefault((medico_id, data_disponivel), []).append((hora_inicio, hora_fim))
+        nomes[medico_id] = medico_nome
+
+    minimo_primeiro_dia = hora_para_minutos(hora_minima)
+    horarios = []
+    for (medico_id, data_db), janelas in disponiveis.items():
+        janelas = _unir_intervalos(_intervalos_em_minutos(janelas))
+        if minimo_primeiro_dia is not None and data_db == data_inicio_db:
+            janelas = [(max(inicio, minimo_primeiro_dia), fim) for inicio, fim in janelas if fim > minimo_primeiro_dia]
+        livres = _subtrair_intervalos(janelas, _intervalos_em_minutos(ocupados.get((medico_id, data_db), [])), duracao_minutos)
+        for inicio, fim in livres:
+            horarios.append({
+                'medico_id': medico_id, 'medico_nome': nomes[medico_id], 'data': data_db,
+                'hora_inicio': minutos_para_hora(inicio), 'hora_fim': minutos_para_hora(fim),
+            })
+    horarios.sort(key=lambda h: (h['data'], h['hora_inicio'], h['medico_nome']))
+    return horarios[:limite] if limite is not None else horarios
 
 def listar_sessoes_por_data(data_db):
     """Retorna as sessões de uma data específica com nome do paciente e médico."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT s.hora_inicio_sessao, s.hora_fim_sessao, p.nome_completo as paciente_nome, m.nome_completo as medico_nome
@@ -564,27 +1951,27 @@ def listar_sessoes_por_data(data_db):
             WHERE s.data_sessao = ?
             ORDER BY s.hora_inicio_sessao
         """, (data_db,))
-        return [dict(row) for row in cursor.fetchall()]
+        return _linhas(cursor, 'SessaoAgenda').fetchall()
 
 def listar_disponibilidade_geral_por_data(data_db):
-    """Retorna a disponibilidade de todos os médicos para uma data específica."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    """Retorna a disponibilidade (avulsa e semanal) de todos os médicos para uma data específica."""
+    sql, params = _disponibilidade_expandida(data_db, data_db)
+    with _conexao() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT d.hora_inicio, d.hora_fim, m.nome_completo as medico_nome
-            FROM disponibilidade_medico d
-            JOIN medicos m ON d.medico_id = m.id
-            WHERE d.data_disponivel = ?
-            ORDER BY m.nome_completo, d.hora_inicio
-        """, (data_db,))
-        return [dict(row) for row in cursor.fetchall()]
+        cursor.execute(sql + """
+            SELECT disponibilidade.hora_inicio, disponibilidade.hora_fim, m.nome_completo as medico_nome
+            FROM disponibilidade
+            JOIN medicos m ON disponibilidade.medico_id = m.id
+            ORDER BY m.nome_completo, disponibilidade.hora_inicio
+        """, params)
+        return _linhas(cursor, 'DisponibilidadeAgenda').fetchall()
 
 # --- Funções Financeiras ---
 
+@_transacao_escrita
 def adicionar_despesa(descricao, valor, data_db):
     """Adiciona uma nova despesa ao banco de dados."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO despesas (descricao, valor, data) VALUES (?, ?, ?)",
@@ -593,53 +1980,194 @@ def adicionar_despesa(descricao, valor, data_db):
 
 def listar_despesas_por_periodo(data_inicio_db, data_fim_db):
     """Retorna uma lista de todas as despesas em um período."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM despesas WHERE data BETWEEN ? AND ? ORDER BY data DESC",
-            (data_inicio_db, data_fim_db)
-        )
-        return [dict(row) for row in cursor.fetchall()]
+    return _listar_linhas(*_consulta_despesas_por_periodo(data_inicio_db, data_fim_db), 'Despesa')
+
+def _consulta_despesas_por_periodo(data_inicio_db, data_fim_db):
+    """Monta o SQL e os parâmetros de listar_despesas_por_periodo/iter_despesas_por_periodo."""
+    return "SELECT * FROM despesas WHERE data BETWEEN ? AND ? ORDER BY data DESC", (data_inicio_db, data_fim_db)
+
+def iter_despesas_por_periodo(data_inicio_db, data_fim_db):
+    """Como listar_despesas_por_periodo, mas gera as linhas aos poucos (ver _iterar_linhas)."""
+    return _iterar_linhas(*_consulta_despesas_por_periodo(data_inicio_db, data_fim_db), 'Despesa')
 
-def listar_sessoes_financeiro_por_periodo(data_inicio_db, data_fim_db):
+ORDENACAO_SESSOES_FINANCEIRO = {
+    'id': 's.id', 'data_sessao': 's.data_sessao', 'paciente_nome': 'p.nome_completo',
+    'medico_nome': 'm.nome_completo', 'valor_sessao': 's.valor_sessao', 'status_pagamento': 's.status_pagamento',
+}
+
+def listar_sessoes_financeiro_por_periodo(data_inicio_db, data_fim_db, ordenar_por=None, decrescente=False, limite=None, deslocamento=0):
+    """
+    Retorna uma lista das sessões (pagas e pendentes) em um período,
+    para uso na tela de fluxo de caixa. Aceita ordenação e paginação.
     """
-    Retorna uma lista de todas as sessões (pagas e pendentes) em um período,
-    para uso na tela de fluxo de caixa.
+    return _listar_linhas(*_consulta_sessoes_financeiro_por_periodo(data_inicio_db, data_fim_db, ordenar_por, decrescente, limite, deslocamento), 'SessaoFinanceira')
+
+def _consulta_sessoes_financeiro_por_periodo(data_inicio_db, data_fim_db, ordenar_por=None, decrescente=False, limite=None, deslocamento=0):
+    """Monta o SQL e os parâmetros de listar_sessoes_financeiro_por_periodo/iter_sessoes_financeiro_por_periodo."""
+    sql_ordem, params_ordem = _ordem_e_paginacao(
+        ORDENACAO_SESSOES_FINANCEIRO, ordenar_por, decrescente,
+        "s.data_sessao DESC, s.status_pagamento, s.id", limite, deslocamento
+    )
+    return """
+        SELECT s.id, s.data_sessao, s.valor_sessao, s.status_pagamento, p.nome_completo as paciente_nome, m.nome_completo as medico_nome
+        FROM sessoes s
+        JOIN pacientes p ON s.paciente_id = p.id
+        LEFT JOIN medicos m ON s.medico_id = m.id
+        WHERE s.data_sessao BETWEEN ? AND ?
+    """ + sql_ordem, [data_inicio_db, data_fim_db] + params_ordem
+
+def iter_sessoes_financeiro_por_periodo(data_inicio_db, data_fim_db, ordenar_por=None, decrescente=False, limite=None, deslocamento=0):
+    """Como listar_sessoes_financeiro_por_periodo, mas gera as linhas aos poucos (ver _iterar_linhas)."""
+    return _iterar_linhas(*_consulta_sessoes_financeiro_por_periodo(data_inicio_db, data_fim_db, ordenar_por, decrescente, limite, deslocamento), 'SessaoFinanceira')
+
+DIAS_MINIMOS_RESUMO_DIARIO = 60 # A partir deste período os totais são lidos do resumo diário
+
+def _periodo_usa_resumo(data_inicio_db, data_fim_db):
+    """Indica se o período é longo o bastante para somar o resumo diário em vez das sessões."""
+    return (date.fromisoformat(data_fim_db) - date.fromisoformat(data_inicio_db)).days >= DIAS_MINIMOS_RESUMO_DIARIO
+
+@_transacao_escrita
+def reconstruir_resumo_financeiro():
     """
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    Refaz o resumo financeiro diário a partir das sessões e despesas. Os triggers o mantêm
+    atualizado; a reconstrução corrige um banco editado por fora do sistema. Retorna o número de linhas.
+    """
+    inicio = time.perf_counter()
+    with _conexao() as conn:
+        cursor = conn.cursor()
+        _reconstruir_resumo_financeiro(cursor)
+        cursor.execute("SELECT COUNT(*) FROM resumo_financeiro_diario")
+        linhas = cursor.fetchone()[0]
+    print(f"Resumo financeiro reconstruído ({linhas} linhas) em {(time.perf_counter() - inicio) * 1000:.1f} ms.")
+    return linhas
+
+# Somas usadas por todos os totais financeiros (qualquer status diferente de 'Pago' conta como a receber)
+_SQL_SOMAS_FINANCEIRAS = """
+    COUNT(*) as quantidade,
+    TOTAL(CASE WHEN status_pagamento = 'Pago' THEN valor_sessao END) as total_recebido,
+    TOTAL(CASE WHEN status_pagamento = 'Pago' THEN NULL ELSE valor_sessao END) as total_a_receber
+"""
+# As mesmas somas a partir do resumo diário
+_SQL_SOMAS_RESUMO = """
+    COALESCE(SUM(quantidade_sessoes), 0) as quantidade,
+    TOTAL(total_recebido) as total_recebido,
+    TOTAL(total_a_receber) as total_a_receber
+"""
+
+def calcular_totais_financeiros_por_periodo(data_inicio_db, data_fim_db):
+    """Retorna o total recebido, a receber e de despesas de um período, somados no próprio banco."""
+    with _conexao() as conn:
+        cursor = conn.cursor()
+        if _periodo_usa_resumo(data_inicio_db, data_fim_db):
+            cursor.execute(f"""
+                SELECT {_SQL_SOMAS_RESUMO}, TOTAL(total_despesas) as total_despesas
+                FROM resumo_financeiro_diario
+                WHERE data BETWEEN ? AND ?
+            """, (data_inicio_db, data_fim_db))
+            return dict(cursor.fetchone())
+        cursor.execute(f"""
+            SELECT {_SQL_SOMAS_FINANCEIRAS}
+            FROM sessoes
+            WHERE data_sessao BETWEEN ? AND ?
+        """, (data_inicio_db, data_fim_db))
+        totais = dict(cursor.fetchone())
+        cursor.execute("SELECT TOTAL(valor) FROM despesas WHERE data BETWEEN ? AND ?", (data_inicio_db, data_fim_db))
+        totais['total_despesas'] = cursor.fetchone()[0]
+        return totais
+
+def calcular_totais_por_status(data_inicio_db, data_fim_db):
+    """Retorna a quantidade e o valor das sessões do período para cada status de pagamento."""
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT s.id, s.data_sessao, s.valor_sessao, s.status_pagamento, p.nome_completo as paciente_nome, m.nome_completo as medico_nome
-            FROM sessoes s
-            JOIN pacientes p ON s.paciente_id = p.id
-            LEFT JOIN medicos m ON s.medico_id = m.id
-            WHERE s.data_sessao BETWEEN ? AND ?
-            ORDER BY s.data_sessao DESC, s.status_pagamento
+            SELECT COALESCE(status_pagamento, 'Pendente') as status_pagamento,
+                   COUNT(*) as quantidade, TOTAL(valor_sessao) as total
+            FROM sessoes
+            WHERE data_sessao BETWEEN ? AND ?
+            GROUP BY 1
+            ORDER BY 1
         """, (data_inicio_db, data_fim_db))
-        return [dict(row) for row in cursor.fetchall()]
+        return _linhas(cursor, 'TotalPorStatus').fetchall()
+
+# Expressões de agrupamento aceitas por calcular_totais_por_data (as datas são gravadas como YYYY-MM-DD)
+AGRUPAMENTOS_POR_DATA = {'dia': '{coluna}', 'mes': 'substr({coluna}, 1, 7)'}
+
+def calcular_totais_por_data(data_inicio_db, data_fim_db, agrupar_por='dia'):
+    """
+    Retorna os totais recebido e a receber do período agrupados por dia ('YYYY-MM-DD')
+    ou por mês ('YYYY-MM'), em ordem cronológica. Lança ValueError para outro agrupamento.
+    """
+    if agrupar_por not in AGRUPAMENTOS_POR_DATA:
+        raise ValueError(f"Agrupamento inválido: {agrupar_por}")
+    with _conexao() as conn:
+        cursor = conn.cursor()
+        if _periodo_usa_resumo(data_inicio_db, data_fim_db):
+            cursor.execute(f"""
+                SELECT {AGRUPAMENTOS_POR_DATA[agrupar_por].format(coluna='data')} as periodo, {_SQL_SOMAS_RESUMO}
+                FROM resumo_financeiro_diario
+                WHERE data BETWEEN ? AND ?
+                GROUP BY periodo
+                HAVING quantidade > 0
+                ORDER BY periodo
+            """, (data_inicio_db, data_fim_db))
+            return _linhas(cursor, 'TotalPorPeriodo').fetchall()
+        cursor.execute(f"""
+            SELECT {AGRUPAMENTOS_POR_DATA[agrupar_por].format(coluna='data_sessao')} as periodo, {_SQL_SOMAS_FINANCEIRAS}
+            FROM sessoes
+            WHERE data_sessao BETWEEN ? AND ?
+            GROUP BY periodo
+            ORDER BY periodo
+        """, (data_inicio_db, data_fim_db))
+        return _linhas(cursor, 'TotalPorPeriodo').fetchall()
+
+def calcular_totais_por_terapeuta(data_inicio_db, data_fim_db):
+    """Retorna os totais recebido e a receber do período por terapeuta, do maior faturamento para o menor."""
+    with _conexao() as conn:
+        cursor = conn.cursor()
+        if _periodo_usa_resumo(data_inicio_db, data_fim_db):
+            cursor.execute(f"""
+                SELECT NULLIF(medico_id, 0) as medico_id, -- No resumo, sessão sem terapeuta fica com id 0
+                       (SELECT nome_completo FROM medicos WHERE id = medico_id) as medico_nome,
+                       {_SQL_SOMAS_RESUMO}
+                FROM resumo_financeiro_diario
+                WHERE data BETWEEN ? AND ?
+                GROUP BY medico_id
+                HAVING quantidade > 0
+                ORDER BY total_recebido + total_a_receber DESC
+            """, (data_inicio_db, data_fim_db))
+            return _linhas(cursor, 'TotalPorTerapeuta').fetchall()
+        cursor.execute(f"""
+            SELECT medico_id,
+                   (SELECT nome_completo FROM medicos WHERE id = medico_id) as medico_nome,
+                   {_SQL_SOMAS_FINANCEIRAS}
+            FROM sessoes
+            WHERE data_sessao BETWEEN ? AND ?
+            GROUP BY +medico_id -- O '+' mantém o índice de cobertura do período em vez de percorrer idx_sessoes_medico_data
+            ORDER BY total_recebido + total_a_receber DESC
+        """, (data_inicio_db, data_fim_db))
+        return _linhas(cursor, 'TotalPorTerapeuta').fetchall()
 
 def listar_planos_saude():
     """Retorna uma lista de todos os planos de saúde cadastrados."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, nome FROM planos_saude ORDER BY nome")
-        return [dict(row) for row in cursor.fetchall()]
+        return _linhas(cursor, 'PlanoSaude').fetchall()
 
+@_transacao_escrita
 def adicionar_plano_saude(nome):
     """Adiciona um novo plano de saúde. Lança ValueError se o nome já existir."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         try:
             cursor.execute("INSERT INTO planos_saude (nome) VALUES (?)", (nome,))
         except sqlite3.IntegrityError:
             raise ValueError(f"O plano de saúde '{nome}' já existe.")
 
+@_transacao_escrita
 def excluir_plano_saude(plano_id):
     """Exclui um plano de saúde. Lança IntegrityError se estiver em uso."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         # A restrição de chave estrangeira impedirá a exclusão se o plano estiver em uso.
         # A exceção sqlite3.IntegrityError será capturada na UI.
@@ -647,7 +2175,7 @@ def excluir_plano_saude(plano_id):
 
 def verificar_pendencias_paciente(paciente_id):
     """Verifica se um paciente possui sessões com pagamento pendente."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT 1 FROM sessoes WHERE paciente_id = ? AND status_pagamento = 'Pendente' LIMIT 1",
@@ -657,8 +2185,7 @@ def verificar_pendencias_paciente(paciente_id):
 
 def listar_sessoes_pendentes_por_paciente(paciente_id):
     """Retorna uma lista das sessões com pagamento pendente de um paciente."""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute(
             """
@@ -669,11 +2196,12 @@ def listar_sessoes_pendentes_por_paciente(paciente_id):
             """,
             (paciente_id,)
         )
-        return [dict(row) for row in cursor.fetchall()]
+        return _linhas(cursor, 'SessaoPendente').fetchall()
 
+@_transacao_escrita
 def marcar_todas_sessoes_como_pagas(paciente_id):
     """Marca todas as sessões pendentes de um paciente como 'Pago'."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _conexao() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE sessoes SET status_pagamento = 'Pago' WHERE paciente_id = ? AND status_pagamento = 'Pendente'",
@@ -684,9 +2212,20 @@ def listar_receitas_agrupadas_por_plano(data_inicio_db, data_fim_db):
     """
     Calcula o total de receitas (sessões pagas) agrupado por plano de saúde em um período.
     """
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with _conexao() as conn:
         cursor = conn.cursor()
+        if _periodo_usa_resumo(data_inicio_db, data_fim_db):
+            cursor.execute("""
+                SELECT
+                    (SELECT nome FROM planos_saude WHERE id = plano_saude_id) as plano_nome,
+                    SUM(total_recebido) as total_valor
+                FROM resumo_financeiro_diario
+                WHERE data BETWEEN ? AND ? AND plano_saude_id <> 0
+                GROUP BY plano_saude_id
+                HAVING plano_nome IS NOT NULL AND ROUND(total_valor, 2) > 0
+                ORDER BY total_valor DESC
+            """, (data_inicio_db, data_fim_db))
+            return _linhas(cursor, 'ReceitaPorPlano').fetchall()
         cursor.execute("""
             SELECT 
                 ps.nome as plano_nome,
@@ -696,40 +2235,477 @@ def listar_receitas_agrupadas_por_plano(data_inicio_db, data_fim_db):
             JOIN planos_saude ps ON p.plano_saude_id = ps.id
             WHERE s.status_pagamento = 'Pago' AND s.data_sessao BETWEEN ? AND ?
             GROUP BY ps.nome
+            HAVING ROUND(total_valor, 2) > 0 -- Como no resumo, que não distingue plano sem receita de receita zerada
             ORDER BY total_valor DESC
         """, (data_inicio_db, data_fim_db))
-        return [dict(row) for row in cursor.fetchall()]
+        return _linhas(cursor, 'ReceitaPorPlano').fetchall()
 
-def listar_todas_sessoes_pendentes(termo_busca=None):
+ORDENACAO_SESSOES_PENDENTES = {
+    'id': 's.id', 'paciente_nome': 'p.nome_completo', 'data_sessao': 's.data_sessao', 'valor_sessao': 's.valor_sessao',
+}
+
+def listar_todas_sessoes_pendentes(termo_busca=None, ordenar_por=None, decrescente=False, limite=None, deslocamento=0):
     """
     Retorna uma lista de todas as sessões com pagamento pendente,
-    opcionalmente filtrando pelo nome do paciente.
+    opcionalmente filtrando pela busca de texto do paciente. Aceita ordenação e paginação.
+    """
+    return _listar_linhas(*_consulta_todas_sessoes_pendentes(termo_busca, ordenar_por, decrescente, limite, deslocamento), 'SessaoPendente')
+
+def _consulta_todas_sessoes_pendentes(termo_busca=None, ordenar_por=None, decrescente=False, limite=None, deslocamento=0):
+    """Monta o SQL e os parâmetros de listar_todas_sessoes_pendentes/iter_todas_sessoes_pendentes."""
+    query = """
+        SELECT s.id, s.data_sessao, s.valor_sessao, p.nome_completo as paciente_nome
+        FROM sessoes s
+        JOIN pacientes p ON s.paciente_id = p.id
+        WHERE s.status_pagamento = 'Pendente'
+    """
+    params = []
+    expressao = _expressao_busca_pacientes(termo_busca)
+    if expressao:
+        query += " AND " + _SQL_FILTRO_BUSCA_PACIENTES
+        params.append(expressao)
+    sql_ordem, params_ordem = _ordem_e_paginacao(
+        ORDENACAO_SESSOES_PENDENTES, ordenar_por, decrescente, "p.nome_completo, s.data_sessao, s.id", limite, deslocamento
+    )
+    return query + sql_ordem, params + params_ordem
+
+def iter_todas_sessoes_pendentes(termo_busca=None, ordenar_por=None, decrescente=False, limite=None, deslocamento=0):
+    """Como listar_todas_sessoes_pendentes, mas gera as linhas aos poucos (ver _iterar_linhas)."""
+    return _iterar_linhas(*_consulta_todas_sessoes_pendentes(termo_busca, ordenar_por, decrescente, limite, deslocamento), 'SessaoPendente')
+
+# --- Backup ---
+
+BACKUP_PAGINAS_POR_PASSO = 1024 # Páginas copiadas por passo; entre um passo e outro as outras conexões podem escrever
+BACKUP_PAUSA_SEGUNDOS = 0.005 # Pausa entre os passos
+BACKUP_MAXIMO_REINICIOS = 3 # Escritas de outras conexões reiniciam a cópia; depois disso, ela é feita em um único passo
+BACKUP_GERACOES = 7 # Backups automáticos mantidos na pasta
+BACKUP_INTERVALO_HORAS = 24 # Intervalo entre backups automáticos
+BACKUP_PREFIXO = 'backup_clinica_'
+BACKUP_AUTOMATICO_INCREMENTAL = True # Backups automáticos guardam só as páginas alteradas (ver backup_incremental)
+
+class _BackupReiniciado(Exception):
+    """A cópia em passos foi reiniciada vezes demais por escritas concorrentes."""
+
+def _copiar_banco(destino, ao_progredir=None):
+    """
+    Copia o banco para o arquivo 'destino' com a API de backup do SQLite. A cópia é sempre
+    consistente, mesmo com outras conexões escrevendo durante o backup.
+    """
+    def copiar(paginas, progresso):
+        with _conexao() as origem:
+            copia = sqlite3.connect(destino)
+            try:
+                origem.backup(copia, pages=paginas, progress=progresso, sleep=BACKUP_PAUSA_SEGUNDOS)
+            finally:
+                copia.close()
+
+    estado = {'restantes': None, 'reinicios': 0}
+
+    def progresso(status, restantes, total):
+        if estado['restantes'] is not None and restantes > estado['restantes']:
+            estado['reinicios'] += 1 # Outra conexão escreveu e a cópia recomeçou
+            if estado['reinicios'] > BACKUP_MAXIMO_REINICIOS:
+                raise _BackupReiniciado()
+        estado['restantes'] = restantes
+        if ao_progredir:
+            ao_progredir(total - restantes, total, f"Copiando páginas: {total - restantes} de {total}")
+
+    try:
+        copiar(BACKUP_PAGINAS_POR_PASSO, progresso)
+    except _BackupReiniciado:
+        # Em um único passo a cópia não é interrompida (no modo WAL as escritas continuam normalmente)
+        print("Backup: muitas escritas durante a cópia, concluindo em um único passo.")
+        copiar(-1, None)
+
+def backup_database(backup_path, ao_progredir=None, comprimir=None):
+    """
+    Faz uma cópia consistente do banco de dados no local especificado, sem bloquear as escritas.
+    Com 'comprimir' (padrão: quando o nome termina em '.gz') o arquivo é gravado em gzip.
+    O backup é gravado com outro nome e só então renomeado, então um arquivo pela metade
+    nunca fica com o nome final. 'ao_progredir(feito, total, texto)' recebe o andamento.
+    Retorna um dicionário com 'caminho', 'bytes' e 'segundos'.
     """
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        query = """
-            SELECT s.id, s.data_sessao, s.valor_sessao, p.nome_completo as paciente_nome
-            FROM sessoes s
-            JOIN pacientes p ON s.paciente_id = p.id
-            WHERE s.status_pagamento = 'Pendente'
-        """
-        params = []
-        if termo_busca:
-            query += " AND lower(p.nome_completo) LIKE ?"
-            params.append(f"%{termo_busca.lower()}%")
-        query += " ORDER BY p.nome_completo, s.data_sessao"
-        cursor.execute(query, params)
-        return [dict(row) for row in cursor.fetchall()]
-
-def backup_database(backup_path):
-    """Copia o arquivo do banco de dados atual para o local de backup especificado."""
     if not os.path.exists(DB_FILE):
         raise FileNotFoundError("Arquivo do banco de dados (clinica.db) não encontrado.")
-    shutil.copyfile(DB_FILE, backup_path)
+    if comprimir is None:
+        comprimir = backup_path.lower().endswith('.gz')
+    inicio = time.perf_counter()
+    pasta = os.path.dirname(os.path.abspath(backup_path))
+    fd, temporario = tempfile.mkstemp(suffix='.tmp', prefix=BACKUP_PREFIXO, dir=pasta)
+    os.close(fd)
+    try:
+        if comprimir:
+            fd, copia = tempfile.mkstemp(suffix='.db', prefix=BACKUP_PREFIXO, dir=pasta)
+            os.close(fd)
+            try:
+                _copiar_banco(copia, ao_progredir)
+                if ao_progredir:
+                    ao_progredir(0, 0, "Comprimindo o backup...")
+                with open(copia, 'rb') as entrada, gzip.open(temporario, 'wb', compresslevel=6) as saida:
+                    shutil.copyfileobj(entrada, saida, 1024 * 1024)
+            finally:
+                os.remove(copia)
+        else:
+            _copiar_banco(temporario, ao_progredir)
+        os.replace(temporario, backup_path)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+    segundos = time.perf_counter() - inicio
+    tamanho = os.path.getsize(backup_path)
+    print(f"Backup salvo em {backup_path} ({tamanho / 1024:.0f} KB) em {segundos:.2f} s.")
+    return {'caminho': backup_path, 'bytes': tamanho, 'segundos': segundos}
+
+def pasta_backups_automaticos():
+    """Pasta dos backups automáticos: 'backups', ao lado do arquivo do banco."""
+    return os.path.join(os.path.dirname(os.path.abspath(DB_FILE)), 'backups')
+
+def listar_backups_automaticos(pasta=None):
+    """Retorna os caminhos dos backups automáticos, do mais antigo para o mais recente."""
+    pasta = pasta or pasta_backups_automaticos()
+    if not os.path.isdir(pasta):
+        return []
+    # O nome leva data e hora em ordem ano-mês-dia, então a ordem alfabética é a cronológica
+    nomes = sorted(n for n in os.listdir(pasta) if n.startswith(BACKUP_PREFIXO) and n.endswith(('.db', '.db.gz')))
+    return [os.path.join(pasta, n) for n in nomes]
+
+def backup_automatico_pendente(pasta=None, intervalo_horas=BACKUP_INTERVALO_HORAS):
+    """Indica se o último backup automático tem mais de 'intervalo_horas' horas (ou se ainda não há nenhum)."""
+    if BACKUP_AUTOMATICO_INCREMENTAL:
+        backups = [os.path.join(c, MANIFESTO_BACKUP) for c in listar_cadeias_backup(pasta)]
+    else:
+        backups = listar_backups_automaticos(pasta)
+    if not backups:
+        return True
+    return time.time() - os.path.getmtime(backups[-1]) >= intervalo_horas * 3600
+
+def realizar_backup_automatico(pasta=None, geracoes=BACKUP_GERACOES, ao_progredir=None):
+    """
+    Grava um backup comprimido com data e hora na pasta de backups automáticos e apaga os mais
+    antigos, mantendo apenas as últimas 'geracoes' cópias. Retorna o resultado de backup_database.
+    Com BACKUP_AUTOMATICO_INCREMENTAL, grava um backup incremental (veja backup_incremental).
+    """
+    if BACKUP_AUTOMATICO_INCREMENTAL:
+        return backup_incremental(pasta, ao_progredir)
+    pasta = pasta or pasta_backups_automaticos()
+    os.makedirs(pasta, exist_ok=True)
+    nome = f"{BACKUP_PREFIXO}{time.strftime('%Y-%m-%d_%H-%M-%S')}.db.gz"
+    resultado = backup_database(os.path.join(pasta, nome), ao_progredir, comprimir=True)
+    for antigo in listar_backups_automaticos(pasta)[:-geracoes]:
+        os.remove(antigo)
+        print(f"Backup antigo removido: {antigo}")
+    return resultado
+
+# --- Backup Incremental ---
+# Cada cadeia é uma pasta com um backup completo seguido de incrementos que guardam só as páginas
+# do banco alteradas desde o backup anterior. O manifesto da cadeia registra os arquivos e as métricas;
+# o arquivo de estado guarda o hash de cada página do último backup, para comparar com o próximo.
+
+BACKUP_INCREMENTOS_POR_CADEIA = 30 # Depois disso uma nova cadeia começa com um backup completo
+BACKUP_CADEIAS = 2 # Cadeias mantidas na pasta de backups incrementais
+MANIFESTO_BACKUP = 'manifesto.json'
+ESTADO_BACKUP = 'estado.hashes'
+_TAMANHO_HASH_PAGINA = 16
+_CABECALHO_PAGINA = struct.Struct('>I') # Número da página (a partir de 1) antes do conteúdo
+
+def pasta_backups_incrementais():
+    """Pasta das cadeias de backup incremental, dentro da pasta de backups automáticos."""
+    return os.path.join(pasta_backups_automaticos(), 'incrementais')
+
+def _hashes_das_paginas(caminho, tamanho_pagina):
+    """Lê o arquivo página a página e retorna a lista de hashes (um por página)."""
+    hashes = []
+    with open(caminho, 'rb') as arquivo:
+        while True:
+            pagina = arquivo.read(tamanho_pagina)
+            if not pagina:
+                return hashes
+            hashes.append(hashlib.blake2b(pagina, digest_size=_TAMANHO_HASH_PAGINA).digest())
+
+def _ler_manifesto(pasta_cadeia):
+    with open(os.path.join(pasta_cadeia, MANIFESTO_BACKUP), encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+def _gravar_arquivo_atomico(caminho, conteudo):
+    temporario = caminho + '.tmp'
+    with open(temporario, 'wb') as arquivo:
+        arquivo.write(conteudo)
+    os.replace(temporario, caminho)
+
+def listar_cadeias_backup(pasta=None):
+    """Retorna as pastas das cadeias de backup incremental, da mais antiga para a mais recente."""
+    pasta = pasta or pasta_backups_incrementais()
+    if not os.path.isdir(pasta):
+        return []
+    return [os.path.join(pasta, n) for n in sorted(os.listdir(pasta))
+            if os.path.isfile(os.path.join(pasta, n, MANIFESTO_BACKUP))]
+
+def backup_incremental(pasta=None, ao_progredir=None):
+    """
+    Grava um backup incremental: tira uma cópia consistente do banco (API de backup), calcula o hash
+    de cada página e grava, comprimidas, só as páginas diferentes das do último backup da cadeia.
+    Sem cadeia anterior (ou com a cadeia cheia) grava um backup completo e começa uma nova.
+    Retorna as métricas do backup: 'arquivo', 'tipo', 'paginas_total', 'paginas_alteradas', 'bytes' e 'segundos'.
+    """
+    pasta = pasta or pasta_backups_incrementais()
+    os.makedirs(pasta, exist_ok=True)
+    inicio = time.perf_counter()
+    fd, copia = tempfile.mkstemp(suffix='.db', prefix=BACKUP_PREFIXO, dir=pasta)
+    os.close(fd)
+    try:
+        _copiar_banco(copia, ao_progredir)
+        with sqlite3.connect(copia) as conn:
+            tamanho_pagina = conn.execute("PRAGMA page_size").fetchone()[0]
+        hashes = _hashes_das_paginas(copia, tamanho_pagina)
+
+        cadeias = listar_cadeias_backup(pasta)
+        pasta_cadeia = cadeias[-1] if cadeias else None
+        manifesto = _ler_manifesto(pasta_cadeia) if pasta_cadeia else None
+        if (manifesto is None or manifesto['tamanho_pagina'] != tamanho_pagina
+                or len(manifesto['backups']) > BACKUP_INCREMENTOS_POR_CADEIA):
+            # Nova cadeia, começando por um backup completo
+            pasta_cadeia = os.path.join(pasta, time.strftime('%Y-%m-%d_%H-%M-%S'))
+            os.makedirs(pasta_cadeia)
+            manifesto = {'tamanho_pagina': tamanho_pagina, 'backups': []}
+            nome, tipo, alteradas = '0000_completo.db.gz', 'completo', list(range(len(hashes)))
+            if ao_progredir:
+                ao_progredir(0, 0, "Comprimindo o backup completo...")
+            with open(copia, 'rb') as entrada, gzip.open(os.path.join(pasta_cadeia, nome), 'wb', compresslevel=6) as saida:
+                shutil.copyfileobj(entrada, saida, 1024 * 1024)
+        else:
+            with open(os.path.join(pasta_cadeia, ESTADO_BACKUP), 'rb') as arquivo:
+                estado = arquivo.read()
+            anteriores = [estado[i:i + _TAMANHO_HASH_PAGINA] for i in range(0, len(estado), _TAMANHO_HASH_PAGINA)]
+            alteradas = [i for i, h in enumerate(hashes) if i >= len(anteriores) or anteriores[i] != h]
+            nome, tipo = f"{len(manifesto['backups']):04d}_incremento.paginas.gz", 'incremento'
+            if ao_progredir:
+                ao_progredir(0, 0, f"Gravando {len(alteradas)} páginas alteradas...")
+            with open(copia, 'rb') as entrada, gzip.open(os.path.join(pasta_cadeia, nome), 'wb', compresslevel=6) as saida:
+                for indice in alteradas:
+                    entrada.seek(indice * tamanho_pagina)
+                    saida.write(_CABECALHO_PAGINA.pack(indice + 1))
+                    saida.write(entrada.read(tamanho_pagina))
+
+        metricas = {
+            'arquivo': nome, 'tipo': tipo, 'data': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'paginas_total': len(hashes), 'paginas_alteradas': len(alteradas),
+            'bytes': os.path.getsize(os.path.join(pasta_cadeia, nome)),
+            'segundos': time.perf_counter() - inicio,
+        }
+        manifesto['backups'].append(metricas)
+        # O manifesto é gravado antes do estado: se o processo parar entre os dois, o próximo incremento
+        # compara com o estado anterior e apenas guarda páginas a mais, sem deixar a cadeia incompleta.
+        _gravar_arquivo_atomico(os.path.join(pasta_cadeia, MANIFESTO_BACKUP),
+                                json.dumps(manifesto, indent=1, ensure_ascii=False).encode('utf-8'))
+        _gravar_arquivo_atomico(os.path.join(pasta_cadeia, ESTADO_BACKUP), b''.join(hashes))
+    finally:
+        os.remove(copia)
+
+    for antiga in listar_cadeias_backup(pasta)[:-BACKUP_CADEIAS]:
+        shutil.rmtree(antiga)
+        print(f"Cadeia de backup antiga removida: {antiga}")
+    print(f"Backup {metricas['tipo']} em {pasta_cadeia}: {metricas['paginas_alteradas']} de {metricas['paginas_total']} páginas, "
+          f"{metricas['bytes'] / 1024:.0f} KB em {metricas['segundos']:.2f} s.")
+    return metricas
+
+def reconstruir_backup_incremental(pasta_cadeia, destino, ate=None, ao_progredir=None):
+    """
+    Reconstrói em 'destino' o banco de um ponto da cadeia: descomprime o backup completo e aplica,
+    em ordem, as páginas de cada incremento até o de índice 'ate' (padrão: o último).
+    Retorna o número de backups aplicados.
+    """
+    manifesto = _ler_manifesto(pasta_cadeia)
+    backups = manifesto['backups'][:None if ate is None else ate + 1]
+    tamanho_pagina = manifesto['tamanho_pagina']
+    with gzip.open(os.path.join(pasta_cadeia, backups[0]['arquivo']), 'rb') as entrada, open(destino, 'wb') as saida:
+        shutil.copyfileobj(entrada, saida, 1024 * 1024)
+    with open(destino, 'r+b') as saida:
+        for numero, backup in enumerate(backups[1:], start=1):
+            if ao_progredir:
+                ao_progredir(numero, len(backups) - 1, f"Aplicando incremento {numero} de {len(backups) - 1}...")
+            with gzip.open(os.path.join(pasta_cadeia, backup['arquivo']), 'rb') as entrada:
+                while True:
+                    cabecalho = entrada.read(_CABECALHO_PAGINA.size)
+                    if not cabecalho:
+                        break
+                    (pagina,) = _CABECALHO_PAGINA.unpack(cabecalho)
+                    saida.seek((pagina - 1) * tamanho_pagina)
+                    saida.write(entrada.read(tamanho_pagina))
+        # O banco pode ter diminuído (VACUUM) desde o backup completo
+        saida.truncate(backups[-1]['paginas_total'] * tamanho_pagina)
+    return len(backups)
+
+# --- Restauração ---
+
+RESTAURACAO_ESPERA_CONEXOES = 10.0 # Segundos para as operações em andamento terminarem antes da troca do arquivo
+RESTAURACAO_VERIFICACAO = 'integrity_check' # ou 'quick_check', mais rápido em bancos grandes
+
+def _abrir_somente_leitura(caminho):
+    """
+    Abre um arquivo de backup sem escrever nada em disco: os backups ficam marcados como WAL e,
+    sem 'immutable', o SQLite criaria arquivos -wal e -shm ao lado deles. Um backup é um arquivo
+    completo, então não há WAL a ser lido.
+    """
+    return sqlite3.connect(f"file:{urllib.request.pathname2url(os.path.abspath(caminho))}?mode=ro&immutable=1", uri=True)
 
-def restore_database(backup_path):
-    """Restaura o banco de dados a partir de um arquivo de backup."""
+def _preparar_banco_restaurado(fonte, destino, ao_progredir=None):
+    """
+    Copia 'fonte' para 'destino' com a API de backup, verifica a integridade da cópia e aplica as
+    migrações pendentes. Lança um erro, sem tocar no banco atual, se o arquivo não servir.
+    Retorna a versão do esquema do backup.
+    """
+    origem = _abrir_somente_leitura(fonte)
+    copia = sqlite3.connect(destino)
+    try:
+        def progresso(status, restantes, total):
+            if ao_progredir:
+                ao_progredir(total - restantes, total, f"Lendo o backup: {total - restantes} de {total} páginas")
+        origem.backup(copia, pages=BACKUP_PAGINAS_POR_PASSO, progress=progresso)
+
+        if ao_progredir:
+            ao_progredir(0, 0, "Verificando a integridade do backup...")
+        problemas = [linha[0] for linha in copia.execute(f"PRAGMA {RESTAURACAO_VERIFICACAO}")]
+        if problemas != ['ok']:
+            raise sqlite3.DatabaseError("O backup está corrompido: " + "; ".join(problemas[:5]))
+        if copia.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pacientes'").fetchone() is None:
+            raise ValueError("O arquivo selecionado não é um backup do sistema da clínica.")
+        versao_backup = copia.execute("PRAGMA user_version").fetchone()[0]
+        if versao_backup > VERSAO_ESQUEMA:
+            raise ValueError("O backup foi criado por uma versão mais nova do sistema.")
+
+        if ao_progredir:
+            ao_progredir(0, 0, "Atualizando a estrutura do banco...")
+        copia.execute("PRAGMA foreign_keys = ON")
+        with copia:
+            _aplicar_migracoes(copia.cursor())
+        return versao_backup
+    finally:
+        origem.close()
+        copia.close()
+
+def restore_database(backup_path, ao_progredir=None):
+    """
+    Restaura o banco de dados a partir de um backup (.db, .db.gz ou o manifesto de uma cadeia incremental).
+    O backup é copiado para um arquivo temporário, verificado e migrado; só então as conexões são
+    fechadas e o arquivo é trocado de uma vez (os.replace). Em qualquer erro o banco atual fica intacto.
+    Antes da troca, o banco atual é copiado para a pasta de backups.
+    Retorna 'segundos' (total), 'segundos_indisponivel' (tempo com o banco fechado), 'versao_backup'
+    e 'copia_anterior'.
+    """
     if not os.path.exists(backup_path):
         raise FileNotFoundError("Arquivo de backup não encontrado.")
-    shutil.copyfile(backup_path, DB_FILE)
\ No newline at end of file
+    inicio = time.perf_counter()
+    pasta = os.path.dirname(os.path.abspath(DB_FILE))
+    temporarios = []
+
+    def temporario(sufixo):
+        fd, caminho = tempfile.mkstemp(suffix=sufixo, prefix='restauracao_', dir=pasta)
+        os.close(fd)
+        temporarios.append(caminho)
+        return caminho
+
+    try:
+        fonte = backup_path
+        if os.path.basename(backup_path) == MANIFESTO_BACKUP:
+            # Backup incremental: o banco é reconstruído a partir da cadeia até o último incremento
+            fonte = temporario('.db')
+            reconstruir_backup_incremental(os.path.dirname(backup_path), fonte, ao_progredir=ao_progredir)
+        elif backup_path.lower().endswith('.gz'):
+            if ao_progredir:
+                ao_progredir(0, 0, "Descomprimindo o backup...")
+            fonte = temporario('.db')
+            with gzip.open(backup_path, 'rb') as entrada, open(fonte, 'wb') as saida:
+                shutil.copyfileobj(entrada, saida, 1024 * 1024)
+
+        novo = temporario('.db')
+        versao_backup = _preparar_banco_restaurado(fonte, novo, ao_progredir)
+
+        copia_anterior = None
+        if os.path.exists(DB_FILE):
+            if ao_progredir:
+                ao_progredir(0, 0, "Guardando uma cópia do banco atual...")
+            os.makedirs(pasta_backups_automaticos(), exist_ok=True)
+            copia_anterior = os.path.join(pasta_backups_automaticos(), f"antes_da_restauracao_{time.strftime('%Y-%m-%d_%H-%M-%S')}.db")
+            _copiar_banco(copia_anterior)
+
+        if ao_progredir:
+            ao_progredir(0, 0, "Substituindo o banco de dados...")
+        inicio_troca = time.perf_counter()
+        with _banco_fechado(RESTAURACAO_ESPERA_CONEXOES):
+            if os.path.exists(DB_FILE + '-wal') and os.path.getsize(DB_FILE + '-wal') > 0:
+                # Com todas as conexões daqui fechadas, o -wal só continua com dados se outra estação estiver usando o banco
+                raise sqlite3.OperationalError("O banco está aberto em outra estação. Feche o sistema nas outras estações e tente novamente.")
+            for sufixo in ('-wal', '-shm'):
+                if os.path.exists(DB_FILE + sufixo):
+                    os.remove(DB_FILE + sufixo)
+            os.replace(novo, DB_FILE)
+        segundos_indisponivel = time.perf_counter() - inicio_troca
+    finally:
+        for caminho in temporarios:
+            for sufixo in ('', '-wal', '-shm'):
+                if os.path.exists(caminho + sufixo):
+                    os.remove(caminho + sufixo)
+
+    limpar_cache_datas_sessoes()
+    segundos = time.perf_counter() - inicio
+    print(f"Banco restaurado de {backup_path} em {segundos:.2f} s (indisponível por {segundos_indisponivel * 1000:.0f} ms).")
+    return {
+        'segundos': segundos, 'segundos_indisponivel': segundos_indisponivel,
+        'versao_backup': versao_backup, 'copia_anterior': copia_anterior,
+    }
+
+# --- Medição de Memória ---
+
+def _pico_memoria_kb():
+    """Pico de memória residente (RSS) do processo em KB, ou None onde o módulo 'resource' não existe (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico // 1024 if sys.platform == 'darwin' else pico # macOS informa em bytes; Linux, em KB
+
+def _carregar_sessoes_para_medicao(caminho_banco, forma, data_inicio_db, data_fim_db):
+    """Roda em um processo novo: lê as sessões do período na 'forma' pedida e retorna o quanto a memória cresceu."""
+    global DB_FILE
+    DB_FILE = caminho_banco
+    rastrear = _pico_memoria_kb() is None
+    if rastrear:
+        tracemalloc.start()
+    antes = _pico_memoria_kb()
+    inicio = time.perf_counter()
+    if forma == 'dict':
+        # Como as listagens faziam antes: um dicionário por linha
+        resultado = [dict(linha) for linha in iter_sessoes_financeiro_por_periodo(data_inicio_db, data_fim_db)]
+        linhas = len(resultado)
+    elif forma == 'tupla':
+        resultado = listar_sessoes_financeiro_por_periodo(data_inicio_db, data_fim_db)
+        linhas = len(resultado)
+    else:
+        linhas = sum(1 for _ in iter_sessoes_financeiro_por_periodo(data_inicio_db, data_fim_db))
+    segundos = time.perf_counter() - inicio
+    if rastrear:
+        crescimento = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    else:
+        crescimento = _pico_memoria_kb() - antes
+    fechar_conexoes()
+    return {'linhas': linhas, 'segundos': segundos, 'pico_kb': crescimento, 'medida': 'tracemalloc' if rastrear else 'rss'}
+
+def medir_memoria_linhas(data_inicio_db, data_fim_db):
+    """
+    Compara a memória usada para ler as sessões do período na tela de fluxo de caixa em três formas:
+    'dict' (um dicionário por linha, como antes), 'tupla' (listar_sessoes_financeiro_por_periodo)
+    e 'iter' (iter_sessoes_financeiro_por_periodo, sem guardar as linhas). Cada forma roda em um
+    processo novo e é medida pelo crescimento do pico de RSS (no Windows, pelo tracemalloc).
+    Retorna {forma: {'linhas', 'segundos', 'pico_kb', 'medida'}}.
+    """
+    caminho = os.path.abspath(DB_FILE)
+    resultados = {}
+    for forma in ('dict', 'tupla', 'iter'):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            resultados[forma] = pool.submit(_carregar_sessoes_para_medicao, caminho, forma, data_inicio_db, data_fim_db).result()
+        r = resultados[forma]
+        print(f"Memória ({forma}): {r['linhas']} linhas, +{r['pico_kb']} KB ({r['medida']}) em {r['segundos']:.2f} s.")
+    return resultados
@@ -0,0 +1,165 @@
+import functools
+import io
+import multiprocessing
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
+from xml.sax.saxutils import escape
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import inch
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+# Geração dos relatórios em PDF. Não depende do Tk, então pode rodar em threads ou processos de fundo.
+
+MARGEM = inch
+TEXTO_VAZIO = 'Não informado.'
+MINIMO_RELATORIOS_POR_PROCESSO = 20 # Abaixo disso, iniciar processos custa mais do que gerar os PDFs aqui
+
+@functools.lru_cache(maxsize=None)
+def estilos_relatorio():
+    """
+    Estilos usados nos relatórios, montados uma única vez por processo
+    (getSampleStyleSheet recria a folha de estilos inteira a cada chamada).
+    """
+    styles = getSampleStyleSheet()
+    return {'titulo': styles['h1'], 'secao': styles['h2'], 'corpo': styles['BodyText']}
+
+def _data_para_exibicao(data_db):
+    try:
+        return datetime.strptime(data_db, '%Y-%m-%d').strftime('%d/%m/%Y')
+    except (TypeError, ValueError):
+        return data_db or 'N/A'
+
+def _paragrafos(texto, estilo):
+    """
+    Converte o texto digitado em parágrafos do ReportLab, escapando '<' e '&' (que seriam lidos como marcação).
+    Linhas em branco separam parágrafos; cada um pode continuar na página seguinte.
+    """
+    texto = (texto or '').strip() or TEXTO_VAZIO
+    return [Paragraph(escape(bloco.strip()).replace('\n', '<br/>'), estilo) for bloco in texto.split('\n\n') if bloco.strip()]
+
+def montar_relatorio_sessao(sessao):
+    """Retorna os elementos (flowables) do relatório de uma sessão, na ordem em que são desenhados."""
+    estilos = estilos_relatorio()
+    elementos = [
+        Paragraph("Relatório de Sessão Terapêutica", estilos['titulo']),
+        Spacer(1, 10),
+        Paragraph(
+            f"<b>Paciente:</b> {escape(sessao.get('paciente_nome') or 'N/A')}<br/>"
+            f"<b>Data:</b> {_data_para_exibicao(sessao.get('data_sessao'))}<br/>"
+            f"<b>Terapeuta:</b> {escape(sessao.get('medico_nome') or 'N/A')}",
+            estilos['corpo']
+        ),
+        Spacer(1, 20),
+    ]
+    for titulo, campo in (("Resumo da Sessão:", 'resumo_sessao'),
+                          ("Observações sobre a Evolução:", 'observacoes_evolucao'),
+                          ("Plano Terapêutico:", 'plano_terapeutico')):
+        elementos.append(Paragraph(f"<b>{titulo}</b>", estilos['secao']))
+        elementos.extend(_paragrafos(sessao.get(campo), estilos['corpo']))
+        elementos.append(Spacer(1, 20))
+    return elementos
+
+def _desenhar_rodape(canvas_obj, doc):
+    """Rodapé de todas as páginas: paciente à esquerda e número da página à direita."""
+    largura, _ = doc.pagesize
+    canvas_obj.saveState()
+    canvas_obj.setFont('Helvetica', 8)
+    canvas_obj.drawString(MARGEM, MARGEM / 2, doc.title)
+    canvas_obj.drawRightString(largura - MARGEM, MARGEM / 2, f"Página {doc.page}")
+    canvas_obj.restoreState()
+
+def gerar_relatorio_sessao_pdf(destino, sessao, ao_progredir=None):
+    """
+    Gera o PDF do relatório de uma sessão em 'destino' (caminho ou arquivo aberto em modo binário)
+    e retorna o número de páginas. Textos longos continuam nas páginas seguintes.
+    'ao_progredir(feito, total, texto)' recebe o andamento, na thread que gera o relatório.
+    """
+    doc = SimpleDocTemplate(
+        destino, pagesize=letter,
+        leftMargin=MARGEM, rightMargin=MARGEM, topMargin=MARGEM, bottomMargin=MARGEM,
+        title=f"Sessão de {_data_para_exibicao(sessao.get('data_sessao'))} - {sessao.get('paciente_nome') or 'Paciente'}"
+    )
+    if ao_progredir:
+        andamento = {'total': 0, 'pagina': 0}
+
+        def progresso(tipo, valor):
+            if tipo == 'SIZE_EST':
+                andamento['total'] = valor
+            elif tipo == 'PAGE':
+                andamento['pagina'] = valor
+            elif tipo == 'PROGRESS':
+                ao_progredir(valor, andamento['total'], f"Gerando página {max(andamento['pagina'], 1)}...")
+
+        doc.setProgressCallBack(progresso)
+    doc.build(montar_relatorio_sessao(sessao), onFirstPage=_desenhar_rodape, onLaterPages=_desenhar_rodape)
+    return doc.page
+
+# --- Exportação em Lote ---
+
+def _nome_seguro(texto):
+    return "".join(c for c in texto if c.isalnum() or c in " ._-").strip() or 'Paciente'
+
+def nome_arquivo_relatorio(sessao):
+    """Caminho do relatório dentro do ZIP: uma pasta por paciente e um PDF por sessão, em ordem de data."""
+    partes = [sessao.get('data_sessao'), (sessao.get('hora_inicio_sessao') or '').replace(':', ''), f"sessao_{sessao['id']}"]
+    return f"{_nome_seguro(sessao.get('paciente_nome') or '')}/{'_'.join(p for p in partes if p)}.pdf"
+
+def _renderizar_relatorio(sessao):
+    """Gera o PDF de uma sessão em memória e retorna (nome no ZIP, conteúdo). Roda nos processos de fundo."""
+    buffer = io.BytesIO()
+    gerar_relatorio_sessao_pdf(buffer, sessao)
+    return nome_arquivo_relatorio(sessao), buffer.getvalue()
+
+def exportar_relatorios_zip(destino, sessoes, processos=None, ao_progredir=None, cancelado=None):
+    """
+    Gera o relatório de cada sessão e grava todos em um único ZIP em 'destino'.
+    Os PDFs são gerados em paralelo em 'processos' processos (padrão: um por núcleo) e gravados
+    na ordem da lista; lotes pequenos são gerados no próprio processo. 'cancelado' (threading.Event)
+    interrompe a exportação. Se ela não chegar ao fim (cancelada ou com erro), o ZIP incompleto é apagado.
+    Retorna um dicionário com 'relatorios', 'segundos', 'por_segundo' e 'cancelado'.
+    """
+    inicio = time.perf_counter()
+    total = len(sessoes)
+    processos = min(processos or os.cpu_count() or 1, max(1, total // MINIMO_RELATORIOS_POR_PROCESSO))
+    feitos = 0
+    interrompido = False
+    concluido = False
+    try:
+        with ExitStack() as pilha:
+            if processos > 1:
+                # 'spawn' em todos os sistemas: um fork do processo da interface copiaria o Tk e as threads de fundo
+                pool = pilha.enter_context(ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context('spawn')))
+                # Blocos de sessões por tarefa reduzem a troca de mensagens entre os processos
+                resultados = pool.map(_renderizar_relatorio, sessoes, chunksize=max(1, min(50, total // (processos * 4))))
+            else:
+                pool = None
+                resultados = map(_renderizar_relatorio, sessoes)
+            arquivo_zip = pilha.enter_context(zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED))
+            for nome, conteudo in resultados:
+                if cancelado is not None and cancelado.is_set():
+                    interrompido = True
+                    if pool is not None:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                    break
+                arquivo_zip.writestr(nome, conteudo)
+                feitos += 1
+                if ao_progredir:
+                    ao_progredir(feitos, total, f"{feitos} de {total} relatórios gerados...")
+        concluido = not interrompido
+    finally:
+        if not concluido:
+            # Um ZIP truncado no destino pareceria uma exportação válida
+            try:
+                os.remove(destino)
+            except OSError:
+                pass
+    segundos = time.perf_counter() - inicio
+    return {
+        'relatorios': feitos, 'segundos': segundos,
+        'por_segundo': feitos / segundos if segundos else 0.0, 'cancelado': interrompido,
+    }
@@ -0,0 +1,59 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+class TestConflitosSessao(unittest.TestCase):
+    """A verificação de conflito precisa enxergar sessões gravadas por outra estação."""
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.db_original = database.DB_FILE
+        database.DB_FILE = os.path.join(self.pasta, "clinica.db")
+        database.inicializar_banco_de_dados()
+        database.adicionar_medico("Terapeuta", "Fono", "")
+        database.adicionar_paciente("Paciente", "2015-01-01", "Responsável", "", None, 100.0)
+        self.medico_id = database.listar_medicos()[0]['id']
+        self.paciente_id = database.listar_pacientes()[0]['id']
+
+    def tearDown(self):
+        database.fechar_conexoes()
+        database.DB_FILE = self.db_original
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _gravar_em_outra_estacao(self, hora_inicio, hora_fim):
+        conn = sqlite3.connect(database.DB_FILE)
+        with conn:
+            conn.execute(
+                "INSERT INTO sessoes (paciente_id, medico_id, data_sessao, hora_inicio_sessao, hora_fim_sessao) VALUES (?, ?, ?, ?, ?)",
+                (self.paciente_id, self.medico_id, "2025-03-10", hora_inicio, hora_fim)
+            )
+        conn.close()
+
+    def test_sessao_de_outra_estacao_conflita(self):
+        database.verificar_conflito_sessao(self.medico_id, "2025-03-10", "09:00", "10:00") # Antes da gravação da outra estação
+        self._gravar_em_outra_estacao("09:00", "10:00")
+        self.assertTrue(database.verificar_conflito_sessao(self.medico_id, "2025-03-10", "9:30", "10:30"))
+        self.assertFalse(database.verificar_conflito_sessao(self.medico_id, "2025-03-10", "10:00", "11:00"))
+        with self.assertRaises(ValueError):
+            database.adicionar_sessao(self.paciente_id, self.medico_id, "2025-03-10", "09:30", "10:30", "", "", "", "")
+
+    def test_edicao_ignora_a_propria_sessao(self):
+        database.adicionar_sessao(self.paciente_id, self.medico_id, "2025-03-10", "09:00", "10:00", "", "", "", "")
+        sessao_id = database.listar_sessoes_por_paciente(self.paciente_id)[0]['id']
+        self.assertFalse(database.verificar_conflito_sessao(self.medico_id, "2025-03-10", "09:30", "10:30", sessao_id))
+        database.atualizar_sessao(sessao_id, self.medico_id, "2025-03-10", "09:30", "10:30", "", "", "", "")
+        self._gravar_em_outra_estacao("11:00", "12:00")
+        with self.assertRaises(ValueError):
+            database.atualizar_sessao(sessao_id, self.medico_id, "2025-03-10", "10:30", "11:30", "", "", "", "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+class TestHorariosLivres(unittest.TestCase):
+    """buscar_horarios_livres: disponibilidade avulsa e semanal menos as sessões, com os trechos exatos."""
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.db_original = database.DB_FILE
+        database.DB_FILE = os.path.join(self.pasta, "clinica.db")
+        database.inicializar_banco_de_dados()
+        database.adicionar_medico("Ana", "Fono", "")
+        database.adicionar_medico("Bruno", "Psico", "")
+        medicos = {m['nome_completo']: m['id'] for m in database.listar_medicos()}
+        self.ana, self.bruno = medicos["Ana"], medicos["Bruno"]
+        database.adicionar_paciente("Paciente", "2015-01-01", "Responsável", "", None, 100.0)
+        paciente_id = database.listar_pacientes()[0]['id']
+
+        # 2025-03-10 e 2025-03-17 são segundas-feiras
+        database.adicionar_modelo_disponibilidade(self.ana, 0, "08:00", "12:00", "2025-03-01")
+        database.adicionar_disponibilidade(self.ana, "2025-03-10", "11:00", "14:00") # Sobrepõe o horário semanal
+        database.adicionar_disponibilidade(self.bruno, "2025-03-11", "14:00", "15:00")
+        sessoes = [
+            (self.ana, "2025-03-10", "09:00", "10:00"),
+            (self.ana, "2025-03-10", "09:30", "10:30"), # Sobreposta à anterior
+            (self.ana, "2025-03-10", "10:30", "11:00"), # Encostada na anterior
+            (self.ana, "2025-03-10", "13:00", "14:00"), # Termina junto com a disponibilidade
+            (self.bruno, "2025-03-11", "14:00", "14:30"),
+        ]
+        # Gravadas direto no banco: a verificação de conflito impediria as sessões sobrepostas
+        with database._conexao() as conn:
+            conn.executemany(
+                "INSERT INTO sessoes (paciente_id, medico_id, data_sessao, hora_inicio_sessao, hora_fim_sessao) VALUES (?, ?, ?, ?, ?)",
+                [(paciente_id, *sessao) for sessao in sessoes]
+            )
+
+    def tearDown(self):
+        database.fechar_conexoes()
+        database.DB_FILE = self.db_original
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _trechos(self, *args, **kwargs):
+        return [(h['medico_nome'], h['data'], h['hora_inicio'], h['hora_fim']) for h in database.buscar_horarios_livres(*args, **kwargs)]
+
+    def test_disponibilidade_menos_sessoes(self):
+        self.assertEqual(self._trechos("2025-03-10", "2025-03-17", 30), [
+            ("Ana", "2025-03-10", "08:00", "09:00"),
+            ("Ana", "2025-03-10", "11:00", "13:00"),
+            ("Bruno", "2025-03-11", "14:30", "15:00"),
+            ("Ana", "2025-03-17", "08:00", "12:00"),
+        ])
+
+    def test_duracao_minima(self):
+        self.assertEqual(self._trechos("2025-03-10", "2025-03-17", 90), [
+            ("Ana", "2025-03-10", "11:00", "13:00"),
+            ("Ana", "2025-03-17", "08:00", "12:00"),
+        ])
+
+    def test_hora_minima_vale_so_no_primeiro_dia(self):
+        self.assertEqual(self._trechos("2025-03-10", "2025-03-17", 30, hora_minima="8:30"), [
+            ("Ana", "2025-03-10", "08:30", "09:00"),
+            ("Ana", "2025-03-10", "11:00", "13:00"),
+            ("Bruno", "2025-03-11", "14:30", "15:00"),
+            ("Ana", "2025-03-17", "08:00", "12:00"),
+        ])
+        self.assertEqual(self._trechos("2025-03-10", "2025-03-10", 45, hora_minima="08:30"), [
+            ("Ana", "2025-03-10", "11:00", "13:00"),
+        ])
+
+    def test_filtro_por_terapeuta_e_limite(self):
+        self.assertEqual(self._trechos("2025-03-10", "2025-03-17", 30, medico_ids=[self.bruno]), [
+            ("Bruno", "2025-03-11", "14:30", "15:00"),
+        ])
+        self.assertEqual(len(self._trechos("2025-03-10", "2025-03-17", 30, limite=2)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+def _popular_banco(pacientes=800, medicos=12, sessoes=20000, disponibilidades=20000):
+    """Insere um volume de dados parecido com o de uma clínica em uso, para o planejador ter o que escolher."""
+    aleatorio = random.Random(42)
+    inicio = date(2023, 1, 1)
+    with database._conexao() as conn:
+        conn.executemany(
+            "INSERT INTO medicos (nome_completo, especialidade) VALUES (?, ?)",
+            [(f"Terapeuta {i}", "Fono") for i in range(medicos)]
+        )
+        ids_medicos = [row[0] for row in conn.execute("SELECT id FROM medicos")]
+        ids_planos = [row[0] for row in conn.execute("SELECT id FROM planos_saude")]
+        conn.executemany(
+            "INSERT INTO pacientes (nome_completo, data_nascimento, nome_responsavel, telefone_responsavel, plano_saude_id, valor_sessao_padrao) VALUES (?, ?, ?, ?, ?, ?)",
+            [(f"Paciente {i} Silva", "2015-01-01", f"Responsavel {i}", f"81 9{i:08d}", aleatorio.choice(ids_planos), 100.0) for i in range(pacientes)]
+        )
+        ids_pacientes = [row[0] for row in conn.execute("SELECT id FROM pacientes")]
+        linhas = []
+        for i in range(sessoes):
+            hora = 8 + i % 10
+            linhas.append((
+                aleatorio.choice(ids_pacientes), aleatorio.choice(ids_medicos),
+                (inicio + timedelta(days=aleatorio.randrange(1000))).isoformat(),
+                f"{hora:02d}:00", f"{hora:02d}:50", 100.0, aleatorio.choice(["Pago", "Pago", "Pendente"]),
+            ))
+        conn.executemany(
+            "INSERT INTO sessoes (paciente_id, medico_id, data_sessao, hora_inicio_sessao, hora_fim_sessao, valor_sessao, status_pagamento) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            linhas
+        )
+        conn.executemany(
+            "INSERT INTO disponibilidade_medico (medico_id, data_disponivel, hora_inicio, hora_fim) VALUES (?, ?, ?, ?)",
+            [(aleatorio.choice(ids_medicos), (inicio + timedelta(days=aleatorio.randrange(1000))).isoformat(), "08:00", "12:00") for _ in range(disponibilidades)]
+        )
+        conn.executemany(
+            "INSERT INTO disponibilidade_semanal (medico_id, dia_semana, hora_inicio, hora_fim, valido_de) VALUES (?, ?, ?, ?, ?)",
+            [(medico_id, dia, "13:00", "18:00", inicio.isoformat()) for medico_id in ids_medicos for dia in range(5)]
+        )
+        conn.executemany(
+            "INSERT INTO despesas (descricao, valor, data) VALUES (?, ?, ?)",
+            [(f"Despesa {i}", 50.0, (inicio + timedelta(days=i % 1000)).isoformat()) for i in range(2000)]
+        )
+
+
+class TestPlanosDeConsulta(unittest.TestCase):
+    """As consultas mais frequentes não podem varrer tabelas inteiras (ver verificar_planos_de_consulta)."""
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.db_original = database.DB_FILE
+        database.DB_FILE = os.path.join(self.pasta, "clinica.db")
+
+    def tearDown(self):
+        database.fechar_conexoes()
+        database.DB_FILE = self.db_original
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def test_banco_populado_sem_estatisticas(self):
+        database.inicializar_banco_de_dados()
+        _popular_banco()
+        self.assertEqual(database.verificar_planos_de_consulta(), [])
+
+    def test_banco_populado_com_estatisticas_atualizadas(self):
+        database.inicializar_banco_de_dados()
+        _popular_banco()
+        database.verificar_planos_de_consulta() # As conexões precisam ter usado as tabelas para o PRAGMA optimize analisá-las
+        database.fechar_conexoes(otimizar=True)
+        with database._conexao() as conn:
+            self.assertTrue(conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0])
+        self.assertEqual(database.verificar_planos_de_consulta(), [])
+
+    def test_estatisticas_do_banco_pequeno_sao_refeitas_quando_ele_cresce(self):
+        database.inicializar_banco_de_dados()
+        _popular_banco(pacientes=2, medicos=1, sessoes=2, disponibilidades=2)
+        database.verificar_planos_de_consulta()
+        database.fechar_conexoes(otimizar=True) # Estatísticas tiradas com o banco ainda pequeno
+        _popular_banco()
+        database.verificar_planos_de_consulta()
+        database.otimizar_estatisticas()
+        database.fechar_conexoes()
+        self.assertEqual(database.verificar_planos_de_consulta(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
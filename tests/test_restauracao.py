@@ -0,0 +1,84 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+class TestRestauracao(unittest.TestCase):
+    """A troca do arquivo do banco precisa esperar as escritas em andamento, sem travá-las."""
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.db_original = database.DB_FILE
+        self.espera_original = database.RESTAURACAO_ESPERA_CONEXOES
+        database.DB_FILE = os.path.join(self.pasta, "clinica.db")
+        database.inicializar_banco_de_dados()
+        database.adicionar_despesa("Antes do backup", 10.0, "2025-01-01")
+        self.backup = os.path.join(self.pasta, "backup.db")
+        database.backup_database(self.backup)
+
+    def tearDown(self):
+        database.fechar_conexoes()
+        database.RESTAURACAO_ESPERA_CONEXOES = self.espera_original
+        database.DB_FILE = self.db_original
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def test_restauracao_espera_escrita_em_andamento(self):
+        database.RESTAURACAO_ESPERA_CONEXOES = 3.0
+        iniciou = threading.Event()
+        erros = []
+
+        @database._transacao_escrita
+        def escrita_demorada():
+            iniciou.set()
+            time.sleep(0.5)
+            # Chamada aninhada: passa de novo por _obter_pool enquanto a restauração aguarda
+            database.adicionar_despesa("Durante a restauração", 1.0, "2025-01-02")
+
+        def executar():
+            try:
+                escrita_demorada()
+            except Exception as e:
+                erros.append(e)
+
+        escritora = threading.Thread(target=executar)
+        escritora.start()
+        iniciou.wait()
+        inicio = time.perf_counter()
+        database.restore_database(self.backup)
+        segundos = time.perf_counter() - inicio
+        escritora.join()
+
+        self.assertEqual(erros, [])
+        self.assertLess(segundos, 2.0)
+        # O banco restaurado é o do backup, sem a escrita feita durante a troca
+        despesas = database.listar_despesas_por_periodo("2025-01-01", "2025-01-31")
+        self.assertEqual([d['descricao'] for d in despesas], ["Antes do backup"])
+
+    def test_operacao_nova_espera_o_fim_da_troca(self):
+        pronto = threading.Event()
+        resultado = []
+
+        def consultar():
+            pronto.set()
+            resultado.append(len(database.listar_despesas_por_periodo("2025-01-01", "2025-01-31")))
+
+        with database._banco_fechado(1.0):
+            leitora = threading.Thread(target=consultar)
+            leitora.start()
+            pronto.wait()
+            time.sleep(0.1)
+            self.assertEqual(resultado, []) # Ainda esperando a troca
+        leitora.join()
+        self.assertEqual(resultado, [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
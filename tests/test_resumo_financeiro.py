@@ -0,0 +1,135 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+PERIODO = ("2025-01-01", "2025-12-31")
+
+
+class TestResumoFinanceiro(unittest.TestCase):
+    """Os triggers precisam manter o resumo diário igual ao que uma reconstrução completa produziria."""
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.db_original = database.DB_FILE
+        self.dias_original = database.DIAS_MINIMOS_RESUMO_DIARIO
+        database.DB_FILE = os.path.join(self.pasta, "clinica.db")
+        database.inicializar_banco_de_dados()
+        self.aleatorio = random.Random(7)
+        for i in range(3):
+            database.adicionar_medico(f"Terapeuta {i}", "Fono", "")
+        self.medicos = [m['id'] for m in database.listar_medicos()]
+        self.planos = [p['id'] for p in database.listar_planos_saude()] + [None]
+
+    def tearDown(self):
+        database.fechar_conexoes()
+        database.DIAS_MINIMOS_RESUMO_DIARIO = self.dias_original
+        database.DB_FILE = self.db_original
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _data(self):
+        return (date(2025, 1, 1) + timedelta(days=self.aleatorio.randrange(365))).isoformat()
+
+    def _valor(self):
+        return self.aleatorio.choice([0, 50, 80.5, 120, 150.25])
+
+    def _ids(self, tabela):
+        with database._conexao() as conn:
+            return [row[0] for row in conn.execute(f"SELECT id FROM {tabela}")]
+
+    def _operacao_aleatoria(self):
+        a = self.aleatorio
+        pacientes, sessoes, despesas = self._ids("pacientes"), self._ids("sessoes"), self._ids("despesas")
+        operacao = a.choice([
+            'paciente', 'sessao', 'sessao', 'sessao', 'editar_sessao', 'financeiro', 'status_lote',
+            'excluir_sessao', 'despesa', 'editar_despesa', 'excluir_despesa', 'mudar_plano', 'excluir_paciente',
+        ])
+        if operacao == 'paciente' or not pacientes:
+            database.adicionar_paciente(f"Paciente {a.random()}", "2015-01-01", "Responsável", "", a.choice(self.planos), self._valor())
+        elif operacao == 'sessao':
+            hora = a.randrange(8, 18)
+            try:
+                database.adicionar_sessao(a.choice(pacientes), a.choice(self.medicos + [None]), self._data(),
+                                          f"{hora}:00", f"{hora}:45", "", "", "", "")
+            except ValueError:
+                pass # Conflito de horário: nada é gravado
+        elif operacao == 'editar_sessao' and sessoes:
+            hora = a.randrange(8, 18)
+            try:
+                database.atualizar_sessao(a.choice(sessoes), a.choice(self.medicos), self._data(),
+                                          f"{hora}:00", f"{hora}:45", "", "", "", "")
+            except ValueError:
+                pass
+        elif operacao == 'financeiro' and sessoes:
+            database.atualizar_financeiro_sessao(a.choice(sessoes), self._valor(), a.choice(['Pago', 'Pendente']))
+        elif operacao == 'status_lote' and sessoes:
+            database.atualizar_status_pagamento_sessoes(a.sample(sessoes, min(len(sessoes), 5)), a.choice(['Pago', 'Pendente']))
+        elif operacao == 'excluir_sessao' and sessoes:
+            database.excluir_sessao(a.choice(sessoes))
+        elif operacao == 'despesa':
+            database.adicionar_despesa("Despesa", self._valor(), self._data())
+        elif operacao == 'editar_despesa' and despesas:
+            with database._conexao() as conn:
+                conn.execute("UPDATE despesas SET valor = ?, data = ? WHERE id = ?", (self._valor(), self._data(), a.choice(despesas)))
+        elif operacao == 'excluir_despesa' and despesas:
+            with database._conexao() as conn:
+                conn.execute("DELETE FROM despesas WHERE id = ?", (a.choice(despesas),))
+        elif operacao == 'mudar_plano':
+            paciente = database.buscar_paciente_por_id(a.choice(pacientes))
+            database.atualizar_paciente(paciente['id'], paciente['nome_completo'], paciente['data_nascimento'],
+                                        paciente['nome_responsavel'], paciente['telefone_responsavel'],
+                                        a.choice(self.planos), paciente['valor_sessao_padrao'])
+        elif operacao == 'excluir_paciente' and len(pacientes) > 3:
+            database.excluir_paciente(a.choice(pacientes))
+
+    def _resumo(self):
+        """Linhas do resumo sem as zeradas (os triggers deixam a linha com zeros quando tudo sai dela)."""
+        with database._conexao() as conn:
+            return sorted(
+                (data, medico_id, plano_id, round(recebido, 2), round(a_receber, 2), round(despesas, 2), quantidade)
+                for data, medico_id, plano_id, recebido, a_receber, despesas, quantidade in conn.execute(
+                    "SELECT data, medico_id, plano_saude_id, total_recebido, total_a_receber, total_despesas, quantidade_sessoes "
+                    "FROM resumo_financeiro_diario"
+                )
+                if (round(recebido, 2), round(a_receber, 2), round(despesas, 2), quantidade) != (0, 0, 0, 0)
+            )
+
+    def _totais(self, dias_minimos):
+        """Resultado das consultas financeiras lendo do resumo (dias_minimos=0) ou das tabelas (dias_minimos enorme)."""
+        database.DIAS_MINIMOS_RESUMO_DIARIO = dias_minimos
+
+        def arredondar(linhas):
+            return [tuple(round(v, 2) if isinstance(v, float) else v for v in linha) for linha in linhas]
+
+        totais = database.calcular_totais_financeiros_por_periodo(*PERIODO)
+        return (
+            {chave: round(valor, 2) for chave, valor in totais.items()},
+            arredondar(database.calcular_totais_por_data(*PERIODO, agrupar_por='dia')),
+            arredondar(database.calcular_totais_por_data(*PERIODO, agrupar_por='mes')),
+            sorted(arredondar(database.calcular_totais_por_terapeuta(*PERIODO)), key=lambda t: (t[0] is None, t[0] or 0)),
+            sorted(arredondar(database.listar_receitas_agrupadas_por_plano(*PERIODO))),
+        )
+
+    def test_resumo_igual_a_reconstrucao_apos_edicoes_aleatorias(self):
+        for _ in range(600):
+            self._operacao_aleatoria()
+        mantido = self._resumo()
+        self.assertTrue(mantido)
+        database.reconstruir_resumo_financeiro()
+        self.assertEqual(mantido, self._resumo())
+
+    def test_totais_do_resumo_iguais_aos_das_tabelas(self):
+        for _ in range(400):
+            self._operacao_aleatoria()
+        self.assertEqual(self._totais(0), self._totais(10 ** 6))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import gc
+import os
+import pickle
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+class TestTiposLinha(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.db_original = database.DB_FILE
+        database.DB_FILE = os.path.join(self.pasta, "clinica.db")
+        database.inicializar_banco_de_dados()
+        for i in range(1200):
+            database.adicionar_despesa(f"Despesa {i}", 10.0, "2025-01-01")
+
+    def tearDown(self):
+        database.fechar_conexoes()
+        database.DB_FILE = self.db_original
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def test_linha_acessivel_como_dicionario_e_tupla(self):
+        despesa = database.listar_despesas_por_periodo("2025-01-01", "2025-01-31")[0]
+        self.assertEqual(despesa['descricao'], despesa.descricao)
+        self.assertEqual(despesa.get('inexistente', 'padrao'), 'padrao')
+        self.assertEqual(dict(despesa)['valor'], 10.0)
+        self.assertEqual(despesa[0], despesa['id'])
+        self.assertIn('id', despesa.keys())
+        self.assertEqual(pickle.loads(pickle.dumps(despesa)), despesa)
+
+    def test_iterador_pausado_nao_prende_a_conexao_da_thread(self):
+        gerador = database.iter_despesas_por_periodo("2025-01-01", "2025-01-31")
+        next(gerador)
+        self.assertIsNone(database._obter_pool().conexao_atual())
+        # A escrita tem sua própria transação e fica visível para outras conexões logo após o commit
+        database.adicionar_despesa("Durante a iteração", 1.0, "2025-02-01")
+        conn = sqlite3.connect(database.DB_FILE)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM despesas WHERE descricao = 'Durante a iteração'").fetchone()[0], 1)
+        conn.close()
+        self.assertEqual(1 + sum(1 for _ in gerador), 1200)
+
+    def test_iterador_abandonado_devolve_a_conexao(self):
+        pool = database._obter_pool()
+        gerador = database.iter_despesas_por_periodo("2025-01-01", "2025-01-31")
+        next(gerador)
+        livres_durante = pool._livres.qsize()
+        referencias = [gerador]
+        del gerador
+        # Finalizado em outra thread: não pode mexer na conexão desta
+        finalizar = threading.Thread(target=lambda: (referencias.clear(), gc.collect()))
+        finalizar.start()
+        finalizar.join()
+        self.assertEqual(pool._livres.qsize(), livres_durante + 1)
+        self.assertIsNone(pool.conexao_atual())
+        self.assertEqual(len(database.listar_despesas_por_periodo("2025-01-01", "2025-01-31")), 1200)
+
+
+if __name__ == "__main__":
+    unittest.main()